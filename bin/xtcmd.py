@@ -0,0 +1,17 @@
+#! /usr/bin/env python
+# Run EditXT text commands on files from the command line. The editxt package
+# must be importable; it is found automatically when this script is run from
+# the EditXT source tree.
+#
+# Example: xtcmd.py -c "sort all" -c "comment_text" *.txt
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.exists(os.path.join(root, "editxt", "__init__.py")):
+    sys.path.insert(0, root)
+
+from editxt.headless import main
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -21,6 +21,7 @@ import glob
 import logging
 import objc
 import os
+from copy import deepcopy
 from itertools import chain, repeat, count
 
 import objc
@@ -33,6 +34,7 @@ import editxt.constants as const
 from editxt.commands import iterlines
 from editxt.config import Config
 from editxt.errorlog import errlog
+from editxt.filewatcher import FileWatcher
 from editxt.textcommand import CommandHistory, TextCommandController
 from editxt.util import (ContextMap, perform_selector,
     atomicfile, dump_yaml, load_yaml)
@@ -61,6 +63,10 @@ class Application(object):
         self.config = Config(self.profile_path)
         self.context = ContextMap()
         self.syntax_factory = None
+        self.file_watcher = FileWatcher()
+        self.editor_states_scheduled = False
+        self.saved_editor_states = {}
+        self.editor_states_scanned = False
         state_dir = os.path.join(self.profile_path, const.STATE_DIR)
         command_history = CommandHistory(state_dir)
         self.text_commander = TextCommandController(command_history)
@@ -351,6 +357,9 @@ class Application(object):
     def save_editor_state(self, editor, ident=None):
         """Save a single editor's state
 
+        The state file is not rewritten if the editor's state has not
+        changed since it was last saved.
+
         :param editor: The editor with state to be saved.
         :param ident: The identifier to use when saving editor state. It
             is assumed that the profile has been setup when this
@@ -361,23 +370,39 @@ class Application(object):
         if ident is None:
             raise NotImplementedError
             ident = editor.id
-        self.setup_profile(editors=True)
         state_name = const.EDITOR_STATE.format(ident)
+        state = editor.state
+        if state_name in self.saved_editor_states \
+                and self.saved_editor_states[state_name] == state:
+            return state_name
+        self.setup_profile(editors=True)
         state_file = os.path.join(
             self.profile_path, const.STATE_DIR, state_name)
-        state = editor.state
         try:
             with atomicfile(state_file, encoding="utf-8") as fh:
                 dump_yaml(state, fh)
         except Exception:
             log.error('cannot write %s\n%s\n', state_file, state, exc_info=True)
+            self.saved_editor_states.pop(state_name, None)
+        else:
+            self.saved_editor_states[state_name] = deepcopy(state)
         return state_name
 
     def save_editor_states(self):
-        """Save all editors' states"""
+        """Save all editors' states
+
+        Only state files of editors whose state changed since the last
+        save are rewritten. The state directory is scanned for existing
+        state files only on the first save; after that the names of
+        saved state files are tracked in memory.
+        """
         state_path = os.path.join(self.profile_path, const.STATE_DIR)
-        old_glob = os.path.join(state_path, const.EDITOR_STATE.format('*'))
-        old = {os.path.basename(name) for name in glob.glob(old_glob)}
+        if not self.editor_states_scanned:
+            old_glob = os.path.join(state_path, const.EDITOR_STATE.format('*'))
+            for name in glob.glob(old_glob):
+                self.saved_editor_states.setdefault(os.path.basename(name), None)
+            self.editor_states_scanned = True
+        old = set(self.saved_editor_states)
         for i, editor in enumerate(self.iter_editors()):
             state_name = self.save_editor_state(editor, i)
             old.discard(state_name)
@@ -385,11 +410,32 @@ class Application(object):
             state_file = os.path.join(state_path, name)
             try:
                 os.remove(state_file)
+            except FileNotFoundError:
+                pass
             except Exception:
+                # forget the file so the error is not logged on every save
                 log.error('cannot remove %s', state_file, exc_info=True)
+            del self.saved_editor_states[name]
+
+    def schedule_save_editor_states(self, delay=1.0):
+        """Save all editors' states after a short delay
+
+        Requests made before the delay expires are coalesced, so saving
+        many documents at once causes editor states to be written once.
+        This must be called on the main thread.
+        """
+        if not self.editor_states_scheduled:
+            self.editor_states_scheduled = True
+            AppHelper.callLater(delay, self._save_scheduled_editor_states)
+
+    def _save_scheduled_editor_states(self):
+        self.editor_states_scheduled = False
+        self.save_editor_states()
 
     def app_will_terminate(self, app):
         self.save_editor_states()
+        self.file_watcher.stop()
+        self.text_commander.history.close()
 
 
 class DocumentController(ak.NSDocumentController):
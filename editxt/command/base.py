@@ -26,7 +26,7 @@ import Foundation as fn
 
 import editxt
 from editxt.command.parser import CommandParser, Options, VarArgs
-from editxt.command.util import make_command_predicate
+from editxt.command.util import iter_command_history
 from editxt.controls.alert import Caller
 from editxt.util import KVOProxy, WeakProperty
 
@@ -96,8 +96,7 @@ def command(func=None, name=None, title=None, hotkey=None,
 
 
 def load_options(command, history):
-    predicate = make_command_predicate(command)
-    argstr = next(history.iter_matching(predicate), None)
+    argstr = next(iter_command_history(command, history), None)
     if argstr is not None:
         try:
             return command.parse(argstr)
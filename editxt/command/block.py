@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Rectangular (column) block editing
+
+A block is a range of lines and a range of display columns on each of
+those lines. Tabs advance to the next multiple of the tab size (the
+indent size of the document) when columns are computed. A linear
+selection is treated as a block with corners at the start and end of
+the selection. Rectangular selections made in the text view (one range
+per line) are also supported.
+
+All lines of a block are edited with a single batched edit (see
+`editxt.command.util.apply_edits`).
+"""
+import logging
+from array import array
+
+import AppKit as ak
+
+from editxt.command.base import command, CommandError
+from editxt.command.parser import CommandParser, String, SubArgs, SubParser
+from editxt.command.util import (Lines, apply_edits, line_offsets,
+    line_range, select_ranges, selected_ranges, view_offsets)
+
+log = logging.getLogger(__name__)
+
+EOL_CHARS = "\r\n\u2028"
+
+
+@command(name="block", arg_parser=CommandParser(SubParser("action",
+    SubArgs("insert", String("text", default="")),
+    SubArgs("replace", String("text", default="")),
+    SubArgs("delete"),
+    SubArgs("copy"),
+    SubArgs("paste"),
+)))
+def block_edit(textview, sender, args):
+    """Edit a rectangular block of text
+
+    - insert TEXT: insert text at the left edge of the block.
+    - replace TEXT: replace the block with text on each line.
+    - delete: delete the block.
+    - copy: copy the block to the pasteboard (one line per row).
+    - paste: replace the block with lines from the pasteboard.
+    """
+    if args is None or args.action is None:
+        raise CommandError("nothing to do")
+    sub, opts = args.action
+    block = Block.from_textview(textview)
+    if sub.name == "copy":
+        eol = textview.doc_view.document.eol
+        save_to_pasteboard(eol.join(block.strings()))
+    elif sub.name == "paste":
+        text = load_pasteboard_string()
+        if text is None:
+            raise CommandError("nothing to paste")
+        edit_block(textview, block, text.splitlines() or [""])
+    elif sub.name == "delete":
+        edit_block(textview, block, [""])
+    else:
+        edit_block(textview, block, [opts.text], insert=(sub.name == "insert"))
+
+
+def edit_block(textview, block, strings, insert=False):
+    """Replace the cells of a block, or insert text before them
+
+    Lines that are shorter than the left edge of the block are padded
+    with spaces when text is added to them. The resulting block is
+    selected after the edit.
+
+    :param textview: The text view.
+    :param block: A `Block`.
+    :param strings: A list of strings, one per row of the block. The
+    list is repeated if it has fewer items than the block has rows.
+    :param insert: Insert strings at the left edge of the block rather
+    than replacing the contents of the block.
+    """
+    offsets = view_offsets(textview, block.lines.text)
+    edits = []
+    ranges = []
+    shift = 0
+    for i, (offset, length, pad) in enumerate(block.cells()):
+        string = strings[i % len(strings)]
+        if insert:
+            length = 0
+        if string and pad:
+            edits.append((offset, length, " " * pad + string))
+            offset += pad
+        else:
+            edits.append((offset, length, string))
+            pad = 0
+        ranges.append((offset + shift, len(string)))
+        shift += pad + len(string) - length
+    if apply_edits(textview, offsets.utf16_edits(edits)) is not None:
+        offsets = view_offsets(textview, textview.string())
+        select_ranges(textview, [offsets.utf16_range(r) for r in ranges])
+
+
+def load_pasteboard_string():
+    """Get the string value of the general pasteboard or `None`"""
+    pboard = ak.NSPasteboard.generalPasteboard()
+    if pboard.availableTypeFromArray_([ak.NSStringPboardType]):
+        return pboard.stringForType_(ak.NSStringPboardType)
+    return None
+
+
+def save_to_pasteboard(text):
+    """Save the given text to the general pasteboard"""
+    pboard = ak.NSPasteboard.generalPasteboard()
+    pboard.declareTypes_owner_([ak.NSStringPboardType], None)
+    pboard.setString_forType_(text, ak.NSStringPboardType)
+
+
+def text_width(text, tab_size):
+    """Get the number of display columns occupied by a string of text
+
+    The text is assumed to begin at column zero.
+    """
+    if "\t" not in text:
+        return len(text)
+    column = 0
+    for char in text:
+        if char == "\t":
+            column += tab_size - column % tab_size
+        else:
+            column += 1
+    return column
+
+
+def column_offset(line, column, tab_size):
+    """Get the offset of a display column in a line
+
+    :param line: A line of text without a line ending.
+    :param column: Display column.
+    :param tab_size: Number of columns per tab stop.
+    :returns: A tuple `(offset, start_column)`: the offset of the first
+    character that begins at or after `column` and the column where it
+    begins. If the line ends before `column` the offset is the length
+    of the line and the column is the width of the line.
+    """
+    if "\t" not in line:
+        offset = min(column, len(line))
+        return offset, offset
+    current = 0
+    for offset, char in enumerate(line):
+        if current >= column:
+            return offset, current
+        if char == "\t":
+            current += tab_size - current % tab_size
+        else:
+            current += 1
+    return len(line), current
+
+
+class Block(object):
+    """A rectangular block of text
+
+    :param lines: `Lines` of the block.
+    :param start: The left edge (display column) of the block.
+    :param end: The right edge (display column) of the block.
+    :param tab_size: Number of columns per tab stop.
+    """
+
+    def __init__(self, lines, start, end, tab_size):
+        self.lines = lines
+        self.start = start
+        self.end = end
+        self.tab_size = tab_size
+
+    @classmethod
+    def from_textview(cls, textview):
+        tab_size = textview.doc_view.document.indent_size
+        if hasattr(textview, "selectedRanges"):
+            ranges = selected_ranges(textview)
+        else:
+            ranges = [tuple(textview.selectedRange())]
+        text = textview.string()
+        offsets = view_offsets(textview, text)
+        ranges = [offsets.char_range(r) for r in ranges]
+        return cls.from_ranges(text, ranges, tab_size)
+
+    @classmethod
+    def from_ranges(cls, text, ranges, tab_size):
+        """Create a block from selected ranges
+
+        :param text: The text.
+        :param ranges: A list of `(location, length)` character ranges
+        sorted by location. A single range is a block with corners at the start
+        and end of the range. Multiple ranges (a rectangular selection)
+        define a block spanning all of them.
+        """
+        first = ranges[0][0]
+        last = ranges[-1][0] + ranges[-1][1]
+        lines_range = line_range(text, (first, last - first))
+        offsets = line_offsets(text, lines_range)
+        if len(offsets) == 1:
+            # empty last line
+            offsets = array("l", [lines_range[0], lines_range[0]])
+        lines = Lines(text, offsets)
+
+        def column(offset):
+            index = lines.line_index(offset)
+            return text_width(text[offsets[index]:offset], tab_size)
+
+        if len(ranges) == 1:
+            start, end = sorted([column(first), column(last)])
+        else:
+            start = min(column(r[0]) for r in ranges)
+            end = max(column(r[0] + r[1]) for r in ranges)
+        return cls(lines, start, end, tab_size)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def cells(self):
+        """Generate the location of the block on each line
+
+        :yields: `(offset, length, padding)` tuples. `padding` is the
+        number of columns between the end of a line and the left edge
+        of the block (zero unless the line is shorter than that).
+        """
+        start, end, tab_size = self.start, self.end, self.tab_size
+        for line_start, line in zip(self.lines.offsets, self.lines):
+            content = line.rstrip(EOL_CHARS)
+            if "\t" not in content:
+                # fast path: one column per character
+                size = len(content)
+                begin = start if start < size else size
+                finish = end if end < size else size
+                yield line_start + begin, finish - begin, start - begin
+                continue
+            begin, column = column_offset(content, start, tab_size)
+            if end > start and begin < len(content):
+                finish = column_offset(content, end, tab_size)[0]
+            else:
+                finish = begin
+            yield line_start + begin, finish - begin, max(start - column, 0)
+
+    def strings(self):
+        """Get a list of the text of the block on each line"""
+        text = self.lines.text
+        return [text[offset:offset + length]
+                for offset, length, pad in self.cells()]
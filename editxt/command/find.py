@@ -30,7 +30,8 @@ import editxt
 import editxt.constants as const
 from editxt.command.base import command, CommandError, objc_delegate, PanelController
 from editxt.command.parser import Choice, Regex, RegexPattern, CommandParser, Options
-from editxt.command.util import make_command_predicate
+from editxt.command.util import (iter_command_history, select_ranges,
+    selected_ranges)
 from editxt.util import KVOProxy, KVOLink
 
 log = logging.getLogger(__name__)
@@ -61,6 +62,8 @@ WORD = "word"
         ('replace-all all', 'replace_all'),
         ('replace-in-selection in-selection selection', 'replace_all_in_selection'),
         ('count-occurrences highlight', 'count_occurrences'),
+        ('multi-next', 'select_next'),
+        ('multi-all', 'select_all'),
         name='action'),
     Choice('regex literal word python-replace', name='search_type'),
     Choice(('wrap', True), ('no-wrap', False), name='wrap_around'),
@@ -173,8 +176,7 @@ class FindOptions(Options):
     @property
     def recent_finds(self):
         # HACK global resource
-        predicate = make_command_predicate(find)
-        items = editxt.app.text_commander.history.iter_matching(predicate)
+        items = iter_command_history(find, editxt.app.text_commander.history)
         result = []
         for i, item in enumerate(items):
             if i < 10:
@@ -229,6 +231,49 @@ class Finder(object):
             self.options.find_text, self.options.regular_expression)
         return "Found {} occurrence{}".format(num, ("" if num == 1 else "s"))
 
+    def select_next(self, sender):
+        """Add a selection (caret) at the next occurrence of the find text
+
+        The search starts after the last selected range.
+        """
+        target = self.find_target()
+        ftext = self.options.find_text
+        if target is not None and ftext:
+            ranges = selected_ranges(target)
+            last = fn.NSMakeRange(*max(ranges))
+            range = self._find(target, ftext, last, FORWARD)
+            if range is not None:
+                range = tuple(range)
+                if range not in ranges:
+                    select_ranges(target, sorted(ranges + [range]))
+                    target.scrollRangeToVisible_(range)
+                    return
+        ak.NSBeep()
+
+    def select_all(self, sender):
+        """Select all occurrences of the find text (one caret per match)"""
+        target = self.find_target()
+        ftext = self.options.find_text
+        if target is not None and ftext:
+            options = self.options
+            if options.regular_expression:
+                finditer = self.regexfinditer
+            elif options.match_entire_word:
+                ftext = "\\b" + re.escape(ftext) + "\\b"
+                finditer = self.regexfinditer
+            else:
+                finditer = self.simplefinditer
+            text = target.string()
+            full_range = fn.NSMakeRange(0, len(text))
+            ranges = [tuple(found.range) for found in
+                      finditer(text, ftext, full_range, FORWARD, False)]
+            if ranges:
+                select_ranges(target, ranges)
+                target.scrollRangeToVisible_(ranges[0])
+                return "Selected {} occurrence{}".format(
+                    len(ranges), ("" if len(ranges) == 1 else "s"))
+        ak.NSBeep()
+
     def mark_occurrences(self, ftext, regex=False, color=None):
         """Mark occurrences of ftext in target
 
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Whitespace normalization command and save hook"""
+import logging
+
+from editxt.command.base import command
+from editxt.command.parser import Choice, CommandParser, Options
+from editxt.command.util import (edit_text, indent_normalizer,
+    whitespace_edits)
+
+log = logging.getLogger(__name__)
+
+
+@command(name="normalize", title="Normalize Whitespace",
+    arg_parser=CommandParser(
+        Choice(("indent", True), ("no-indent", False)),
+        Choice(("newlines", True), ("no-newlines", False)),
+        Choice(("strip", True), ("no-strip", False)),
+        Choice(("final-newline", True), ("no-final-newline", False),
+            name="final_newline"),
+    ))
+def normalize_whitespace(textview, sender, args):
+    """Normalize indentation, line endings and trailing whitespace
+
+    Indentation is converted to the indent mode and size of the
+    document, and line endings are converted to the newline mode of
+    the document.
+    """
+    if args is None:
+        args = normalize_whitespace.arg_parser.default_options()
+    normalize_text(textview, args)
+
+
+def normalize_text(textview, options):
+    """Normalize whitespace in the entire text of a text view
+
+    Only changed whitespace is replaced (see `whitespace_edits`).
+
+    :param textview: The text view.
+    :param options: Options with `indent`, `newlines`, `strip` and
+    `final_newline` attributes.
+    :returns: True if the text was changed.
+    """
+    document = textview.doc_view.document
+    text = textview.string()
+    edits = whitespace_edits(text,
+        indent=(indent_normalizer(document.indent_mode, document.indent_size)
+                if options.indent else None),
+        eol=document.eol if options.newlines else None,
+        strip=options.strip,
+        final_newline=options.final_newline,
+    )
+    return edit_text(textview, text, edits)
+
+
+def save_options(config):
+    """Get whitespace normalization options to be applied on save
+
+    :param config: The application config.
+    :returns: Options for `normalize_text` or `None` if whitespace
+    should not be normalized on save.
+    """
+    options = Options(
+        indent=config["on_save.normalize_indent"],
+        newlines=config["on_save.normalize_newlines"],
+        strip=config["on_save.strip_trailing_whitespace"],
+        final_newline=config["on_save.ensure_final_newline"],
+    )
+    if any(value for key, value in options):
+        return options
+    return None
@@ -60,8 +60,11 @@ Command parser specification:
         ' /abc/'    : bool = None, regex = 'abc', num = None
         '  1'  : bool = False, regex = None, num = 1
 """
+import os
 import re
 
+from editxt.dircache import DirectoryCache
+
 
 class CommandParser(object):
     """Text command parser
@@ -71,6 +74,7 @@ class CommandParser(object):
 
     def __init__(self, *argspec):
         self.argspec = argspec
+        self.placeholder_state = None
         # TODO assert no duplicate arg names
 
     def match(self, text, index=0):
@@ -84,6 +88,27 @@ class CommandParser(object):
             return False
         return True
 
+    def get_start_chars(self):
+        """Get character classes that may begin a match of this parser
+
+        See ``Field.get_start_chars`` for details.
+        """
+        return self.argspec[0].get_start_chars()
+
+    def match_token(self, text, index=0):
+        """Check if first argument can consume a complete token at index
+
+        :returns: A tuple ``(matched, terminated)``. ``terminated`` is
+        true if the first argument matched a token that is followed by
+        a space, which means that text appended to ``text`` will not
+        change the match.
+        """
+        try:
+            token, end, terminated = self.argspec[0].parse_token(text, index)
+        except (ParseError, ArgumentError):
+            return False, False
+        return True, terminated and end < len(text)
+
     def parse(self, text, index=0):
         """Parse arguments from the given text
 
@@ -120,20 +145,39 @@ class CommandParser(object):
     def get_placeholder(self, text):
         """Get placeholder string to follow the given command text
 
+        Parsing resumes after the last argument that was consumed by
+        the previous call if ``text`` starts with the previous text and
+        that argument was terminated by a space before the end of the
+        previous text, since appending more text cannot change it. This
+        avoids re-parsing the entire command on every keystroke.
+
         :param text: Argument string.
         :returns: A string of placeholder text, which can be used as a
             hint about remaining arguments to be entered.
         """
-        index = 0
+        state = self.placeholder_state
+        if state is not None and text.startswith(state[0]):
+            start, index = state[1]
+        else:
+            start, index = 0, 0
+        resume = (start, index)
+        stable = True
         values = []
-        for arg in self.argspec:
-            value, next_index = arg.get_placeholder(text, index)
+        for i in range(start, len(self.argspec)):
+            value, next_index = self.argspec[i].get_placeholder(text, index)
             if next_index is None:
                 assert value is None, value
+                stable = False
                 continue
+            if stable and value is None and index < next_index < len(text) \
+                    and text[next_index - 1] == " ":
+                resume = (i + 1, next_index)
+            else:
+                stable = False
             index = next_index
             if value is not None:
                 values.append(value)
+        self.placeholder_state = (text, resume)
         return " ".join(values)
 
     def get_completions(self, text):
@@ -178,6 +222,35 @@ class CommandParser(object):
 
 
 IDENTIFIER_PATTERN = re.compile('^[a-zA-Z_][a-zA-Z0-9_]*$')
+ESCAPE_SEQUENCE = re.compile(r"\\(.)", re.DOTALL)
+_scanners = {}
+
+def scanner(delim):
+    """Get a compiled pattern that matches text up to an unescaped delimiter
+
+    The pattern matches characters other than ``delim`` and backslash
+    escape sequences. The match ends before the first unescaped
+    ``delim`` or before a backslash at the end of the text.
+    """
+    try:
+        return _scanners[delim]
+    except KeyError:
+        pattern = r"[^\\{0}]*(?:\\.[^\\{0}]*)*".format(re.escape(delim))
+        value = _scanners[delim] = re.compile(pattern, re.DOTALL)
+        return value
+
+def char_class(char):
+    """Get the character class of the given character
+
+    Decimal digits are all in the class "0" and whitespace characters
+    other than space are in the class "\\t". Other characters are in a
+    class of their own.
+    """
+    if char.isdecimal():
+        return "0"
+    if char != " " and char.isspace():
+        return "\t"
+    return char
 
 def identifier(name):
     ident = name.replace('-', '_')
@@ -196,6 +269,7 @@ class Field(object):
             self.placeholder = name
         self.name = identifier(name)
         self.default = default
+        self.parsed_tokens = (None, {})
 
     def __eq__(self, other):
         if not issubclass(type(self), type(other)):
@@ -237,6 +311,19 @@ class Field(object):
         """
         raise NotImplementedError("abstract method")
 
+    def get_start_chars(self):
+        """Get character classes that may begin this argument
+
+        This is used to quickly rule out arguments that cannot consume
+        a given string. A leading space is included in the result if
+        the argument would use its default value when the text begins
+        with a space.
+
+        :returns: A set of character classes (see ``char_class``) or
+        ``None`` if this argument may begin with any character.
+        """
+        return None
+
     def consume_token(self, text, index):
         """Helper method that consumes one token from text starting at index
 
@@ -276,14 +363,32 @@ class Field(object):
         whether the token has been terminated, meaning that additional
         text beyond ``index`` would be a separate argument.
         :raises: See ``consume``.
+
+        Results are cached for the most recently parsed text since
+        placeholders, completions and command lookup all parse the same
+        command text after each keystroke.
         """
-        value, end = self.consume(text, index)
+        parsed_text, tokens = self.parsed_tokens
+        if parsed_text != text:
+            tokens = {}
+            self.parsed_tokens = (text, tokens)
+        elif index in tokens:
+            result = tokens[index]
+            if isinstance(result, Error):
+                raise result.with_traceback(None)
+            return result
+        try:
+            value, end = self.consume(text, index)
+        except (ParseError, ArgumentError) as err:
+            tokens[index] = err
+            raise
         terminated = (
             index < end and         # token exists
             end <= len(text) and    # would not consume more
             text[end - 1] == " "    # space between tokens
         )
-        return text[index:end], end, terminated
+        result = tokens[index] = (text[index:end], end, terminated)
+        return result
 
     def get_placeholder(self, text, index):
         """Get placeholder string for this argument
@@ -445,6 +550,9 @@ class Choice(Field):
             msg = '{!r} does not match any of: {}'.format(token, names)
         raise ParseError(msg, self, index, end)
 
+    def get_start_chars(self):
+        return {char_class(name[0]) for name in self.mapping} | {" "}
+
     def get_placeholder(self, text, index):
         if index >= len(text):
             return str(self), index
@@ -494,6 +602,9 @@ class Int(Field):
         except (ValueError, TypeError) as err:
             raise ParseError(str(err), self, index, end)
 
+    def get_start_chars(self):
+        return {"0", "+", "-", " ", "\t"}
+
     def get_placeholder(self, text, index):
         if index >= len(text):
             if isinstance(self.default, int):
@@ -537,31 +648,34 @@ class String(Field):
         else:
             delim = text[index]
             start = index + 1
-        chars, esc = [], 0
-        escapes = self.ESCAPES
-        for i, c in enumerate(text[start:]):
-            if esc:
-                esc = 0
-                try:
-                    chars.append(escapes[c])
-                    continue
-                except KeyError:
-                    chars.append('\\')
-            elif c == delim:
-                if delim != ' ' and text[start + i + 1:start + i + 2] == ' ':
-                    start += 1 # consume trailing space
-                return ''.join(chars), start + i + 1
-            if c == '\\':
-                esc = 1
-            else:
-                chars.append(c)
+        end = scanner(delim).match(text, start).end()
+        if end < len(text) and text[end] == delim:
+            value = self.unescape(text[start:end])
+            end += 1
+            if delim != ' ' and text[end:end + 1] == ' ':
+                end += 1 # consume trailing space
+            return value, end
+        if end == len(text) and delim == ' ':
+            return self.unescape(text[start:]), len(text) # FIXME? should add one to index?
         if delim == ' ':
-            if not esc:
-                return ''.join(chars), len(text) # FIXME? should add one to index?
             delim = ''
         msg = 'unterminated string: {}{}'.format(delim, text[start:])
         raise ParseError(msg, self, index, len(text))
 
+    @classmethod
+    def unescape(cls, value):
+        """Replace escape sequences in value
+
+        Unknown escape sequences are left unchanged.
+        """
+        if "\\" not in value:
+            return value
+        escapes = cls.ESCAPES
+        def unescape(match):
+            char = match.group(1)
+            return escapes.get(char, "\\" + char)
+        return ESCAPE_SEQUENCE.sub(unescape, value)
+
     def arg_string(self, value):
         if value == self.default:
             return ""
@@ -575,6 +689,61 @@ class String(Field):
             return Regex.delimit(value, delimiters=""""'""")[0]
         return value
 
+class File(String):
+    """A file path argument type
+
+    Completions are names of entries in the directory of the (partial)
+    path being completed. Directory listings are read in the background
+    and cached (see ``editxt.dircache``), so completion does not block
+    on slow file systems; it may be incomplete while a large directory
+    is being read. Spaces in unquoted paths may be escaped with a
+    backslash.
+
+    :param name: Argument name.
+    :param directory: Base directory of relative paths. This may be a
+    callable returning a directory path. Defaults to the user's home
+    directory.
+    :param default: Default value.
+    """
+
+    ESCAPES = dict(String.ESCAPES, **{" ": " "})
+    cache = DirectoryCache()
+
+    def __init__(self, name, directory=None, default=None):
+        self.args = [name, directory, default]
+        self.directory = directory
+        super(File, self).__init__(name, default)
+
+    def get_directory(self, path=""):
+        """Get the absolute path of a (relative) directory path"""
+        path = os.path.expanduser(path)
+        if not os.path.isabs(path):
+            base = self.directory
+            if callable(base):
+                base = base()
+            if base is None:
+                base = os.path.expanduser("~")
+            path = os.path.join(base, path)
+        return os.path.normpath(path)
+
+    def get_completions(self, token):
+        """List names of directory entries that complete token
+
+        Hidden entries are only listed if the name being completed
+        starts with a dot.
+        """
+        delim = token[0] if token and token[0] in "\"'" else ""
+        dirname, prefix = os.path.split(self.unescape(token[len(delim):]))
+        names, complete = self.cache.get(self.get_directory(dirname))
+        hidden = prefix.startswith(".")
+        names = [n for n in names
+            if n.startswith(prefix) and (hidden or not n.startswith("."))]
+        if delim:
+            return [n.replace("\\", "\\\\").replace(delim, "\\" + delim)
+                    for n in names]
+        return [n.replace("\\", "\\\\").replace(" ", "\\ ") for n in names]
+
+
 class VarArgs(Field):
     """Consume all remaining arguments by splitting the string"""
 
@@ -682,22 +851,12 @@ class Regex(Field):
 
     def consume_expression(self, text, index):
         delim = text[index]
-        chars, esc = [], 0
-        i = -1
-        for i, c in enumerate(text[index + 1:]):
-            if esc:
-                esc = 0
-                chars.append(c)
-                continue
-            elif c == delim:
-                return ''.join(chars), index + i + 2
-            chars.append(c)
-            if c == '\\':
-                esc = 1
-        if not esc:
-            return ''.join(chars), index + i + 3
-        token = ''.join(chars)
-        msg = 'unterminated regex: {}{}'.format(delim, token)
+        end = scanner(delim).match(text, index + 1).end()
+        if end < len(text) and text[end] == delim:
+            return text[index + 1:end], end + 1
+        if end == len(text):
+            return text[index + 1:], len(text) + 1
+        msg = 'unterminated regex: {}{}'.format(delim, text[index + 1:])
         raise ParseError(msg, self, index, len(text))
 
     def consume_flags(self, text, index):
@@ -716,6 +875,9 @@ class Regex(Field):
             index += 1
         return value, index
 
+    def get_start_chars(self):
+        return set(self.DELIMITERS)
+
     def get_placeholder(self, text, index):
         if index >= len(text):
             return str(self), index
@@ -852,6 +1014,9 @@ class SubParser(Field):
             raise
         return (sub, opts), len(text)
 
+    def get_start_chars(self):
+        return {char_class(name[0]) for name in self.subargs} | {" "}
+
     def get_placeholder(self, text, index):
         if index >= len(text):
             return "{} ...".format(self), index
@@ -907,6 +1072,8 @@ class SubParser(Field):
         return [n for n in sorted(self.subargs) if n.startswith(token)]
 
     def arg_string(self, value):
+        if value == self.default:
+            return ""
         sub, opts = value
         return sub.name + " " + sub.parser.arg_string(opts, strip=False)
 
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Run scripts of command bar commands
+
+A script is a text file containing one command per line using the same
+syntax as the command bar. Blank lines and lines beginning with ``#``
+are ignored. All commands are parsed before any of them are run, and
+then the commands are run on each text view as a single undoable edit.
+"""
+import logging
+import os
+
+from editxt.command.base import command, CommandError
+from editxt.command.parser import CommandParser, File
+from editxt.command.util import current_directory, resolve_path
+
+log = logging.getLogger(__name__)
+
+# Real paths of scripts that are running (used to detect recursion)
+_running_scripts = set()
+
+
+@command(name='run', arg_parser=CommandParser(
+    File("script", directory=current_directory)))
+def run_script_file(textview, sender, args):
+    """Run a script of commands on the current document"""
+    if args is None or not args.script:
+        raise CommandError("please specify a script to run")
+    path = os.path.realpath(resolve_path(args.script, textview))
+    if path in _running_scripts:
+        raise CommandError("script is already running: {}".format(args.script))
+    try:
+        with open(path, encoding="utf-8") as fh:
+            text = fh.read()
+    except (IOError, UnicodeDecodeError) as err:
+        raise CommandError("cannot read script: {}".format(err))
+    commander = getattr(sender, "text_commander", None)
+    if commander is None:
+        from editxt import app
+        commander = app.text_commander
+    commands = parse_script(text, commander)
+    _running_scripts.add(path)
+    try:
+        run_script(commands, [textview], sender)
+    finally:
+        _running_scripts.discard(path)
+    return "ran {} commands from {}".format(len(commands), args.script)
+
+
+def parse_script(text, text_commander):
+    """Parse command lines of a script
+
+    :param text: Script text.
+    :param text_commander: ``TextCommandController`` used to lookup
+    commands.
+    :returns: A list of ``(line_number, command, args)`` tuples.
+    :raises: ``CommandError`` if a line cannot be parsed.
+    """
+    commands = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        try:
+            command, args = text_commander.parse(line)
+        except CommandError as err:
+            raise CommandError("line {}: {}".format(number, err))
+        commands.append((number, command, args))
+    return commands
+
+
+def run_script(commands, textviews, sender=None):
+    """Run parsed commands on text views
+
+    The commands are run on each text view as a single undoable edit,
+    and text storage processing (layout, highlighting) is deferred until
+    all commands have been run on a view.
+
+    :param commands: A list of commands returned by ``parse_script``.
+    :param textviews: A list of text views.
+    :param sender: Sender passed to each command.
+    :raises: ``CommandError`` if a command fails. Commands that were run
+    before the failure are not undone.
+    """
+    for textview in textviews:
+        undo_manager = textview.undoManager()
+        undo_manager.beginUndoGrouping()
+        text_storage = textview.textStorage()
+        text_storage.beginEditing()
+        try:
+            for number, command, args in commands:
+                try:
+                    command(textview, sender, args)
+                except CommandError as err:
+                    raise CommandError("line {}: {}".format(number, err))
+                except Exception:
+                    log.error("line %s: error in command: %s",
+                        number, command, exc_info=True)
+                    raise CommandError("line {}: error in command: {}"
+                        .format(number, command.name))
+        finally:
+            text_storage.endEditing()
+            undo_manager.setActionName_("Run Script")
+            undo_manager.endUndoGrouping()
@@ -17,20 +17,50 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import heapq
 import logging
+import multiprocessing
 import objc
 import os
+import pickle
 import re
 import time
+from array import array
+from functools import partial
+from itertools import islice
+from tempfile import mkstemp
 
 import editxt.constants as const
-from editxt.command.base import command, objc_delegate, SheetController
-from editxt.command.parser import (Choice, Regex, RegexPattern, CommandParser,
-    Options)
+from editxt.command.base import (command, objc_delegate, CommandError,
+    SheetController)
+from editxt.command.block import Block, column_offset
+from editxt.command.parser import (Choice, Int, Regex, RegexPattern, String,
+    CommandParser, Options, SubArgs, SubParser)
 from editxt.commands import iterlines
 
 log = logging.getLogger(__name__)
 
+# Selections larger than this (characters) are sorted with external_sort
+EXTERNAL_SORT_SIZE = 32 * 1024 * 1024
+# Number of lines per sorted run spilled to disk by external_sort
+RUN_SIZE = 200000
+# Number of (key, line) items per pickle record in a run file
+RUN_BATCH_SIZE = 1000
+
+# sort orders
+TEXT = "text"
+NUMERIC = "numeric"
+NATURAL = "natural"
+
+# duplicate line handling
+KEEP = "keep"
+UNIQUE = "unique"
+COUNT = "count"
+
+NUMBER = re.compile(r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?")
+DIGITS = re.compile(r"(\d+)")
+EOL_CHARS = "\r\n\u2028"
+
 
 @command(name='sort', title="Sort Lines...",
     arg_parser=CommandParser(
@@ -44,6 +74,21 @@ log = logging.getLogger(__name__)
             ('ignore-case', True),
             ('match-case', False)),
         Regex('sort-regex', True),
+        Choice(
+            ('text', TEXT),
+            ('numeric', NUMERIC),
+            ('natural version', NATURAL),
+            name='order'),
+        Choice(
+            ('keep-duplicates', KEEP),
+            ('unique', UNIQUE),
+            ('count', COUNT),
+            name='duplicates'),
+        SubParser("key",
+            SubArgs("field", Int("number", default=1), String("delimiter")),
+            SubArgs("column", Int("start", default=1), Int("end")),
+            SubArgs("block"),
+        ),
     ))
 def sort_lines(textview, sender, args):
     if args is None:
@@ -60,12 +105,21 @@ class SortOptions(Options):
         reverse=False,
         ignore_leading_whitespace=False,
         ignore_case=True,
-        numeric_match=False,
+        order=TEXT,
+        duplicates=KEEP,
+        key=None,
         regex_sort=False,
         search_pattern="",
         match_pattern="",
     )
 
+    @property
+    def numeric_match(self):
+        return self.order == NUMERIC
+    @numeric_match.setter
+    def numeric_match(self, value):
+        self.order = NUMERIC if value else TEXT
+
     @property
     def sort_regex(self):
         if self.regex_sort:
@@ -94,39 +148,384 @@ class SortLinesController(SheetController):
 
 def sortlines(textview, opts):
     text = textview.string()
-    if opts.sort_regex[0]:
-        regex = re.compile(opts.sort_regex[0], flags=opts.sort_regex[0].flags)
-        if opts.sort_regex[1]:
-            groups = [int(g.strip()) for g in opts.sort_regex[1].split("\\") if g.strip()]
-        else:
-            groups = None
+    block = None
+    if opts.key is not None and opts.key[0].name == "block":
+        block = Block.from_textview(textview)
+        block = (block.start, block.end, block.tab_size)
+    key = SortKey(opts, block)
+    if opts.selection:
+        range = text.lineRangeForRange_(textview.selectedRange())
     else:
-        regex = None
-    def key(line):
-        if opts.ignore_leading_whitespace:
+        range = (0, len(text))
+    lines = iterlines(text, range)
+    eol = missing_eol(text, range)
+    if eol:
+        lines = end_last_line(lines, eol)
+    if range[1] > EXTERNAL_SORT_SIZE:
+        pool = multiprocessing.Pool()
+        try:
+            items = external_sort(lines, key, opts.reverse, pool=pool,
+                                  with_keys=True)
+            output = join_sorted(items, opts.duplicates)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        lines = list(lines)
+        keys, order = sort_order(lines, key, opts.reverse)
+        if opts.duplicates == KEEP:
+            output = "".join([lines[i] for i in order])
+        else:
+            items = ((keys[i], lines[i]) for i in order)
+            output = join_sorted(items, opts.duplicates)
+    if eol and output.endswith(eol):
+        output = output[:-len(eol)]
+    if textview.shouldChangeTextInRange_replacementString_(range, output):
+        textview.textStorage().replaceCharactersInRange_withString_(range, output)
+        textview.didChangeText()
+        if opts.selection:
+            textview.setSelectedRange_((range[0], len(output)))
+
+
+def missing_eol(text, range):
+    """Get the line ending missing from the last line of a range of text
+
+    :returns: The line ending of the second to last line in range if the
+    last line has no line ending, otherwise an empty string.
+    """
+    start, end = range[0], range[0] + range[1]
+    if end == start or text[end - 1] in EOL_CHARS:
+        return ""
+    index = max(text.rfind(char, start, end) for char in EOL_CHARS)
+    if index < 0:
+        return ""
+    if text[index] == "\n" and index > start and text[index - 1] == "\r":
+        return "\r\n"
+    return text[index]
+
+
+def end_last_line(lines, eol):
+    """Generate lines, adding eol to the last line
+
+    A sorted line must end with a line ending so it is not joined to the
+    line after it.
+    """
+    last = None
+    for line in lines:
+        if last is not None:
+            yield last
+        last = line
+    if last is not None:
+        yield last + eol
+
+
+class SortKey(object):
+    """Sort key function for lines
+
+    This is a class rather than a closure so it can be pickled and sent
+    to worker processes.
+
+    :param opts: Sort options.
+    :param block: A `(start, end, tab_size)` tuple of display columns
+    used as the sort key when the key option is "block". The key extends
+    to the end of each line if `start == end`.
+    """
+
+    def __init__(self, opts, block=None):
+        self.ignore_leading_whitespace = opts.ignore_leading_whitespace
+        self.ignore_case = opts.ignore_case
+        self.order = opts.order
+        self.regex = self.groups = None
+        if opts.sort_regex[0]:
+            self.regex = re.compile(
+                opts.sort_regex[0], flags=opts.sort_regex[0].flags)
+            if opts.sort_regex[1]:
+                self.groups = [int(g.strip())
+                    for g in opts.sort_regex[1].split("\\") if g.strip()]
+        self.field = self.delimiter = self.columns = self.block = None
+        if opts.key is not None:
+            sub, args = opts.key
+            if sub.name == "field":
+                if args.number < 1:
+                    raise CommandError("invalid field number: {}"
+                                       .format(args.number))
+                self.field = args.number
+                self.delimiter = args.delimiter or None
+            elif sub.name == "block":
+                self.block = block
+            else:
+                if args.start < 1 or (args.end is not None
+                                      and args.end < args.start):
+                    raise CommandError("invalid column range: {} {}"
+                                       .format(args.start, args.end))
+                self.columns = (args.start - 1, args.end)
+
+    def __call__(self, line):
+        key = self.text_key(line)
+        if self.order == NUMERIC:
+            return numeric_key(key)
+        if self.order == NATURAL:
+            return natural_key(key)
+        return key
+
+    def text_key(self, line):
+        """Get the text sort key for a line
+
+        This is the sort key for the `TEXT` order.
+        """
+        if self.field is not None:
+            if self.delimiter is None:
+                fields = line.split()
+            else:
+                fields = line.rstrip(EOL_CHARS).split(self.delimiter)
+            line = fields[self.field - 1] if len(fields) >= self.field else ""
+        elif self.columns is not None:
+            line = line.rstrip(EOL_CHARS)[self.columns[0]:self.columns[1]]
+        elif self.block is not None:
+            start, end, tab_size = self.block
+            line = line.rstrip(EOL_CHARS)
+            begin = column_offset(line, start, tab_size)[0]
+            if end > start:
+                line = line[begin:column_offset(line, end, tab_size)[0]]
+            else:
+                line = line[begin:]
+        if self.ignore_leading_whitespace:
             line = line.lstrip()
-        if opts.ignore_case:
+        if self.ignore_case:
             line = line.lower()
-        if regex is not None:
-            match = regex.search(line)
+        if self.regex is not None:
+            match = self.regex.search(line)
             if match is None:
                 line = (1,)
             elif not match.groups():
                 line = (0, match.group(0))
             else:
                 matched = match.groups("")
-                if groups:
+                if self.groups:
                     matched = dict(enumerate(matched))
-                    matched = tuple(matched.get(g - 1, "") for g in groups)
+                    matched = tuple(matched.get(g - 1, "") for g in self.groups)
                 line = (0,) + matched
         return line
-    if opts.selection:
-        range = text.lineRangeForRange_(textview.selectedRange())
+
+
+def number(text):
+    """Get the value of the first number in text
+
+    :returns: A float; negative infinity if there is no number in text.
+    """
+    match = NUMBER.search(text)
+    return float(match.group()) if match is not None else float("-inf")
+
+
+def numeric_key(key):
+    """Convert a text key to a numeric key
+
+    Text is ordered by its first number, and then by the text itself.
+    """
+    if isinstance(key, tuple):
+        return tuple(numeric_key(value) if isinstance(value, str) else value
+                     for value in key)
+    return (number(key), key)
+
+
+def natural_key(key):
+    """Convert a text key to a natural (version) order key
+
+    Runs of digits are compared by their numeric value, so "v2" sorts
+    before "v10". Text that differs only in leading zeros is ordered
+    by the text itself.
+    """
+    if isinstance(key, tuple):
+        return tuple(natural_key(value) if isinstance(value, str) else value
+                     for value in key)
+    parts = DIGITS.split(key)
+    parts[1::2] = [int(part) for part in parts[1::2]]
+    return (tuple(parts), key)
+
+
+def sort_order(lines, key, reverse=False):
+    """Sort a list of lines by key
+
+    Keys are computed once per line and a list of line indices is
+    sorted by key. Numeric keys are stored in an array of floats and
+    sorted in two stable passes (text, then number), which is faster
+    and smaller than sorting by `(number, text)` tuples.
+
+    :returns: A tuple `(keys, order)`. `order` is a list of line
+    indices in sorted order. Two lines have the same sort key if and
+    only if they have equal `keys` items.
+    """
+    indices = range(len(lines))
+    if key.order == NUMERIC and key.regex is None:
+        keys = [key.text_key(line) for line in lines]
+        numbers = array("d", [number(k) for k in keys])
+        order = sorted(indices, key=keys.__getitem__, reverse=reverse)
+        order.sort(key=numbers.__getitem__, reverse=reverse)
     else:
-        range = (0, len(text))
-    output = "".join(sorted(iterlines(text, range), key=key, reverse=opts.reverse))
-    if textview.shouldChangeTextInRange_replacementString_(range, output):
-        textview.textStorage().replaceCharactersInRange_withString_(range, output)
-        textview.didChangeText()
-        if opts.selection:
-            textview.setSelectedRange_(range)
+        keys = [key(line) for line in lines]
+        order = sorted(indices, key=keys.__getitem__, reverse=reverse)
+    return keys, order
+
+
+def iter_unique(items, count=False):
+    """Generate the first line of each run of items having equal keys
+
+    :param items: An iterable of `(key, line)` pairs sorted by key.
+    :param count: Prefix each line with the number of lines in its run
+    (like `uniq -c`) if true.
+    """
+    items = iter(items)
+    for key, line in items:
+        break
+    else:
+        return
+    num = 1
+    for next_key, next_line in items:
+        if next_key == key:
+            num += 1
+            continue
+        yield "{:>7} {}".format(num, line) if count else line
+        key = next_key
+        line = next_line
+        num = 1
+    yield "{:>7} {}".format(num, line) if count else line
+
+
+def join_sorted(items, duplicates):
+    """Join sorted `(key, line)` items
+
+    :param duplicates: `KEEP`, `UNIQUE` or `COUNT` (see `iter_unique`).
+    """
+    if duplicates == KEEP:
+        return "".join(item[1] for item in items)
+    return "".join(iter_unique(items, duplicates == COUNT))
+
+
+class Descending(object):
+    """Sort key wrapper that inverts the order of a key
+
+    Runs of a reverse sort are written with these keys so they can be
+    merged in ascending order.
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __reduce__(self):
+        return (Descending, (self.key,))
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    __hash__ = None
+
+
+def external_sort(lines, key, reverse=False, run_size=None, pool=None,
+                  tempdir=None, with_keys=False):
+    """Sort lines without holding all lines and keys in memory at once
+
+    Lines are split into runs of `run_size` lines. Each run is sorted
+    and spilled to a temporary file along with the precomputed sort
+    keys, and then the runs are merged. The sort is stable, like
+    `sorted`.
+
+    :param lines: An iterable of lines.
+    :param key: Sort key function. It must be picklable if `pool` is
+    given.
+    :param reverse: Sort in reverse (descending) order if true.
+    :param run_size: Number of lines per run. Defaults to `RUN_SIZE`.
+    :param pool: Optional `multiprocessing.Pool` used to sort runs in
+    parallel.
+    :param tempdir: Directory in which run files are created.
+    :param with_keys: Generate `(key, line)` pairs rather than lines.
+    :returns: A generator of sorted lines. Run files are removed when
+    the generator is exhausted or closed.
+    """
+    if run_size is None:
+        run_size = RUN_SIZE
+    runs = iter_runs(lines, run_size)
+    sort = partial(sort_run, key=key, reverse=reverse, tempdir=tempdir)
+    paths = []
+    try:
+        if pool is None:
+            for run in runs:
+                paths.append(sort(run))
+        else:
+            paths.extend(pool.imap(sort, runs))
+        merged = heapq.merge(*[decorate_run(read_run(path), index)
+                               for index, path in enumerate(paths)])
+        if with_keys:
+            for item_key, index, seq, line in merged:
+                yield (item_key.key if reverse else item_key), line
+        else:
+            for item in merged:
+                yield item[3]
+    finally:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                log.warn("cannot remove sort run: %s", path, exc_info=True)
+
+
+def decorate_run(items, index):
+    """Generate `(key, index, seq, line)` items of a run for merging
+
+    Equal keys are merged in run order and then in order within each
+    run, which keeps the sort stable. Lines are never compared.
+    """
+    for seq, (key, line) in enumerate(items):
+        yield key, index, seq, line
+
+
+def iter_runs(lines, run_size):
+    lines = iter(lines)
+    while True:
+        run = list(islice(lines, run_size))
+        if not run:
+            break
+        yield run
+
+
+def sort_run(lines, key, reverse, tempdir=None):
+    """Sort a run of lines and write it to a temporary file
+
+    Keys are computed once per line (decorate-sort-undecorate) and an
+    array of line indices is sorted by key.
+
+    :param reverse: Sort in descending order if true. Keys are written
+    as `Descending` keys so runs are always in ascending key order.
+    :returns: The path of the run file.
+    """
+    keys = [key(line) for line in lines]
+    if reverse:
+        keys = [Descending(k) for k in keys]
+    order = array("l", sorted(range(len(lines)), key=keys.__getitem__))
+    fd, path = mkstemp(prefix="sort-", suffix=".run", dir=tempdir)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            for i in range(0, len(order), RUN_BATCH_SIZE):
+                batch = [(keys[j], lines[j])
+                    for j in order[i:i + RUN_BATCH_SIZE]]
+                pickle.dump(batch, fh, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def read_run(path):
+    """Generate `(key, line)` items from a run file"""
+    with open(path, "rb") as fh:
+        while True:
+            try:
+                batch = pickle.load(fh)
+            except EOFError:
+                break
+            for item in batch:
+                yield item
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Text command execution statistics
+
+Usage: stats [show|on|off|clear|dump] [path]
+
+Profiling is off by default. Turn it on with `stats on`, run some
+commands, and then use `stats` to show execution time percentiles per
+command or `stats dump <path>` to save all recorded data to a JSON file.
+"""
+import logging
+
+from editxt.command.base import command, CommandError
+from editxt.command.parser import Choice, CommandParser, File
+from editxt.command.util import current_directory, resolve_path
+
+log = logging.getLogger(__name__)
+
+
+@command(name='stats', arg_parser=CommandParser(
+    Choice("show on off clear dump", name="action"),
+    File("path", directory=current_directory),
+))
+def command_stats(textview, sender, args):
+    """Show or manage text command execution statistics"""
+    commander = getattr(sender, "text_commander", None)
+    if commander is None:
+        from editxt import app
+        commander = app.text_commander
+    profiler = commander.profiler
+    action = "show" if args is None else args.action
+    if action == "on":
+        profiler.enabled = True
+        return "command profiling enabled"
+    if action == "off":
+        profiler.enabled = False
+        return "command profiling disabled"
+    if action == "clear":
+        profiler.clear()
+        return "command statistics cleared"
+    if action == "dump":
+        if not args.path:
+            raise CommandError("please specify a file path")
+        path = resolve_path(args.path, textview)
+        try:
+            num = profiler.dump(path)
+        except IOError as err:
+            raise CommandError("cannot write {}: {}".format(path, err))
+        return "wrote {} records to {}".format(num, path)
+    report = profiler.report()
+    if not profiler.enabled:
+        report += "\n(profiling is off; use 'stats on' to enable it)"
+    return report
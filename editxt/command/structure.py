@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Structural selection and navigation commands
+
+These commands use the structure index of the document (see
+`editxt.structure.StructureIndex`) to find brackets, strings, comments
+and indentation blocks.
+"""
+import logging
+
+import AppKit as ak
+
+from editxt.command.base import command
+from editxt.command.util import view_offsets
+
+log = logging.getLogger(__name__)
+
+
+@command(name="expand", title="Expand Selection to Block")
+def expand_selection(textview, sender, args):
+    """Expand the selection to the enclosing string, brackets or block
+
+    Repeat to select progressively larger structures.
+    """
+    structure = textview.doc_view.document.structure
+    text = textview.string()
+    offsets = view_offsets(textview, text)
+    range = structure.expand_selection(
+        text, offsets.char_range(textview.selectedRange()))
+    if range is None:
+        ak.NSBeep()
+        return
+    range = offsets.utf16_range(range)
+    textview.setSelectedRange_(range)
+    textview.scrollRangeToVisible_(range)
+
+
+@command(name="bracket", title="Go to Matching Bracket")
+def goto_matching_bracket(textview, sender, args):
+    """Move the caret to the bracket matching the one beside it
+
+    The bracket after the caret is matched if there is one, otherwise
+    the bracket before it. The caret is placed on the same side of the
+    matching bracket so repeating the command returns to the original
+    position.
+    """
+    structure = textview.doc_view.document.structure
+    text = textview.string()
+    offsets = view_offsets(textview, text)
+    caret = offsets.to_char(textview.selectedRange()[0])
+    for offset, after in [(caret, True), (caret - 1, False)]:
+        if offset < 0 or structure.bracket_at(text, offset) is None:
+            continue
+        match = structure.match_bracket(text, offset)
+        if match is not None:
+            range = (offsets.to_utf16(match if after else match + 1), 0)
+            textview.setSelectedRange_(range)
+            textview.scrollRangeToVisible_(range)
+            return
+    ak.NSBeep()
@@ -18,8 +18,16 @@
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import os
 import re
-from collections import Counter
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, namedtuple
+from itertools import accumulate, chain, islice
+from weakref import WeakKeyDictionary
+
+import AppKit as ak
+import Foundation as fn
 
 import editxt.constants as const
 
@@ -30,9 +38,78 @@ def has_selection(textview, sender):
     return textview.selectedRange().length > 0
 
 
+def current_directory(textview=None):
+    """Get the directory of the current document
+
+    :param textview: The text view of the document. Defaults to the
+    current view of the current editor.
+    :returns: The directory of the document or ``None`` if the document
+    has not been saved.
+    """
+    if textview is None:
+        from editxt import app
+        editor = app.current_editor()
+        view = None if editor is None else editor.current_view
+    else:
+        view = textview.doc_view
+    path = getattr(view, "file_path", None)
+    return os.path.dirname(path) if path else None
+
+
+def resolve_path(path, textview=None):
+    """Get the absolute, normalized path of a (relative) path
+
+    :param path: A path, which may begin with ``~``.
+    :param textview: See ``current_directory``. Relative paths are
+    relative to the directory of the document or the user's home
+    directory if the document has not been saved.
+    """
+    path = os.path.expanduser(path)
+    if not os.path.isabs(path):
+        directory = current_directory(textview) or os.path.expanduser("~")
+        path = os.path.join(directory, path)
+    return os.path.normpath(path)
+
+
 _line_splitter = re.compile("([^\n\r\u2028]*(?:%s)?)" % "|".join(
     eol for eol in sorted(const.EOLS.values(), key=len, reverse=True)))
 
+# Characters that str.splitlines treats as line boundaries, but which are
+# not line endings (const.EOLS) in the editor.
+_other_line_breaks = "\v\f\x1c\x1d\x1e\x85\u2029"
+
+# Approximate number of characters split into lines at a time
+LINE_BLOCK_SIZE = 1 << 16
+
+
+def _split_lines(text):
+    return [line for line in _line_splitter.findall(text) if line]
+
+def _iter_line_blocks(text, start, end):
+    """Generate lists of lines of text[start:end] with line endings
+
+    Text is split in blocks of approximately `LINE_BLOCK_SIZE` characters
+    so lines are generated lazily. Blocks end after a line feed, so a
+    CRLF is never split between blocks. `str.splitlines` is used unless
+    the text contains characters that it considers line breaks but the
+    editor does not.
+    """
+    split = lambda block: block.splitlines(True)
+    for char in _other_line_breaks:
+        if text.find(char, start, end) >= 0:
+            split = _split_lines
+            break
+    while start < end:
+        stop = text.find("\n", start + LINE_BLOCK_SIZE, end)
+        stop = end if stop < 0 else stop + 1
+        yield split(text[start:stop])
+        start = stop
+
+def _text_range(text, range):
+    if len(range) < 2:
+        return range[0], len(text)
+    return range[0], range[0] + range[1]
+
 def iterlines(text, range=(0,)):
     """iterate over lines of text
 
@@ -43,11 +120,88 @@ def iterlines(text, range=(0,)):
     if not text:
         yield text
     else:
-        if range != (0,):
-            range = (range[0], sum(range))
-        for line in _line_splitter.finditer(text, *range):
-            if line.group():
-                yield line.group()
+        for block in _iter_line_blocks(text, *_text_range(text, range)):
+            for line in block:
+                yield line
+
+
+def line_offsets(text, range=(0,)):
+    """Get the offsets of lines in text
+
+    :param text: The text to split into lines.
+    :param range: An optional `(location, length)` range of text to split.
+    Lines are split in the same way as `iterlines`.
+    :returns: An `array` of line start offsets followed by the end offset
+    of the last line. The array has one item if there are no lines.
+    """
+    start, end = _text_range(text, range)
+    offsets = array("l", [start])
+    for block in _iter_line_blocks(text, start, end):
+        ends = accumulate(chain([offsets[-1]], map(len, block)))
+        offsets.extend(islice(ends, 1, None))
+    return offsets
+
+
+class Lines(object):
+    """A sequence of lines backed by text and an array of line offsets
+
+    Slicing returns a view sharing the same text and offsets, so no
+    text (or offsets) are copied until a line is accessed.
+
+    :param text: The text.
+    :param offsets: Line offsets (see `line_offsets`). Offsets are
+    computed from the entire text if not given.
+    """
+
+    def __init__(self, text, offsets=None):
+        if offsets is None:
+            offsets = line_offsets(text)
+        self.text = text
+        self.offsets = memoryview(offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("slice step not supported: {}".format(step))
+            return Lines(self.text, self.offsets[start:max(start, stop) + 1])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("line index out of range: {}".format(index))
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        text = self.text
+        offsets = iter(self.offsets)
+        start = next(offsets)
+        for end in offsets:
+            yield text[start:end]
+            start = end
+
+    @property
+    def range(self):
+        """The `(location, length)` range of these lines in text"""
+        return (self.offsets[0], self.offsets[-1] - self.offsets[0])
+
+    def line_range(self, index):
+        """Get the `(location, length)` range of a line in text"""
+        if index < 0:
+            index += len(self)
+        start = self.offsets[index]
+        return (start, self.offsets[index + 1] - start)
+
+    def line_index(self, offset):
+        """Get the index of the line containing the given text offset
+
+        An offset at the end of the last line is in the last line.
+        """
+        index = bisect_right(self.offsets, offset) - 1
+        return max(0, min(index, len(self) - 1))
+
 
 # def expand_range(text, range):
 #     """expand range to beginning of first selected line and end of last selected line"""
@@ -59,110 +213,601 @@ def iterlines(text, range=(0,)):
 #     return r
 
 
-_newlines = re.compile("|".join(
-    eol for eol in sorted(const.EOLS.values(), key=len, reverse=True)))
+# Characters outside the Basic Multilingual Plane (emoji, etc.). NSString
+# (and NSTextView) ranges count UTF-16 code units, in which each of these
+# characters has a length of two.
+_astral_chars = re.compile("[\U00010000-\U0010FFFF]")
 
-def replace_newlines(textview, eol):
-    sel = textview.selectedRange()
-    text = textview.string()
-    next = _newlines.sub(eol, text)
-    if text == next:
+def text_length(textview, text):
+    """Get the length of text in the range units of a text view
+
+    NSTextView ranges count UTF-16 code units while other (headless)
+    text views count characters.
+    """
+    length = len(text)
+    if isinstance(textview, ak.NSTextView):
+        length += sum(1 for m in _astral_chars.finditer(text))
+    return length
+
+
+class Utf16Offsets(object):
+    """Convert offsets in text between characters and UTF-16 code units
+
+    :param text: The text. Offsets are not changed by conversion if it
+    has no characters outside the Basic Multilingual Plane.
+    """
+
+    def __init__(self, text):
+        self.chars = [m.start() for m in _astral_chars.finditer(text)]
+        self.units = [offset + i for i, offset in enumerate(self.chars)]
+
+    def to_utf16(self, offset):
+        """Get the UTF-16 offset of a character offset"""
+        return offset + bisect_left(self.chars, offset)
+
+    def to_char(self, offset):
+        """Get the character offset of a UTF-16 offset
+
+        An offset between the two code units of a character is moved to
+        the start of the character.
+        """
+        return offset - bisect_left(self.units, offset)
+
+    def char_range(self, range):
+        """Convert a `(location, length)` range to characters"""
+        start = self.to_char(range[0])
+        return (start, self.to_char(range[0] + range[1]) - start)
+
+    def utf16_range(self, range):
+        """Convert a `(location, length)` range to UTF-16 code units"""
+        start = self.to_utf16(range[0])
+        return (start, self.to_utf16(range[0] + range[1]) - start)
+
+    def utf16_edits(self, edits):
+        """Convert the ranges of `(offset, length, string)` edits"""
+        for offset, length, string in edits:
+            yield self.utf16_range((offset, length)) + (string,)
+
+
+def view_offsets(textview, text):
+    """Get `Utf16Offsets` for text in the range units of a text view
+
+    See `text_length`. Offsets are not converted for headless text views.
+    """
+    return Utf16Offsets(text if isinstance(textview, ak.NSTextView) else "")
+
+
+def line_range(text, range):
+    """Get the range of the lines containing the given range
+
+    This is equivalent to `NSString.lineRangeForRange_` with character
+    offsets. The returned range includes the line ending of the last line.
+    """
+    start, length = range
+    line_start = max(text.rfind(eol, 0, start) + 1 for eol in "\n\r\u2028")
+    match = _eol_regex.search(text, start + length - 1 if length else start)
+    line_end = match.end() if match is not None else len(text)
+    return (line_start, line_end - line_start)
+
+
+def line_edit(old, new):
+    """Get the smallest edit that will transform one line into another
+
+    :param old: The old line.
+    :param new: The new line.
+    :returns: A tuple `(<offset>, <length>, <replacement string>)` or
+    `None` if the lines are equal. The offset is relative to the start
+    of the old line.
+    """
+    if old == new:
+        return None
+    # fast paths: prefix inserted or removed (indent, comment, etc.)
+    if new.endswith(old):
+        return (0, 0, new[:len(new) - len(old)])
+    if old.endswith(new):
+        return (0, len(old) - len(new), "")
+    start = 0
+    end = min(len(old), len(new))
+    while start < end and old[start] == new[start]:
+        start += 1
+    old_end = len(old)
+    new_end = len(new)
+    while old_end > start and new_end > start \
+            and old[old_end - 1] == new[new_end - 1]:
+        old_end -= 1
+        new_end -= 1
+    return (start, old_end - start, new[start:new_end])
+
+
+def line_edits(text, range, transform):
+    """Generate edits that transform each line in a range of text
+
+    :param text: The text.
+    :param range: The range of (whole) lines to transform.
+    :param transform: A function that takes a line (including its line
+    ending) and returns the transformed line.
+    :yields: Edits `(<offset>, <length>, <replacement string>)` ordered
+    by offset. Only changed lines generate edits. A single edit of the
+    entire range is generated if the range contains characters that
+    are longer in UTF-16 (text view) units than in Python strings.
+    """
+    start, end = _text_range(text, range)
+    if _astral_chars.search(text, start, end) is not None:
+        new = "".join(transform(line) for line in iterlines(text, range))
+        if new != text[start:end]:
+            yield (start, end - start, new)
+        return
+    offset = start
+    for line in iterlines(text, range):
+        edit = line_edit(line, transform(line))
+        if edit is not None:
+            start, length, string = edit
+            yield (offset + start, length, string)
+        offset += len(line)
+
+
+def diff_edits(text, range, new):
+    """Generate edits that replace a range of text with new text
+
+    Only the changed regions (see `editxt.textdiff.diff_text`) are
+    replaced unless the range contains characters that are longer in
+    UTF-16 (text view) units than in Python strings, in which case a
+    single edit of the entire range is generated.
+
+    :yields: Edits `(<offset>, <length>, <replacement string>)` ordered
+    by offset.
+    """
+    from editxt.textdiff import diff_text
+    start, end = _text_range(text, range)
+    old = text[start:end]
+    if _astral_chars.search(old) is not None:
+        if new != old:
+            yield (start, end - start, new)
         return
-    range = (0, len(text))
-    if textview.shouldChangeTextInRange_replacementString_(range, next):
-        textview.textStorage().replaceCharactersInRange_withString_(range, next)
-        textview.didChangeText()
-        textview.setSelectedRange_(sel)
+    for (offset, length), string in diff_text(old, new):
+        yield (start + offset, length, string)
+
+
+def coalesce_edits(edits):
+    """Merge adjacent edits and drop edits that do not change anything
+
+    :param edits: An iterable of `(<offset>, <length>, <replacement>)`
+    tuples ordered by offset. Edits must not overlap.
+    :returns: A tuple `(<ranges>, <replacement strings>)`.
+    """
+    ranges = []
+    strings = []
+    end = -1
+    for start, length, string in edits:
+        if not (length or string):
+            continue
+        if start == end:
+            prev_start, prev_length = ranges[-1]
+            ranges[-1] = (prev_start, prev_length + length)
+            strings[-1] += string
+        else:
+            ranges.append((start, length))
+            strings.append(string)
+        end = start + length
+    return ranges, strings
 
 
-_indentation_regex = re.compile("([ \t]*)([^\r\n\u2028]*[\r\n\u2028]*)")
+def apply_edits(textview, edits):
+    """Apply a batch of edits to a text view
+
+    Adjacent edits are merged and the result is applied with the
+    smallest possible number of text storage replacements inside a
+    single beginEditing/endEditing group. Unlike replacing an entire
+    region, unchanged text keeps its attributes and layout.
+
+    :param textview: The text view.
+    :param edits: An iterable of `(<offset>, <length>, <replacement>)`
+    tuples ordered by offset. Edits must not overlap.
+    :returns: The change in the length of the text or `None` if the
+    text view did not allow the change.
+    """
+    ranges, strings = coalesce_edits(edits)
+    if not ranges:
+        return 0
+    if not textview.shouldChangeTextInRanges_replacementStrings_(
+            range_values(textview, ranges), strings):
+        return None
+    delta = 0
+    store = textview.textStorage()
+    store.beginEditing()
+    try:
+        for range, string in zip(reversed(ranges), reversed(strings)):
+            store.replaceCharactersInRange_withString_(range, string)
+            delta += text_length(textview, string) - range[1]
+    finally:
+        store.endEditing()
+    textview.didChangeText()
+    return delta
+
+
+def range_values(textview, ranges):
+    """Get a list of ranges in the form expected by a text view
+
+    NSTextView methods that take a list of ranges expect `NSValue`
+    objects, which are created for `(location, length)` tuples.
+    """
+    if isinstance(textview, ak.NSTextView):
+        return [fn.NSValue.valueWithRange_(r) for r in ranges]
+    return ranges
+
+
+def select_ranges(textview, ranges):
+    """Select one or more ranges (one per caret or line of a block)
+
+    NSTextView does not keep more than one selected range if any of them
+    is empty. In that case the first range is selected and the ranges
+    are kept as the carets of the text view (see
+    `editxt.controls.textview.TextView.carets`).
+    """
+    if len(ranges) == 1:
+        textview.setSelectedRange_(ranges[0])
+        return
+    if isinstance(textview, ak.NSTextView) and not all(r[1] for r in ranges):
+        textview.setSelectedRange_(ranges[0])
+        textview.carets = [tuple(r) for r in ranges]
+        return
+    textview.setSelectedRanges_(range_values(textview, ranges))
+
+
+def selected_ranges(textview):
+    """Get the selected ranges of a text view as `(location, length)`
+
+    The carets of the text view are returned if it has more than one
+    (see `select_ranges`).
+    """
+    carets = getattr(textview, "carets", None)
+    if carets:
+        return list(carets)
+    return [tuple(r.rangeValue()) if hasattr(r, "rangeValue") else tuple(r)
+            for r in textview.selectedRanges()]
+
+
+def edit_selections(textview, edit):
+    """Apply an edit at each selected range (caret) as a single change
+
+    All edits are applied with `apply_edits`, which makes one undo
+    group and one text storage editing session no matter how many
+    carets there are. New carets are computed in a single pass over
+    the edits, each shifted by the accumulated length change of the
+    edits before it.
+
+    :param textview: The text view.
+    :param edit: A function `edit(text, range)` that returns an edit
+    tuple `(<offset>, <length>, <replacement>)` for the given selected
+    range or `None` if nothing should be changed there (the caret
+    stays where it is). An edit that overlaps the edit of a previous
+    range is dropped and carets that end up at the same offset are
+    merged.
+    :returns: The change in the length of the text or `None` if nothing
+    was changed.
+    """
+    text = textview.string()
+    edits = []
+    changed = False
+    end = -1
+    for range in sorted(selected_ranges(textview)):
+        item = edit(text, range)
+        if item is None:
+            item = (range[0], 0, "")
+        else:
+            changed = True
+        if item[0] < end:
+            continue
+        edits.append(item)
+        end = item[0] + item[1]
+    if not changed:
+        return None
+    delta = apply_edits(textview, edits)
+    if delta is None:
+        return None
+    carets = []
+    shift = 0
+    for start, length, string in edits:
+        size = text_length(textview, string)
+        caret = (start + shift + size, 0)
+        if not carets or carets[-1] != caret:
+            carets.append(caret)
+        shift += size - length
+    select_ranges(textview, carets)
+    textview.scrollRangeToVisible_(carets[0])
+    return delta
+
+
+_eols = "|".join(
+    eol for eol in sorted(const.EOLS.values(), key=len, reverse=True))
+_line_parts = re.compile("([ \t]*)([^\r\n\u2028]*)(%s)?" % _eols)
+
+def whitespace_edits(text, indent=None, eol=None, strip=False,
+        final_newline=False):
+    """Generate edits that normalize whitespace in a single pass over text
+
+    :param text: The text to normalize.
+    :param indent: A function that takes the leading whitespace of a
+    line and returns its replacement (see `indent_normalizer`).
+    Indentation is not changed if this is `None`.
+    :param eol: The line ending to use for all lines. Line endings are
+    not changed if this is `None`.
+    :param strip: Remove trailing whitespace (spaces and tabs) if true.
+    :param final_newline: Add a line ending to the end of (non-empty)
+    text that does not end with one. This is `eol` or the first line
+    ending in the text (`\\n` if there are no line endings).
+    :yields: Edits `(<offset>, <length>, <replacement string>)` ordered
+    by offset (see `apply_edits`).
+    """
+    newline = eol
+    line_eol = None
+    for match in _line_parts.finditer(text):
+        start, end = match.span()
+        if start == end:
+            break
+        ws, content, line_eol = match.groups()
+        if newline is None:
+            newline = line_eol
+        trailing = 0
+        if strip:
+            trailing = len(content) - len(content.rstrip(" \t"))
+            if trailing == len(content) and ws:
+                # whitespace-only line
+                yield (start, len(ws), "")
+                ws = ""
+        if indent is not None and ws:
+            new = indent(ws)
+            if new != ws:
+                yield (start, len(ws), new)
+        if trailing:
+            yield (start + len(ws) + len(content) - trailing, trailing, "")
+        if eol is not None and line_eol is not None and line_eol != eol:
+            yield (end - len(line_eol), len(line_eol), eol)
+    if final_newline and text and line_eol is None:
+        yield (len(text), 0, newline or "\n")
+
+
+def indent_normalizer(mode, size):
+    """Get a function that converts leading whitespace to an indent mode
+
+    Tabs advance to the next multiple of `size` columns. In tab mode,
+    whitespace is converted to as many tabs as possible followed by
+    spaces for the remaining columns. In space mode, all tabs are
+    converted to spaces. Results are cached since most lines share a
+    small number of distinct indents.
+
+    :param mode: `const.INDENT_MODE_TAB` or `const.INDENT_MODE_SPACE`.
+    :param size: Indent size (number of columns per tab).
+    :returns: A function that takes leading whitespace and returns the
+    normalized whitespace.
+    """
+    cache = {}
+    def normalize(ws):
+        try:
+            return cache[ws]
+        except KeyError:
+            pass
+        column = 0
+        for char in ws:
+            if char == "\t":
+                column += size - column % size
+            else:
+                column += 1
+        if mode == const.INDENT_MODE_TAB:
+            new = "\t" * (column // size) + " " * (column % size)
+        else:
+            new = " " * column
+        cache[ws] = new
+        return new
+    return normalize
+
+
+def shift_offset(textview, offset, edits):
+    """Get the offset of a position in the text after edits are applied
+
+    :param textview: The text view (see `text_length`).
+    :param offset: An offset in the text before the edits.
+    :param edits: A sorted sequence of `(offset, length, string)` edits.
+    An offset within a replaced range is kept within its replacement.
+    """
+    delta = 0
+    for start, length, string in edits:
+        if start >= offset:
+            break
+        size = text_length(textview, string)
+        if start + length > offset:
+            return start + delta + min(offset - start, size)
+        delta += size - length
+    return offset + delta
+
+
+def edit_text(textview, text, edits):
+    """Apply edits to the text of a text view and adjust its selection
+
+    The selection is shifted by the length changes of edits made before
+    it (see `shift_offset`).
+
+    :param textview: The text view.
+    :param text: The text of the text view.
+    :param edits: A sorted sequence of `(offset, length, string)` edits
+    with character offsets in text.
+    :returns: True if the text was changed.
+    """
+    edits = list(view_offsets(textview, text).utf16_edits(edits))
+    if not edits:
+        return False
+    sel = textview.selectedRange()
+    if apply_edits(textview, edits) is None:
+        return False
+    start = shift_offset(textview, sel[0], edits)
+    end = shift_offset(textview, sel[0] + sel[1], edits)
+    textview.setSelectedRange_((start, end - start))
+    return True
+
+
+def replace_newlines(textview, eol):
+    text = textview.string()
+    edit_text(textview, text, whitespace_edits(text, eol=eol))
+
 
 def change_indentation(textview, old_indent, new_indent, size):
     attr_change = (new_indent == "\t")
     text_change = (old_indent != new_indent)
     if attr_change or text_change:
-        text = next = textview.string()
+        if attr_change:
+            textview.doc_view.document.reset_text_attributes(size)
         if text_change:
-            #next = text.replace(old_indent, new_indent)
+            text = textview.string()
             # TODO detect comment characters at the beginning of a line and
             # replace indentation beyond the comment characters
-            fragments = []
-            for match in _indentation_regex.finditer(text):
-                ws, other = match.groups()
-                if ws:
-                    fragments.append(ws.replace(old_indent, new_indent))
-                fragments.append(other)
-            next = "".join(fragments)
-        range = (0, len(text))
-        if textview.shouldChangeTextInRange_replacementString_(range, next):
-            if attr_change:
-                textview.doc_view.document.reset_text_attributes(size)
-            if text_change and text != next:
-                sel = textview.selectedRange()
-                textview.textStorage().replaceCharactersInRange_withString_(range, next)
-                if sel[0] + sel[1] > len(next):
-                    if sel[0] > len(next):
-                        sel = (len(next), 0)
-                    else:
-                        sel = (sel[0], len(next) - sel[0])
-                textview.setSelectedRange_(sel)
-            textview.didChangeText()
+            indent = lambda ws: ws.replace(old_indent, new_indent)
+            edit_text(textview, text, whitespace_edits(text, indent))
 
 
-def calculate_indent_mode_and_size(text, sample_lines=256):
-    """Calculate indent mode (tab or space) and size
+Indentation = namedtuple("Indentation", "mode size confidence")
+Indentation.__doc__ = """Detected indentation
 
-    This uses a statistical calculation to determine the most likely
-    indent size based on the first `N` lines in the given text where
-    `N = sample_lines`. Lines containing only whitespace are ignored.
-
-    :returns: A two-tuple: `(<indent_mode>, <indent_size>)`.
-    `indent_mode` will be one of `editxt.constants.INDENT_MODE_SPACE`,
-    `editxt.constants.INDENT_MODE_TAB` or `None`. `indent_size` will
-    be the number of spaces per indent, or `None` if `indent_mode` is
-    `editxt.constants.INDENT_MODE_TAB` or there are no lines indented
-    more than one space.
-    """
-    last_size = None
-    sizes = Counter()
-    space = False
-    mode = size = None
-    for n, line in enumerate(iterlines(text)):
-        if n >= sample_lines:
-            break
-        if not line.strip():
-            continue
-        if line.startswith(" "):
-            space = True
+:param mode: `editxt.constants.INDENT_MODE_SPACE`,
+`editxt.constants.INDENT_MODE_TAB` or `None` if no lines are indented.
+:param size: The number of spaces per indent or `None` if the mode is
+not space or no lines are indented more than one space.
+:param confidence: A number between 0 and 1. This is the fraction of
+indented lines that agree with the mode multiplied by the fraction of
+indent changes that are a multiple of the size.
+"""
+NO_INDENTATION = Indentation(None, None, 0.0)
+MIN_INDENT_CONFIDENCE = 0.5
+_eol_regex = re.compile(_eols)
+
+
+def detect_indentation(text, sample_lines=256):
+    """Detect indent mode (tab or space) and size
+
+    Three chunks of `sample_lines` lines are sampled: the head, middle
+    and tail of the text (the entire text is sampled if it is short).
+    Lines containing only whitespace are ignored. Each indented line
+    is a vote for its indent mode (the first indented line breaks ties),
+    and each increase in indentation from one line to the next is a vote
+    for an indent size. Lines indented by a single space (continued block
+    comments, for example) only count if there are no other indented
+    lines.
+
+    :returns: An `Indentation` tuple.
+    """
+    tabs = spaces = singles = 0
+    first = None
+    deltas = Counter()
+    indents = Counter()
+    chunks = _sample_chunks(text, sample_lines)
+    for chunk in chunks:
+        last = 0 if chunk is chunks[0] else None
+        for line in (text if chunk is None else chunk).splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("\t"):
+                first = first or const.INDENT_MODE_TAB
+                tabs += 1
+                last = None
+                continue
             indent = len(line) - len(line.lstrip(" "))
-            if indent != last_size:
-                last_size = indent
-                sizes[indent] += 1
-        elif not space and line.startswith("\t"):
-            return const.INDENT_MODE_TAB, None
-    sizes.pop(1, None)
-    bases = [] # list of minimum indent sizes
-    for indent in sorted(sizes):
-        if any(indent % b == 0 for b in bases):
-            # stop when we find an indent width that is evenly
-            # divisible by at least one base (minimum indent size)
+            if indent == 1:
+                singles += 1
+            elif indent:
+                first = first or const.INDENT_MODE_SPACE
+                spaces += 1
+                indents[indent] += 1
+            if last is not None and indent - last > 1:
+                deltas[indent - last] += 1
+            last = indent
+    if not (tabs or spaces):
+        if singles:
+            return Indentation(const.INDENT_MODE_SPACE, None, 1.0)
+        return NO_INDENTATION
+    confidence = max(tabs, spaces) / (tabs + spaces)
+    if tabs > spaces or (tabs == spaces and first == const.INDENT_MODE_TAB):
+        return Indentation(const.INDENT_MODE_TAB, None, confidence)
+    votes = deltas or indents
+    total = sum(votes.values())
+    # most common change in indentation; smaller sizes win ties
+    size = min(votes, key=lambda n: (-votes[n], n))
+    agree = sum(count for n, count in votes.items() if n % size == 0)
+    return Indentation(const.INDENT_MODE_SPACE, size,
+                       confidence * agree / total)
+
+
+def _sample_chunks(text, sample_lines):
+    """Get head, middle and tail chunks of text
+
+    :returns: A list containing `None` (meaning "all text") if the text
+    is short enough to be sampled entirely. Otherwise a list of (up to)
+    three strings, each beginning at the start of a line.
+    """
+    head_end = min(len(text), sample_lines * 200)
+    for n, match in enumerate(_eol_regex.finditer(text, 0, head_end), 1):
+        if n == sample_lines:
+            head_end = match.end()
             break
-        bases.append(indent)
-    if len(bases) == 1:
-        size = bases[0]
-    else:
-        def rank(base):
-            return sum(count
-                for indent, count in sizes.items() if indent % base == 0)
-        max_rank = 0
-        for base in bases:
-            if rank(base) > max_rank:
-                max_rank = rank(base)
-                size = base
-    if space:
-        mode = const.INDENT_MODE_SPACE
-    return mode, size
+    if len(text) <= head_end * 3:
+        return [None]
+    chunks = [text[:head_end]]
+    for offset in [(len(text) - head_end) // 2, len(text) - head_end]:
+        match = _eol_regex.search(text, offset, offset + head_end)
+        if match is None:
+            break
+        chunks.append(text[match.end():match.end() + head_end])
+    return chunks
+
+
+def calculate_indent_mode_and_size(text, sample_lines=256):
+    """Calculate indent mode (tab or space) and size
+
+    :returns: A two-tuple: `(<indent_mode>, <indent_size>)`. See
+    `detect_indentation` and `Indentation`.
+    """
+    info = detect_indentation(text, sample_lines)
+    return info.mode, info.size
+
+
+_indentation_cache = OrderedDict()
+MAX_CACHED_INDENTATIONS = 1000
 
+def detect_file_indentation(path, text=None, sample_lines=256):
+    """Detect indentation of a file
+
+    Results are cached by file path, modification time and size, so
+    reopening or reloading an unchanged file does not repeat detection.
+
+    :param path: File path.
+    :param text: The text of the file. The file is read if this is not
+    given.
+    :returns: An `Indentation` tuple. `NO_INDENTATION` if `text` is not
+    given and the file cannot be read.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        if text is None:
+            return NO_INDENTATION
+        return detect_indentation(text, sample_lines)
+    key = (path, stat.st_mtime, stat.st_size, sample_lines)
+    try:
+        info = _indentation_cache.pop(key)
+    except KeyError:
+        if text is None:
+            try:
+                with open(path, encoding="utf-8", errors="replace") as fh:
+                    text = fh.read()
+            except OSError:
+                return NO_INDENTATION
+        info = detect_indentation(text, sample_lines)
+        if len(_indentation_cache) >= MAX_CACHED_INDENTATIONS:
+            _indentation_cache.popitem(last=False)
+    _indentation_cache[key] = info
+    return info
+
+
+_arg_parser_matches = WeakKeyDictionary()
+MAX_CACHED_MATCHES = 1000
 
 def make_command_predicate(command):
     if len(command.names) == 1:
@@ -170,8 +815,33 @@ def make_command_predicate(command):
     else:
         prefix = tuple(n + " " for n in command.names)
     if command.lookup_with_arg_parser:
-        def predicate(item, parser=command.arg_parser):
-            return item.startswith(prefix) or parser.match(item.lstrip(" "))
+        parser = command.arg_parser
+        # parser matches are cached because they are expensive to compute
+        matches = _arg_parser_matches.get(parser)
+        if matches is None or len(matches) > MAX_CACHED_MATCHES:
+            matches = _arg_parser_matches[parser] = {}
+        def predicate(item):
+            if item.startswith(prefix):
+                return True
+            try:
+                return matches[item]
+            except KeyError:
+                result = matches[item] = bool(parser.match(item.lstrip(" ")))
+            return result
     else:
         def predicate(item): return item.startswith(prefix)
     return predicate
+
+
+def iter_command_history(command, history):
+    """Iterate over items in history that match the given command
+
+    Items are yielded in history order (most recent first). The name
+    index of history is used for commands that are not looked up with
+    their argument parser; all items in history are checked otherwise.
+    """
+    if command.lookup_with_arg_parser:
+        return history.iter_matching(make_command_predicate(command))
+    prefix = tuple(name + " " for name in command.names)
+    return (item for item in history.iter_by_name(command.names)
+            if item.startswith(prefix))
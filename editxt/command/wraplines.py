@@ -22,6 +22,9 @@ import objc
 import os
 import re
 import time
+from bisect import bisect_right
+from itertools import accumulate, chain, count
+from operator import add, sub
 
 import AppKit as ak
 import Foundation as fn
@@ -29,11 +32,13 @@ import Foundation as fn
 import editxt.constants as const
 from editxt.command.base import command, objc_delegate, SheetController
 from editxt.command.parser import Choice, Int, CommandParser, Options
-from editxt.command.util import has_selection, iterlines
+from editxt.command.util import (apply_edits, diff_edits, has_selection,
+    iterlines)
 
 log = logging.getLogger(__name__)
 
 WHITESPACE = re.compile(r"[ \t]*")
+GAPS = re.compile(r"([ \t]+)")
 
 
 @command(name='wrap', title="Hard Wrap...",
@@ -42,6 +47,7 @@ WHITESPACE = re.compile(r"[ \t]*")
     arg_parser=CommandParser( # TODO test
         Int('wrap_column', default=const.DEFAULT_RIGHT_MARGIN),
         Choice(('indent', True), ('no-indent', False)),
+        Choice(('greedy', False), ('optimal', True), name='optimal'),
     ))
 def wrap_lines(textview, sender, args):
     if args is None:
@@ -55,12 +61,14 @@ def wrap_lines(textview, sender, args):
     hotkey=("\\", ak.NSCommandKeyMask),
     arg_parser=CommandParser( # TODO test
         Choice(('indent', True), ('no-indent', False)), # TODO default to last used value
+        Choice(('greedy', False), ('optimal', True), name='optimal'),
     ),
     is_enabled=has_selection)
 def wrap_at_margin(textview, sender, args):
     opts = Options()
     opts.wrap_column = const.DEFAULT_RIGHT_MARGIN
     opts.indent = args.indent if args is not None else True
+    opts.optimal = args.optimal if args is not None else False
     wrap_selected_lines(textview, opts)
 
 
@@ -72,6 +80,7 @@ class WrapLinesController(SheetController):
     OPTIONS_FACTORY = lambda self:Options(
         wrap_column=const.DEFAULT_RIGHT_MARGIN,
         indent=True,
+        optimal=False,
     )
 
     @objc_delegate
@@ -86,18 +95,34 @@ def wrap_selected_lines(textview, options):
     eol = textview.doc_view.document.eol
     lines = iterlines(text, sel)
     output = eol.join(wraplines(lines, options, textview))
-    if textview.shouldChangeTextInRange_replacementString_(sel, output):
-        textview.textStorage().replaceCharactersInRange_withString_(sel, output)
-        textview.didChangeText()
-        textview.setSelectedRange_((sel[0], len(output)))
+    delta = apply_edits(textview, diff_edits(text, sel, output))
+    if delta is not None:
+        textview.setSelectedRange_((sel[0], sel[1] + delta))
 
 def wraplines(lines, options, textview):
+    """Generate wrapped lines
+
+    Lines are grouped into paragraphs (separated by blank lines), and
+    each paragraph is tokenized once and broken into lines with
+    `greedy_lines` or `optimal_lines`. Output is generated one paragraph
+    at a time.
+
+    :param lines: An iterable of lines.
+    :param options: Options with `wrap_column`, `indent` and `optimal`
+    attributes.
+    :param textview: The text view being wrapped. The comment token of
+    its document is used to find the indent of commented paragraphs.
+    :yields: Wrapped lines without line endings. The last line is empty
+    so joined output ends with a line ending.
+    """
     width = options.wrap_column
     regexp = WHITESPACE
     if options.indent:
         token = re.escape(textview.doc_view.document.comment_token)
         if token:
             regexp = re.compile(r"^[ \t]*(?:%s *)?" % token)
+    reflow = optimal_lines if options.optimal else greedy_lines
+    lines = iter(lines)
     for frag in lines:
         frag = frag.rstrip()
         if frag:
@@ -105,56 +130,140 @@ def wraplines(lines, options, textview):
         yield ""
     else:
         yield ""
-        raise StopIteration
+        return
     leading = ""
     indent = regexp.match(frag).group()
     comment = regexp is not WHITESPACE and bool(indent.strip())
-    frag = regexp.sub("", frag, 1)
+    first_width = width
     if indent:
-        firstlen = width - len(indent)
-        if firstlen < 1:
-            firstlen = 1
-        line, frag = get_line(frag, lines, firstlen, regexp)
-        yield indent + line
+        first_width = max(width - len(indent), 1)
         if options.indent:
-            width = firstlen
+            width = first_width
             leading = indent
-    while True:
-        while frag is not None:
-            line, frag = get_line(frag, lines, width, regexp)
-            yield leading + line if line else line
-        for frag in lines:
-            frag = regexp.sub("", frag.rstrip(), 1)
-            yield leading if comment else ""
-            if frag:
-                break
-        else:
+    blank = leading if comment else ""
+    prefix = indent
+    paragraph = []
+    frag = regexp.sub("", frag, 1)
+    if frag:
+        paragraph.append(frag)
+    else:
+        yield blank
+    for line in chain(lines, [None]):
+        if line is not None:
+            line = regexp.sub("", line.rstrip(), 1)
             if line:
-                yield ""
-            break
+                paragraph.append(line)
+                continue
+        if paragraph:
+            for wrapped in reflow(" ".join(paragraph), width, first_width):
+                yield prefix + wrapped
+                prefix = leading
+            first_width = width
+            paragraph = []
+        yield "" if line is None else blank
+
+
+def word_bounds(text):
+    """Get start and end offsets of words in text
 
-def get_line(frag, lines, width, regexp, ws=" \t"):
-    while True:
-        while len(frag) < width:
-            try:
-                line = regexp.sub("", next(lines).rstrip(), 1)
-            except StopIteration:
-                return frag, None
-            if not line:
-                return frag, None
-            frag = frag + " " + line if frag else line
-        if len(frag) == width:
-            return frag, ""
-        for i in range(width, 0, -1):
-            if frag[i] in ws:
+    :param text: Text with no leading or trailing whitespace.
+    :returns: A tuple of lists: `(<starts>, <ends>)`.
+    """
+    if "\t" in text or "  " in text:
+        bounds = list(accumulate(chain([0], map(len, GAPS.split(text)))))
+        return bounds[0::2], bounds[1::2]
+    # fast path: words separated by single spaces
+    words = text.split(" ")
+    ends = list(map(add, accumulate(map(len, words)), count()))
+    return list(map(sub, ends, map(len, words))), ends
+
+
+def greedy_lines(text, width, first_width=None):
+    """Break a paragraph into lines that are filled as much as possible
+
+    Whitespace between words is preserved except where a word would
+    fit on a line only if the space before it is collapsed to a single
+    space. A word that is longer than the width is put on a line by
+    itself.
+
+    :param text: Paragraph text with no line breaks or leading or
+    trailing whitespace.
+    :param width: Maximum line length.
+    :param first_width: Maximum length of the first line. Defaults to
+    `width`.
+    :yields: Lines.
+    """
+    starts, ends = word_bounds(text)
+    nwords = len(starts)
+    line_width = width if first_width is None else first_width
+    k = 0
+    while k < nwords:
+        runs = []
+        start = origin = starts[k]
+        while True:
+            # last word that fits with original spacing (at least one word)
+            last = max(k, bisect_right(ends, origin + line_width, k) - 1)
+            k = last + 1
+            if k == nwords:
+                break
+            length = ends[last] - origin
+            if length + 1 + ends[k] - starts[k] > line_width:
                 break
+            # next word fits if the space before it is collapsed
+            runs.append(text[start:ends[last]])
+            start = starts[k]
+            origin = start - length - 1
+        if runs:
+            runs.append(text[start:ends[last]])
+            yield " ".join(runs)
         else:
-            fraglen = len(frag)
-            i = width + 1
-            while i < fraglen and frag[i] not in ws:
-                i += 1
-        line, frag = frag[:i].rstrip(), frag[i:].lstrip()
-        if len(line) + len(WHITESPACE.split(frag, 1)[0]) < width:
-            frag = line + " " + frag
-            continue
-        return line, frag
+            yield text[start:ends[last]]
+        line_width = width
+
+
+def optimal_lines(text, width, first_width=None):
+    """Break a paragraph into lines with minimum raggedness
+
+    Line breaks are chosen to minimize the sum of the squares of the
+    unused space at the end of each line except the last (Knuth-Plass
+    without stretching or hyphenation). Whitespace between words on a
+    line is preserved. A word that is longer than the width is put on a
+    line by itself.
+
+    :param text: Paragraph text with no line breaks or leading or
+    trailing whitespace.
+    :param width: Maximum line length.
+    :param first_width: Maximum length of the first line. Defaults to
+    `width`.
+    :yields: Lines.
+    """
+    starts, ends = word_bounds(text)
+    nwords = len(starts)
+    if first_width is None:
+        first_width = width
+    costs = [0] * (nwords + 1)
+    breaks = [0] * (nwords + 1)
+    for j in range(1, nwords + 1):
+        end = ends[j - 1]
+        best = None
+        for i in range(j - 1, -1, -1):
+            slack = (width if i else first_width) - (end - starts[i])
+            if slack < 0:
+                if i < j - 1:
+                    break
+                cost = costs[i]
+            elif j == nwords:
+                cost = costs[i]
+            else:
+                cost = costs[i] + slack * slack
+            if best is None or cost < best:
+                best = cost
+                breaks[j] = i
+        costs[j] = best
+    lines = []
+    j = nwords
+    while j:
+        i = breaks[j]
+        lines.append(text[starts[i]:ends[j - 1]])
+        j = i
+    return reversed(lines)
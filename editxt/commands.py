@@ -25,13 +25,20 @@ import Foundation as fn
 
 import editxt.constants as const
 from editxt.command.base import command, CommandError
-from editxt.command.parser import (Choice, Int, String, Regex, RegexPattern,
-    VarArgs, CommandParser, Options, SubArgs, SubParser)
-from editxt.command.util import has_selection, iterlines
+from editxt.command.parser import (Choice, File, Int, String, Regex,
+    RegexPattern, VarArgs, CommandParser, Options, SubArgs, SubParser)
+from editxt.command.util import (apply_edits, current_directory,
+    edit_selections, has_selection, iterlines, line_edits, resolve_path,
+    select_ranges, selected_ranges, text_length)
 
+from editxt.command.block import block_edit
 from editxt.command.changeindent import reindent
 from editxt.command.find import find
+from editxt.command.normalize import normalize_whitespace
+from editxt.command.script import run_script_file
 from editxt.command.sortlines import sort_lines
+from editxt.command.stats import command_stats
+from editxt.command.structure import expand_selection, goto_matching_bracket
 from editxt.command.wraplines import wrap_at_margin, wrap_lines
 
 log = logging.getLogger(__name__)
@@ -47,6 +54,7 @@ def load_commands():
         text_menu_commands=[
             show_command_bar,
             goto_line,
+            open_file,
             comment_text,
             pad_comment_text,
             indent_lines,
@@ -54,8 +62,14 @@ def load_commands():
             wrap_at_margin,
             wrap_lines,
             sort_lines,
+            block_edit,
             reindent,
+            normalize_whitespace,
+            expand_selection,
+            goto_matching_bracket,
             find,
+            run_script_file,
+            command_stats,
             clear_highlighted_text,
             reload_config,
             set_variable,
@@ -102,6 +116,21 @@ def goto_line(textview, sender, opts):
     textview.goto_line(opts.line)
 
 
+@command(name='open', arg_parser=CommandParser(
+    File("path", directory=current_directory)))
+def open_file(textview, sender, args):
+    """Open a file in the current editor
+
+    Relative paths are opened relative to the directory of the current
+    document.
+    """
+    from editxt import app
+    if args is None or not args.path:
+        app.open_path_dialog()
+        return
+    app.open_documents_with_paths([resolve_path(args.path, textview)])
+
+
 @command(title="(Un)comment Selected Lines",
     hotkey=(",", ak.NSCommandKeyMask),
     is_enabled=has_selection)
@@ -140,11 +169,10 @@ def _comment_text(textview, sender, args, pad):
         textview.doc_view.document.indent_size,
         pad,
     )
-    seltext = "".join(func(line, *args) for line in iterlines(text, sel))
-    if textview.shouldChangeTextInRange_replacementString_(sel, seltext):
-        textview.textStorage().replaceCharactersInRange_withString_(sel, seltext)
-        textview.setSelectedRange_((sel[0], len(seltext)))
-        textview.didChangeText()
+    delta = apply_edits(textview,
+        line_edits(text, sel, lambda line: func(line, *args)))
+    if delta is not None:
+        textview.setSelectedRange_((sel[0], sel[1] + delta))
 
 def is_comment_range(text, range, comment_token):
     comments = 0
@@ -208,22 +236,19 @@ def indent_lines(textview, sender, args):
         else:
             line_start = text.lineRangeForRange_(sel).location
             seltext = istr[:size - (sel.location - line_start) % size]
-        select = False
+        if textview.shouldChangeTextInRange_replacementString_(sel, seltext):
+            textview.textStorage().replaceCharactersInRange_withString_(sel, seltext)
+            textview.didChangeText()
+            textview.scrollRangeToVisible_((sel[0] + len(seltext), 0))
     else:
         def indent(line):
             if line.strip():
                 return istr + line
             return line.lstrip(" \t")
         sel = text.lineRangeForRange_(sel)
-        seltext = "".join(indent(line) for line in iterlines(text, sel))
-        select = True
-    if textview.shouldChangeTextInRange_replacementString_(sel, seltext):
-        textview.textStorage().replaceCharactersInRange_withString_(sel, seltext)
-        textview.didChangeText()
-        if select:
-            textview.setSelectedRange_((sel[0], len(seltext)))
-        else:
-            textview.scrollRangeToVisible_((sel[0] + len(seltext), 0))
+        delta = apply_edits(textview, line_edits(text, sel, indent))
+        if delta is not None:
+            textview.setSelectedRange_((sel[0], sel[1] + delta))
 
 
 @command(title="Un-indent Selected Lines", hotkey=("[", ak.NSCommandKeyMask))
@@ -243,12 +268,9 @@ def dedent_lines(textview, sender, args):
         return line[remove:]
     text = textview.string()
     sel = text.lineRangeForRange_(textview.selectedRange())
-    seltext = "".join(dedent(line) for line in iterlines(text, sel))
-    if len(seltext) != sel.length:
-        if textview.shouldChangeTextInRange_replacementString_(sel, seltext):
-            textview.textStorage().replaceCharactersInRange_withString_(sel, seltext)
-            textview.setSelectedRange_((sel[0], len(seltext)))
-            textview.didChangeText()
+    delta = apply_edits(textview, line_edits(text, sel, dedent))
+    if delta:
+        textview.setSelectedRange_((sel[0], sel[1] + delta))
 
 
 @command(title="Reload config")
@@ -319,61 +341,80 @@ _ws = re.compile(r"([\t ]+)", re.UNICODE | re.MULTILINE)
 
 def insert_newline(textview, sender, args):
     eol = textview.doc_view.document.eol
-    sel = textview.selectedRange()
-    text = textview.string()
-    if sel.location > 0:
-        i = text.rfind(eol, 0, sel[0])
-        i = 0 if i < 0 else (i + len(eol))
-        indent = _ws.match(text, i)
-        if indent:
-            eol += indent.group()[:sel[0]-i]
-        if i != sel[0]:
-            wslead = _ws.match(text, sel[0])
-            if wslead:
-                sel[1] += len(wslead.group())
-    if textview.shouldChangeTextInRange_replacementString_(sel, eol):
-        textview.textStorage().replaceCharactersInRange_withString_(sel, eol)
+    def edit(text, sel):
+        start, length = sel
+        newline = eol
+        if start > 0:
+            i = text.rfind(eol, 0, start)
+            i = 0 if i < 0 else (i + len(eol))
+            indent = _ws.match(text, i)
+            if indent:
+                newline += indent.group()[:start-i]
+            if i != start:
+                wslead = _ws.match(text, start)
+                if wslead:
+                    length += len(wslead.group())
+        return (start, length, newline)
+    if len(selected_ranges(textview)) > 1:
+        edit_selections(textview, edit)
+        return
+    start, length, newline = edit(textview.string(), textview.selectedRange())
+    replace_selection(textview, (start, length), newline)
+
+def replace_selection(textview, sel, string):
+    """Replace a single range of text and scroll to the end of it"""
+    if textview.shouldChangeTextInRange_replacementString_(sel, string):
+        textview.textStorage().replaceCharactersInRange_withString_(sel, string)
         textview.didChangeText()
-        textview.scrollRangeToVisible_((sel[0] + len(eol), 0))
+        end = sel[0] + text_length(textview, string)
+        textview.scrollRangeToVisible_((end, 0))
 
 def move_to_beginning_of_line(textview, sender, args):
     eol = textview.doc_view.document.eol
-    sel = textview.selectedRange()
     text = textview.string()
-    if sel[0] > 0:
-        i = text.rfind(eol, 0, sel[0])
-        i = 0 if i < 0 else (i + len(eol))
-    else:
-        i = 0
-    new = (i, 0)
-    wslead = _ws.match(text, i)
-    if wslead:
-        new = (wslead.end(), 0)
-    if new[0] == sel[0]:
+    carets = []
+    for sel in sorted(selected_ranges(textview)):
+        if sel[0] > 0:
+            i = text.rfind(eol, 0, sel[0])
+            i = 0 if i < 0 else (i + len(eol))
+        else:
+            i = 0
         new = (i, 0)
-    textview.setSelectedRange_(new)
-    textview.scrollRangeToVisible_(new)
+        wslead = _ws.match(text, i)
+        if wslead:
+            new = (wslead.end(), 0)
+        if new[0] == sel[0]:
+            new = (i, 0)
+        if not carets or carets[-1] != new:
+            carets.append(new)
+    select_ranges(textview, carets)
+    textview.scrollRangeToVisible_(carets[0])
 
 #def move_to_beginning_of_line_and_modify_selection(textview, sender, args):
 
 def delete_backward(textview, sender, args):
-    if textview.doc_view.document.indent_mode == const.INDENT_MODE_TAB:
+    mode = textview.doc_view.document.indent_mode
+    single = len(selected_ranges(textview)) < 2
+    if mode == const.INDENT_MODE_TAB and single:
         textview.deleteBackward_(sender)
         return
-    sel = textview.selectedRange()
-    if sel.length == 0:
-        if sel.location == 0:
-            return
-        text = textview.string()
+    size = textview.doc_view.document.indent_size
+    def edit(text, sel):
+        if sel[1] > 0:
+            return (sel[0], sel[1], "")
+        if sel[0] == 0:
+            return None
         i = sel[0]
-        while i > 0 and text[i - 1] == " ":
-            i -= 1
+        if mode == const.INDENT_MODE_SPACE:
+            while i > 0 and text[i - 1] == " ":
+                i -= 1
         delete = sel[0] - i
         if delete < 1:
-            delete = 1
+            # delete a whole character (never half of a surrogate pair)
+            return tuple(text.rangeOfComposedCharacterSequenceAtIndex_(
+                sel[0] - 1)) + ("",)
         elif delete > 1:
             i = text.lineRangeForRange_((i, 0))[0]
-            size = textview.doc_view.document.indent_size
             maxdel = (sel[0] - i) % size
             if maxdel == 0:
                 maxdel = size
@@ -381,8 +422,11 @@ def delete_backward(textview, sender, args):
                 delete = maxdel
             elif delete < sel[0] - i:
                 delete = 1
-        sel = (sel[0] - delete, delete)
-    if textview.shouldChangeTextInRange_replacementString_(sel, ""):
-        textview.textStorage().replaceCharactersInRange_withString_(sel, "")
-        textview.didChangeText()
-        textview.scrollRangeToVisible_((sel[0], 0))
+        return (sel[0] - delete, delete, "")
+    if not single:
+        edit_selections(textview, edit)
+        return
+    item = edit(textview.string(), textview.selectedRange())
+    if item is not None:
+        start, length, string = item
+        replace_selection(textview, (start, length), string)
@@ -48,6 +48,12 @@ def config_schema(): return {
         const.NEWLINE_MODE_WINDOWS,
         const.NEWLINE_MODE_UNICODE,
         default=const.NEWLINE_MODE_UNIX),
+    "on_save": {
+        "normalize_indent": Boolean(default=False),
+        "normalize_newlines": Boolean(default=False),
+        "strip_trailing_whitespace": Boolean(default=False),
+        "ensure_final_newline": Boolean(default=False),
+    },
     "right_margin": {
         "position": Integer(default=const.DEFAULT_RIGHT_MARGIN, minimum=0),
         "line_color": Color(default=get_color("E6E6E6")),
@@ -29,6 +29,7 @@ from editxt.constants import ERROR, HTML, INFO, LARGE_NUMBER_FOR_TEXT
 log = logging.getLogger(__name__)
 ACTIVATE = "activate"
 SHOULD_RESIZE = "should_resize"
+HISTORY_SEARCH = "  (history: {})"
 MESSAGE_COLORS = {INFO: None, ERROR: ak.NSColor.redColor()}
 
 class CommandView(ak.NSView):
@@ -48,10 +49,27 @@ class CommandView(ak.NSView):
         def text_did_change_handler(textview):
             if self.command is not None:
                 text = textview.string()
-                textview.placeholder = self.command.get_placeholder(text)
+                if self.history_search is not None:
+                    if text != self.history_search[0]:
+                        match = self.command.search_history(text)
+                        self.history_search = (text, 0, match)
+                    match = self.history_search[2]
+                    textview.placeholder = HISTORY_SEARCH.format(
+                        "no match" if match is None else match)
+                else:
+                    textview.placeholder = self.command.get_placeholder(text)
         self.input.text_did_change_handler = text_did_change_handler
+        def key_down_handler(textview, event):
+            if self.command is not None \
+                    and event.modifierFlags() & ak.NSControlKeyMask \
+                    and event.charactersIgnoringModifiers() == "r":
+                self.search_history()
+                return True
+            return False
+        self.input.key_down_handler = key_down_handler
         self.setHidden_(True)
         self.command = None
+        self.history_search = None
         self._last_completions = [None]
         ak.NSNotificationCenter.defaultCenter().addObserver_selector_name_object_(
             self, "resize:", SHOULD_RESIZE, self.input)
@@ -84,6 +102,7 @@ class CommandView(ak.NSView):
         self.window().makeFirstResponder_(self.input)
 
     def deactivate(self):
+        self.history_search = None
         if self.command is not None:
             self.command, command = None, self.command
             view = command.editor.current_view
@@ -118,6 +137,13 @@ class CommandView(ak.NSView):
     #    self.deactivate()
 
     def textView_doCommandBySelector_(self, textview, selector):
+        if self.history_search is not None:
+            if selector == "insertNewline:":
+                self.end_history_search(accept=True)
+                return True
+            self.end_history_search()
+            if selector == "cancelOperation:":
+                return True
         if selector == "cancelOperation:": # escape key
             self.deactivate()
             return True
@@ -171,7 +197,8 @@ class CommandView(ak.NSView):
                 index += 1
             assert len(text) >= index, (text, index)
             range = (index, len(text) - index)
-            word += " "
+            if not word.endswith("/"): # directory
+                word += " "
             if textview.shouldChangeTextInRange_replacementString_(range, word):
                 textview.replaceCharactersInRange_withString_(range, word)
                 textview.didChangeText()
@@ -182,7 +209,43 @@ class CommandView(ak.NSView):
     def textView_completions_forPartialWordRange_indexOfSelectedItem_(
             self, textview, words, range, item_index):
         words, default_index = self.get_completions(textview, range)[1:]
-        return [w + " " for w in words], default_index
+        # directory completions are not followed by a space
+        words = [(w if w.endswith("/") else w + " ") for w in words]
+        return words, default_index
+
+    def search_history(self):
+        """Search command history for the current input text (ctrl+r)
+
+        The best match is displayed after the search text. Type to
+        refine the search, press ctrl+r again for the next best match,
+        return to accept the match, or escape to end the search.
+        """
+        if self.history_search is None:
+            query, skip = self.input.string(), 0
+        else:
+            query, skip = self.history_search[0], self.history_search[1] + 1
+        match = self.command.search_history(query, skip)
+        if match is None:
+            ak.NSBeep()
+            if self.history_search is not None:
+                return
+        self.history_search = (query, skip, match)
+        self.input.textDidChange_(None)
+        self.input.setNeedsDisplay_(True)
+
+    def end_history_search(self, accept=False):
+        """End history search
+
+        :param accept: Replace input text with the matched history item
+        if true. Otherwise leave the search text in the input.
+        """
+        query, skip, match = self.history_search
+        self.history_search = None
+        if accept and match is not None:
+            self.input.setString_(match)
+        else:
+            self.input.textDidChange_(None)
+        self.input.setNeedsDisplay_(True)
 
     def navigate_history(self, forward=False):
         old_text = self.input.string()
@@ -231,6 +294,7 @@ class ContentSizedTextView(ak.NSTextView):
     def initWithFrame_(self, rect):
         super(ContentSizedTextView, self).initWithFrame_(rect)
         self.text_did_change_handler = lambda textview: None # no-op by default
+        self.key_down_handler = lambda textview, event: False # not handled
         #self.setAllowsUndo_(True)
         self.setVerticallyResizable_(True)
         self.setMaxSize_(ak.NSMakeSize(LARGE_NUMBER_FOR_TEXT, LARGE_NUMBER_FOR_TEXT))
@@ -342,6 +406,10 @@ class ContentSizedTextView(ak.NSTextView):
         self.textStorage().setAttributedString_(value)
         self.textDidChange_(None)
 
+    def keyDown_(self, event):
+        if not self.key_down_handler(self, event):
+            super(ContentSizedTextView, self).keyDown_(event)
+
     def textDidChange_(self, notification):
         self.text_did_change_handler(self)
         self.reset_preferred_height()
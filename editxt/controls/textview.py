@@ -26,6 +26,8 @@ import Foundation as fn
 
 from editxt import app
 from editxt.command.find import FindController
+from editxt.command.util import edit_selections
+from editxt.util import untested
 
 log = logging.getLogger(__name__)
 
@@ -74,6 +76,68 @@ class TextView(ak.NSTextView):
             return app.text_commander.is_textview_command_enabled(self, item)
         return super(TextView, self).validateUserInterfaceItem_(item)
 
+    # Multiple selections (carets) ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    _carets = None
+
+    @property
+    def carets(self):
+        """A list of selected `(location, length)` ranges or `None`
+
+        NSTextView does not keep more than one selected range if any of
+        them is empty, so multiple carets are tracked here (see
+        `editxt.command.util.select_ranges`). The first caret is the
+        selected range of the text view. Carets are discarded when the
+        selection is changed in any other way.
+        """
+        return self._carets
+
+    @carets.setter
+    def carets(self, value):
+        if value or self._carets:
+            self.setNeedsDisplay_(True)
+        self._carets = value
+
+    def setSelectedRanges_affinity_stillSelecting_(self, ranges, affinity, still):
+        if self._carets:
+            self.carets = None
+        super(TextView, self).setSelectedRanges_affinity_stillSelecting_(
+            ranges, affinity, still)
+
+    def insertText_(self, text):
+        if not self.carets:
+            super(TextView, self).insertText_(text)
+            return
+        self.insert_at_carets(text)
+
+    def insertText_replacementRange_(self, text, range):
+        if not self.carets or range[0] != fn.NSNotFound:
+            super(TextView, self).insertText_replacementRange_(text, range)
+            return
+        self.insert_at_carets(text)
+
+    def insert_at_carets(self, text):
+        if isinstance(text, fn.NSAttributedString):
+            text = text.string()
+        edit_selections(self, lambda txt, sel: (sel[0], sel[1], text))
+
+    @untested
+    def draw_carets(self, rect):
+        """Draw carets other than the one drawn by NSTextView"""
+        window = self.window()
+        if window is None:
+            return
+        self.insertionPointColor().set()
+        for caret in self.carets[1:]:
+            if caret[1]:
+                continue
+            crect = self.firstRectForCharacterRange_actualRange_(caret, None)[0]
+            crect = self.convertRect_fromView_(
+                window.convertRectFromScreen_(crect), None)
+            crect.size.width = 1
+            if ak.NSIntersectsRect(crect, rect):
+                ak.NSRectFill(crect)
+
     # Drag/drop ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def readSelectionFromPasteboard_type_(self, pasteboard, type_):
@@ -117,6 +181,8 @@ class TextView(ak.NSTextView):
             ak.NSRectFill(fn.NSMakeRect(guideX + 1, rect.origin.y, 10**7, rect.size.height))
             ak.NSGraphicsContext.currentContext().restoreGraphicsState()
         super(TextView, self).drawViewBackgroundInRect_(rect)
+        if self.carets:
+            self.draw_carets(rect)
 
     def setFrameSize_(self, size):
         """add space for scrolling beyond last line"""
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Directory listing cache for path completion
+
+Directories are read in background threads so completing paths on slow
+(network) file systems does not block the user interface. Listings are
+cached per directory and read again when the modification time of the
+directory changes. Names found by a scan that is still in progress are
+available before the scan is complete.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Maximum number of seconds to wait for a directory scan to complete
+SCAN_TIMEOUT = 0.05
+
+
+class DirectoryCache(object):
+    """Cache of directory listings
+
+    :param max_size: Maximum number of directory listings to keep.
+    :param check_interval: Minimum number of seconds between checks of
+    the modification time of a cached directory.
+    """
+
+    def __init__(self, max_size=50, check_interval=2.0):
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()
+        self.max_size = max_size
+        self.check_interval = check_interval
+
+    def get(self, path, timeout=SCAN_TIMEOUT):
+        """Get the names of entries in a directory
+
+        A background scan is started if the directory is not cached. A
+        cached listing is checked in the background (and scanned again
+        if its modification time changed) if it was last checked more
+        than ``check_interval`` seconds ago.
+
+        :param path: Directory path.
+        :param timeout: Number of seconds to wait for a scan in progress.
+        :returns: A tuple ``(names, complete)``. ``names`` is a sorted list
+        of entry names, directory names end with ``/``. ``complete`` is
+        false if the directory was still being scanned.
+        """
+        with self.lock:
+            listing = self.listings.pop(path, None)
+            if listing is None:
+                listing = Listing(path)
+                listing.scan()
+            elif listing.checked + self.check_interval < time.time():
+                listing.scan(check=True)
+            self.listings[path] = listing
+            while len(self.listings) > self.max_size:
+                self.listings.popitem(last=False)
+        return listing.get(timeout)
+
+    def clear(self):
+        with self.lock:
+            self.listings.clear()
+
+
+class Listing(object):
+    """Directory listing read in a background thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.names = None   # sorted names from last complete scan
+        self.found = []     # names found by scan in progress
+        self.mtime = None
+        self.checked = 0
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+
+    def scan(self, check=False):
+        """Start a background scan unless one is already in progress
+
+        :param check: Only scan if the modification time of the directory
+        changed since it was last scanned.
+        """
+        with self.lock:
+            if not self.idle.is_set():
+                return
+            self.idle.clear()
+            self.checked = time.time()
+        thread = threading.Thread(target=self._scan, args=(check,))
+        thread.daemon = True
+        thread.start()
+
+    def _scan(self, check):
+        try:
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if check and mtime == self.mtime:
+                    return
+                found = self.found = []
+                for name in iter_names(self.path):
+                    found.append(name)
+            except OSError as err:
+                log.debug("cannot list directory: %s", err)
+                mtime = None
+                found = []
+            with self.lock:
+                self.names = sorted(found)
+                self.found = []
+                self.mtime = mtime
+        finally:
+            self.idle.set()
+
+    def get(self, timeout=SCAN_TIMEOUT):
+        """Get names from the most recent scan
+
+        :returns: See ``DirectoryCache.get``.
+        """
+        complete = self.idle.wait(timeout)
+        with self.lock:
+            if self.names is not None:
+                return self.names, complete
+            return sorted(self.found), complete
+
+
+def iter_names(path):
+    """Iterate names of entries in directory
+
+    Names of directories end with ``/``. Entries are yielded as they are
+    read if ``os.scandir`` is available.
+    """
+    scandir = getattr(os, "scandir", None)
+    if scandir is None:
+        for name in os.listdir(path):
+            if os.path.isdir(os.path.join(path, name)):
+                name += "/"
+            yield name
+        return
+    for entry in scandir(path):
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        yield entry.name + "/" if is_dir else entry.name
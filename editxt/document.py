@@ -24,6 +24,7 @@ import os
 import objc
 import AppKit as ak
 import Foundation as fn
+from PyObjCTools import AppHelper
 # from NDAlias import NDAlias
 
 import editxt.constants as const
@@ -31,15 +32,19 @@ import editxt.constants as const
 from editxt import app
 from editxt.application import doc_id_gen
 from editxt.command.find import Finder, FindOptions
-from editxt.command.util import (calculate_indent_mode_and_size,
-    change_indentation, iterlines, replace_newlines)
+from editxt.command.normalize import normalize_text, save_options
+from editxt.command.util import (MIN_INDENT_CONFIDENCE, Utf16Offsets,
+    apply_edits, change_indentation, detect_file_indentation,
+    detect_indentation, iterlines, replace_newlines)
 from editxt.constants import TEXT_DOCUMENT, LARGE_NUMBER_FOR_TEXT
 from editxt.controls.alert import Alert
 from editxt.controls.linenumberview import LineNumberView
 from editxt.controls.statscrollview import StatusbarScrollView
 from editxt.controls.textview import TextView
+from editxt.structure import StructureIndex
 from editxt.syntax import SyntaxCache
-from editxt.util import KVOList, KVOProxy, KVOLink, untested, refactor
+from editxt.textdiff import diff_text
+from editxt.util import KVOList, KVOProxy, KVOLink, untested
 from editxt.util import fetch_icon, filestat, register_undo_callback
 
 log = logging.getLogger(__name__)
@@ -68,7 +73,19 @@ class TextDocumentView(fn.NSObject):
 
     @classmethod
     def create_with_state(cls, state):
-        dv = cls.create_with_path(state["path"])
+        """Create a document view that defers loading its document
+
+        The document is loaded when it is first accessed (normally when
+        the view is shown). An already-open document is used immediately.
+        """
+        path = state["path"]
+        url = fn.NSURL.fileURLWithPath_(path)
+        dc = ak.NSDocumentController.sharedDocumentController()
+        doc = dc.documentForURL_(url)
+        if doc is not None:
+            dv = cls.create_with_document(doc)
+        else:
+            dv = cls.alloc().init_with_path(path)
         dv.edit_state = state
         return dv
 
@@ -86,10 +103,25 @@ class TextDocumentView(fn.NSObject):
         self._documents = KVOList.alloc().init()
         self.id = next(doc_id_gen)
         self.project = None
+        self.unloaded_path = None
         self.document = document
         self.text_view = None
         self.scroll_view = None
         self.props = KVOProxy(self)
+        self._link_document(document)
+        return self
+
+    def init_with_path(self, path):
+        """Initialize a view of a document that has not been loaded yet
+
+        The document will be loaded by ``load_document()``, which is
+        called automatically when the document is first accessed.
+        """
+        self = self.init_with_document(None)
+        self.unloaded_path = path
+        return self
+
+    def _link_document(self, document):
         if isinstance(document, ak.NSDocument):
             # HACK this should not be conditional (but it is for tests)
             self.kvolink = KVOLink([
@@ -100,12 +132,48 @@ class TextDocumentView(fn.NSObject):
                 (document, "properties.character_encoding", self.props, "character_encoding"),
                 (document, "properties.highlight_selected_text", self.props, "highlight_selected_text"),
             ])
-        return self
+
+    def _get_document(self):
+        if self.unloaded_path is not None:
+            self.load_document()
+        return self._document
+    def _set_document(self, value):
+        self._document = value
+    document = property(_get_document, _set_document)
+
+    @property
+    def is_loaded(self):
+        """False if this view's document has not been loaded yet"""
+        return self.unloaded_path is None
+
+    def load_document(self):
+        """Load this view's document if it has not been loaded yet"""
+        path = self.unloaded_path
+        if path is not None:
+            doc = TextDocument.get_with_path(path)
+            self.unloaded_path = None
+            self._document = doc
+            self._link_document(doc)
+
+    def is_view_of_document(self, doc):
+        """Check if this is a view of the given document
+
+        This does not load the document of an unloaded view; the path of
+        the given document is compared with the path of the view instead.
+        """
+        if self.unloaded_path is not None:
+            url = doc.fileURL()
+            return url is not None and url.path() == self.unloaded_path
+        return self._document is doc
 
     def icon(self):
+        if self.unloaded_path is not None:
+            return fetch_icon(self.unloaded_path)
         return self.document.icon()
 
     def displayName(self):
+        if self.unloaded_path is not None:
+            return os.path.basename(self.unloaded_path)
         return self.document.displayName()
 
     def setDisplayName_(self, name):
@@ -130,11 +198,15 @@ class TextDocumentView(fn.NSObject):
 
     @property
     def file_path(self):
+        if self.unloaded_path is not None:
+            return self.unloaded_path
         url = self.document.fileURL()
         return (url.path() if url else None)
 
     @property
     def is_dirty(self):
+        if self.unloaded_path is not None:
+            return False
         return self.document.isDocumentEdited()
 
     def set_main_view_of_window(self, view, window):
@@ -341,7 +413,10 @@ class TextDocumentView(fn.NSObject):
         self.scroll_view.commandView.message(msg, self.text_view, msg_type)
 
     def perform_close(self, editor):
-        if list(app.iter_editors_with_view_of_document(self.document)) == [editor]:
+        if self.unloaded_path is not None:
+            # an unloaded document cannot have unsaved changes
+            editor.discard_and_focus_recent(self)
+        elif list(app.iter_editors_with_view_of_document(self.document)) == [editor]:
             info = app.context.put(editor)
             editor.current_view = self
             self.document.canCloseDocumentWithDelegate_shouldCloseSelector_contextInfo_(
@@ -356,6 +431,7 @@ class TextDocumentView(fn.NSObject):
             editor.discard_and_focus_recent(self)
 
     def close(self):
+        self.unloaded_path = None
         doc = self.document
         if self.project is not None and not self.project.closing:
             self.project.remove_document_view(self)
@@ -377,7 +453,10 @@ class TextDocumentView(fn.NSObject):
             self.document = None
 
     def __repr__(self):
-        name = 'N/A' if self.document is None else self.displayName()
+        if self._document is None and self.unloaded_path is None:
+            name = 'N/A'
+        else:
+            name = self.displayName()
         return '<%s 0x%x name=%s>' % (type(self).__name__, id(self), name)
 
     # TextView delegate ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -473,7 +552,14 @@ class TextDocument(ak.NSDocument):
         }
         self.text_storage = ak.NSTextStorage.alloc().initWithString_attributes_("", {})
         self.syntaxer = SyntaxCache()
+        self.structure = StructureIndex()
         self._filestat = None
+        self._watched_path = None
+        self._saving = False
+        self._saved_filestat = None
+        self._deferred_change = None
+        self.external_filestat = None
+        self.externally_modified = False
         self.props = KVOProxy(self)
         self.indent_mode = app.config["indent.mode"]
         self.indent_size = app.config["indent.size"] # should come from syntax definition
@@ -569,28 +655,104 @@ class TextDocument(ak.NSDocument):
             options.pop(ak.NSCharacterEncodingDocumentAttribute, None)
         return success, err
 
+    def saveToURL_ofType_forSaveOperation_delegate_didSaveSelector_contextInfo_(
+            self, url, doctype, operation, delegate, selector, info):
+        if operation in (ak.NSSaveOperation, ak.NSSaveAsOperation):
+            self.normalize_on_save()
+        super(TextDocument, self) \
+            .saveToURL_ofType_forSaveOperation_delegate_didSaveSelector_contextInfo_(
+                url, doctype, operation, delegate, selector, info)
+
+    def normalize_on_save(self):
+        """Normalize whitespace as configured by the on_save settings
+
+        The text is changed through a text view (if there is one) so the
+        change can be undone. Autosaves do not normalize whitespace.
+        """
+        options = save_options(app.config)
+        if options is None:
+            return
+        for view in app.iter_views_of_document(self):
+            if view.text_view is not None:
+                normalize_text(view.text_view, options)
+                break
+
+    def canAsynchronouslyWriteToURL_ofType_forSaveOperation_(
+            self, url, doctype, operation):
+        return True
+
     def dataOfType_error_(self, doctype, error):
-        range = fn.NSMakeRange(0, self.text_storage.length())
+        """Serialize the text of this document
+
+        When saving asynchronously this is called on a background thread
+        while user interaction is blocked. User interaction is unblocked
+        as soon as an immutable snapshot of the text has been taken, so
+        encoding the text and writing the file do not block the UI.
+        """
+        snapshot = self.text_storage.copy()
         attrs = self.document_attrs
-        data, err = self.text_storage \
-            .dataFromRange_documentAttributes_error_(range, attrs, None)
-        if err is None:
-            try:
-                self.update_syntaxer()
-                app.save_editor_states()
-            except Exception:
-                log.error("unexpected error", exc_info=True)
-#             if self.project is not None:
-#                 self.project.save()
-#                 self.updateSyntaxer()
-#             if self.text_view is not None:
-#                 # make the undo manager recognize edits after save
-#                 self.text_view.breakUndoCoalescing()
-        return (data, err)
+        self.unblockUserInteraction()
+        range = fn.NSMakeRange(0, snapshot.length())
+        return snapshot.dataFromRange_documentAttributes_error_(range, attrs, None)
+
+    def writeSafelyToURL_ofType_forSaveOperation_error_(
+            self, url, doctype, operation, error):
+        # called on a background thread when saving asynchronously
+        path = str(url.path())
+        self._saving = True
+        stat = None
+        try:
+            ok, err = super(TextDocument, self) \
+                .writeSafelyToURL_ofType_forSaveOperation_error_(
+                    url, doctype, operation, None)
+            if ok:
+                stat = filestat(path)
+        finally:
+            AppHelper.callAfter(self.save_finished, path, stat)
+        return ok, err
+
+    def save_finished(self, path, stat):
+        """Record the result of writing the file (on the main thread)
+
+        File change notifications caused by our own save are ignored by
+        comparing the `filestat` of the file with the one taken after it
+        was written. Notifications received while saving are handled
+        here, after that stat has been recorded.
+
+        :param path: The path of the written file.
+        :param stat: The result of `filestat(path)` taken after the file
+        was written, or None if the save failed.
+        """
+        self._saving = False
+        if stat is not None:
+            self._saved_filestat = (path, stat)
+            self.document_did_save()
+        change, self._deferred_change = self._deferred_change, None
+        if change is not None:
+            self.file_changed(*change)
+
+    def document_did_save(self):
+        """Update state after the document was saved (on the main thread)"""
+        try:
+            self.update_syntaxer()
+            app.schedule_save_editor_states()
+        except Exception:
+            log.error("unexpected error", exc_info=True)
 
     def setFileModificationDate_(self, date):
         super(TextDocument, self).setFileModificationDate_(date)
         self._filestat = None
+        self.externally_modified = False
+
+    def setFileURL_(self, url):
+        super(TextDocument, self).setFileURL_(url)
+        path = None if url is None else str(url.path())
+        if path != self._watched_path:
+            if self._watched_path is not None:
+                app.file_watcher.unwatch(self._watched_path, self.file_changed)
+            if path is not None:
+                app.file_watcher.watch(path, self.file_changed)
+            self._watched_path = path
 
     def analyze_content(self):
         text = self.text_storage.string()
@@ -599,11 +761,16 @@ class TextDocument(ak.NSDocument):
         if end != cend:
             eol = EOLREF.get(text[cend:end], const.NEWLINE_MODE_UNIX)
             self.newline_mode = eol
-        mode, size = calculate_indent_mode_and_size(text)
-        if size is not None:
-            self.indent_size = size
-        if mode is not None:
-            self.indent_mode = mode
+        url = self.fileURL()
+        if url is None:
+            info = detect_indentation(text)
+        else:
+            info = detect_file_indentation(str(url.path()), text)
+        if info.confidence >= MIN_INDENT_CONFIDENCE:
+            if info.size is not None:
+                self.indent_size = info.size
+            if info.mode is not None:
+                self.indent_mode = info.mode
 
     def is_externally_modified(self):
         """check if this document has been modified by another program"""
@@ -615,13 +782,49 @@ class TextDocument(ak.NSDocument):
                 return self.fileModificationDate() != mdate
         return None
 
+    def file_changed(self, path, stat):
+        """Handle file change notification from the file watcher
+
+        This is called on the main thread when the file of this document
+        is changed on disk. Changes made by our own save are ignored. If
+        the document is displayed in the key window it is checked for
+        external changes immediately; otherwise the check is deferred
+        until one of its views becomes active.
+
+        :param path: The path of the changed file.
+        :param stat: The result of `filestat(path)` taken on the file
+        watcher thread after the change.
+        """
+        if self._saving:
+            # the save may not have finished writing: check when it has
+            self._deferred_change = (path, stat)
+            return
+        # stat again: the notification may be stale by now
+        stat = filestat(path)
+        if (path, stat) == self._saved_filestat:
+            return # changed by our own save
+        self.external_filestat = stat
+        self.externally_modified = bool(self.is_externally_modified())
+        if not self.externally_modified:
+            return
+        for view in app.iter_views_of_document(self):
+            window = view.window()
+            if window is not None and window.isKeyWindow():
+                self.check_for_external_changes(window)
+                break
+
     def check_for_external_changes(self, window):
-        if not self.is_externally_modified():
+        """Reload or prompt to reload if the file was changed externally
+
+        External changes are detected by the file watcher (see
+        `file_changed`), so this method does no file system I/O.
+        """
+        if not self.externally_modified:
             return
         if self.isDocumentEdited():
             if window is None:
                 return # ignore change (no gui for alert)
-            stat = filestat(self.fileURL().path())
+            stat = self.external_filestat
             if self._filestat == stat:
                 return
             self._filestat = stat
@@ -637,13 +840,15 @@ class TextDocument(ak.NSDocument):
         else:
             self.reload_document()
 
-    @refactor("improve undo after reload - use difflib to replace changed text only")
     def reload_document(self):
         """Reload document with the given URL
 
-        This implementation allows the user to undo beyond the reload. The
-        down-side is that it may use a lot of memory if the document is very
-        large.
+        This implementation allows the user to undo beyond the reload. Only
+        the regions of text that changed are replaced, so the size of the
+        undo record and the amount of text that must be re-highlighted are
+        proportional to the size of the change rather than the size of the
+        document. All changed regions are replaced in a single edit, which
+        the text view may reject as a whole.
         """
         url = self.fileURL()
         if url is None or not os.path.exists(url.path()):
@@ -667,22 +872,29 @@ class TextDocument(ak.NSDocument):
             textview = view.text_view
             if textview is not None:
                 break
-        text = tempstore.string()
-        range = fn.NSRange(0, textstore.length())
+        # diff offsets are characters; NSTextStorage ranges are UTF-16
+        old = textstore.string()
+        offsets = Utf16Offsets(old)
+        edits = [offsets.utf16_range(range) + (text,)
+                 for range, text in diff_text(old, tempstore.string())]
         if textview is None:
-            textstore.replaceCharactersInRange_withString_(range, text)
+            textstore.beginEditing()
+            try:
+                for offset, length, text in reversed(edits):
+                    textstore.replaceCharactersInRange_withString_(
+                        (offset, length), text)
+            finally:
+                textstore.endEditing()
             undo.removeAllActions()
-        elif textview.shouldChangeTextInRange_replacementString_(range, text):
-            #state = self.documentState
-            textstore.replaceCharactersInRange_withString_(range, text)
-            #self.documentState = state
-            textview.didChangeText()
-            textview.breakUndoCoalescing()
-            # HACK use timed invocation to allow didChangeText notification
-            # to update change count before _clearUndo is invoked
-            self.performSelector_withObject_afterDelay_("_clearChanges", self, 0)
-            textview.setSelectedRange_(fn.NSRange(0, 0))
-            self.update_syntaxer()
+            return
+        if apply_edits(textview, edits) is None:
+            # nothing was changed, so the document is still modified
+            return
+        textview.breakUndoCoalescing()
+        # HACK use timed invocation to allow didChangeText notification
+        # to update change count before _clearUndo is invoked
+        self.performSelector_withObject_afterDelay_("_clearChanges", self, 0)
+        self.update_syntaxer()
 
     @untested
     def prepareSavePanel_(self, panel):
@@ -731,6 +943,7 @@ class TextDocument(ak.NSDocument):
         return self.syntaxer.syntaxdef
     def _set_syntaxdef(self, value):
         self.syntaxer.syntaxdef = value
+        self.structure.reset(value)
         self.syntaxer.color_text(self.text_storage)
     syntaxdef = property(_get_syntaxdef, _set_syntaxdef)
 
@@ -746,8 +959,18 @@ class TextDocument(ak.NSDocument):
                 self.syntaxer.color_text(self.text_storage)
 
     def textStorageDidProcessEditing_(self, notification):
-        range = self.text_storage.editedRange()
-        self.syntaxer.color_text(self.text_storage, range)
+        ts = self.text_storage
+        range = ts.editedRange()
+        if ts.editedMask() & ak.NSTextStorageEditedCharacters:
+            length = self.structure.edited_length
+            if length is not None:
+                # the edited range is UTF-16; the index counts characters
+                text = ts.string()
+                edited = range
+                if len(text) != ts.length():
+                    edited = Utf16Offsets(text).char_range(range)
+                self.structure.edited(edited, len(text) - length)
+        self.syntaxer.color_text(ts, range)
 
     def updateChangeCount_(self, ctype):
         super(TextDocument, self).updateChangeCount_(ctype)
@@ -769,6 +992,9 @@ class TextDocument(ak.NSDocument):
         # remove window controllers here so NSDocument does not close the windows
         for wc in list(self.windowControllers()):
             self.removeWindowController_(wc)
+        if self._watched_path is not None:
+            app.file_watcher.unwatch(self._watched_path, self.file_changed)
+            self._watched_path = None
         ts = self.text_storage
         if ts is not None and ts.delegate() is self:
             ts.setDelegate_(None)
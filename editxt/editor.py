@@ -109,6 +109,44 @@ class Editor(object):
             if 'window_settings' in state:
                 self.window_settings = state['window_settings']
             self.discard_and_focus_recent(None)
+            self.prefetch_recent_documents()
+
+    def prefetch_recent_documents(self, count=5, delay=0.1):
+        """Load documents of recently used views that are not yet loaded
+
+        Documents of restored views are normally loaded when the view is
+        first shown. This loads the documents of the most recently used
+        views ahead of time, one per run loop iteration, so switching to
+        them is fast without blocking the UI while the editor is opened.
+
+        :param count: The maximum number of documents to load.
+        :param delay: Seconds to wait before loading each document.
+        """
+        views = {}
+        for proj in self.projects:
+            for view in proj.documents():
+                views[view.id] = view
+        pending = []
+        for ident in reversed(list(self.recent)):
+            view = views.get(ident)
+            if view is not None and not view.is_loaded:
+                pending.append(view)
+                if len(pending) >= count:
+                    break
+        def load_next():
+            while pending:
+                view = pending.pop(0)
+                if not view.is_loaded:
+                    try:
+                        view.load_document()
+                    except Exception:
+                        log.warn("cannot load document: %s",
+                                 view.file_path, exc_info=True)
+                    break
+            if pending:
+                AppHelper.callLater(delay, load_next)
+        if pending:
+            AppHelper.callLater(delay, load_next)
 
     def __getstate__(self):
         if self._state is not None:
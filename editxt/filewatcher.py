@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Watch files for changes made by other programs
+
+File system events are received by a pluggable backend on a background
+thread. Events are coalesced per path and delivered to callbacks on the
+main thread, so checking a document for external changes does not
+require any file system I/O when a window becomes key.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from collections import defaultdict
+
+from PyObjCTools import AppHelper
+
+from editxt.util import filestat
+
+log = logging.getLogger(__name__)
+
+
+class FileWatcher(object):
+    """Dispatch file change notifications to callbacks on the main thread
+
+    :param backend: An object implementing the backend interface (see
+        `PollingBackend`). Defaults to the best backend available on
+        this platform.
+    :param call_on_main_thread: A function that schedules a callable
+        to be invoked on the main thread. Defaults to
+        `PyObjCTools.AppHelper.callAfter`.
+    """
+
+    def __init__(self, backend=None, call_on_main_thread=None):
+        self.backend = default_backend() if backend is None else backend
+        self.call_on_main_thread = call_on_main_thread or AppHelper.callAfter
+        self.callbacks = defaultdict(list)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def watch(self, path, callback):
+        """Watch path for changes
+
+        :param path: Path of file to watch.
+        :param callback: A callable to be invoked on the main thread when
+            the file changes. Signature: `callback(path, stat)` where
+            `stat` is the result of `editxt.util.filestat(path)`.
+        """
+        with self.lock:
+            callbacks = self.callbacks[path]
+            if callback in callbacks:
+                return
+            callbacks.append(callback)
+            add = len(callbacks) == 1
+        if add:
+            self.backend.add(path)
+        self.start()
+
+    def unwatch(self, path, callback):
+        """Stop calling callback when path changes"""
+        with self.lock:
+            callbacks = self.callbacks.get(path)
+            if not callbacks or callback not in callbacks:
+                return
+            callbacks.remove(callback)
+            if callbacks:
+                return
+            del self.callbacks[path]
+            self.pending.pop(path, None)
+        self.backend.remove(path)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = thread = threading.Thread(
+                target=self.backend.run,
+                args=(self.file_changed,),
+                name="editxt-file-watcher")
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            self.backend.stop()
+            thread.join()
+
+    def file_changed(self, path):
+        """Queue a change notification (called on the backend thread)"""
+        stat = filestat(path)
+        with self.lock:
+            if path not in self.callbacks:
+                return
+            schedule = not self.pending
+            self.pending[path] = stat
+        if schedule:
+            self.call_on_main_thread(self.dispatch)
+
+    def dispatch(self):
+        """Invoke callbacks for changed files (called on the main thread)"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            changes = [(path, stat, list(self.callbacks.get(path, ())))
+                       for path, stat in pending.items()]
+        for path, stat, callbacks in changes:
+            for callback in callbacks:
+                try:
+                    callback(path, stat)
+                except Exception:
+                    log.error("file change callback failed: %s", path,
+                              exc_info=True)
+
+
+def default_backend():
+    """Create the best file watcher backend for this platform
+
+    inotify is used on Linux. There is no kqueue or FSEvents backend
+    yet, so changes are detected by polling every two seconds on
+    Mac OS X (see `PollingBackend`).
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend()
+        except Exception:
+            log.warn("cannot initialize inotify backend", exc_info=True)
+    return PollingBackend()
+
+
+class PollingBackend(object):
+    """Detect changes by periodically calling `filestat` on each path
+
+    This is the portable fallback backend. The backend interface consists
+    of `add(path)`, `remove(path)`, `run(callback)` and `stop()`. `run`
+    is invoked on a background thread and should block, calling
+    `callback(path)` for each change, until `stop` is called.
+    """
+
+    UNKNOWN = object()
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def add(self, path):
+        with self.lock:
+            self.stats[path] = self.UNKNOWN
+
+    def remove(self, path):
+        with self.lock:
+            self.stats.pop(path, None)
+
+    def run(self, callback):
+        self.stopped.clear()
+        while True:
+            with self.lock:
+                paths = list(self.stats.items())
+            for path, old in paths:
+                new = filestat(path)
+                with self.lock:
+                    if path not in self.stats:
+                        continue
+                    self.stats[path] = new
+                if old is not self.UNKNOWN and new != old:
+                    callback(path)
+            if self.stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self.stopped.set()
+
+
+class InotifyBackend(object):
+    """Receive change events from the Linux inotify API
+
+    The parent directory of each file is watched (rather than the file
+    itself) so files that are replaced by rename (atomic save) continue
+    to be tracked.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.wakeup = os.pipe()
+        self.lock = threading.Lock()
+        self.dirs = {}                  # dirname -> watch descriptor
+        self.wds = {}                   # watch descriptor -> dirname
+        self.names = defaultdict(set)   # dirname -> set of watched names
+
+    def add(self, path):
+        dirname, name = os.path.split(path)
+        with self.lock:
+            if dirname not in self.dirs:
+                wd = self._add_watch(self.fd, os.fsencode(dirname), self.MASK)
+                if wd < 0:
+                    err = ctypes.get_errno()
+                    log.warn("cannot watch %s: %s", dirname, os.strerror(err))
+                    return
+                self.dirs[dirname] = wd
+                self.wds[wd] = dirname
+            self.names[dirname].add(name)
+
+    def remove(self, path):
+        dirname, name = os.path.split(path)
+        with self.lock:
+            names = self.names.get(dirname)
+            if names is None:
+                return
+            names.discard(name)
+            if not names:
+                del self.names[dirname]
+                wd = self.dirs.pop(dirname)
+                del self.wds[wd]
+                self._rm_watch(self.fd, wd)
+
+    def run(self, callback):
+        wakeup = self.wakeup[0]
+        while True:
+            readable = select.select([self.fd, wakeup], [], [])[0]
+            if wakeup in readable:
+                os.read(wakeup, 1)
+                break
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                continue
+            for path in self.iter_paths(data):
+                callback(path)
+
+    def iter_paths(self, data):
+        """Yield watched paths referenced by a buffer of inotify events"""
+        size = self.EVENT.size
+        index = 0
+        seen = set()
+        while index + size <= len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, index)
+            name = data[index + size:index + size + length].rstrip(b"\0")
+            index += size + length
+            with self.lock:
+                if mask & self.IN_Q_OVERFLOW:
+                    # events were dropped: report all watched paths
+                    paths = [os.path.join(d, n)
+                             for d, names in self.names.items() for n in names]
+                else:
+                    dirname = self.wds.get(wd)
+                    name = os.fsdecode(name)
+                    if dirname is None or name not in self.names[dirname]:
+                        continue
+                    paths = [os.path.join(dirname, name)]
+            for path in paths:
+                if path not in seen:
+                    seen.add(path)
+                    yield path
+
+    def stop(self):
+        os.write(self.wakeup[1], b"x")
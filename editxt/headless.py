@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Run text commands on plain files without the editor user interface
+
+`HeadlessTextView` implements the subset of the `NSTextView` interface
+that text commands use on top of a Python string, which allows the
+commands to be applied to files outside of the editor. `main` is a
+command line interface that runs a script of commands over many files
+in parallel with a pool of worker processes.
+"""
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import unicodedata
+from collections import namedtuple
+from optparse import OptionParser
+
+import editxt.constants as const
+from editxt.command.base import CommandError
+from editxt.command.script import parse_script, run_script
+from editxt.command.util import (MIN_INDENT_CONFIDENCE,
+    detect_file_indentation, detect_indentation, line_range)
+from editxt.structure import StructureIndex
+from editxt.syntax import PLAIN_TEXT, SyntaxFactory
+
+log = logging.getLogger(__name__)
+
+# values of the corresponding Foundation constants
+NSCaseInsensitiveSearch = 1
+NSBackwardsSearch = 4
+NSNotFound = sys.maxsize
+
+EOLREF = dict((ch, m) for m, ch in const.EOLS.items())
+
+# Syntax definitions bundled with EditXT
+SYNTAX_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "resources", const.SYNTAX_DEFS_DIR)
+
+_eol = re.compile("|".join(
+    eol for eol in sorted(const.EOLS.values(), key=len, reverse=True)))
+
+
+class Range(namedtuple("Range", ["location", "length"])):
+    """Python equivalent of NSRange"""
+    __slots__ = ()
+
+
+class Text(str):
+    """String with the `NSString` methods used by text commands"""
+
+    def length(self):
+        return len(self)
+
+    def lineRangeForRange_(self, range):
+        """Get the range of the lines containing the given range
+
+        The returned range includes the line ending of the last line.
+        """
+        return Range(*line_range(self, range))
+
+    def rangeOfComposedCharacterSequenceAtIndex_(self, index):
+        """Get the range of the character at index with combining marks"""
+        start = index
+        while start > 0 and unicodedata.combining(self[start]):
+            start -= 1
+        end = index + 1
+        while end < len(self) and unicodedata.combining(self[end]):
+            end += 1
+        return Range(start, end - start)
+
+    def rangeOfString_options_range_(self, string, options, range):
+        start, length = range
+        text = self[start:start + length]
+        if options & NSCaseInsensitiveSearch:
+            text = text.lower()
+            string = string.lower()
+        if options & NSBackwardsSearch:
+            index = text.rfind(string)
+        else:
+            index = text.find(string)
+        if index < 0 or not string:
+            return Range(NSNotFound, 0)
+        return Range(start + index, len(string))
+
+
+class HeadlessDocument(object):
+    """Document settings used by text commands
+
+    Indentation and newline settings are detected from the text in the
+    same way as for documents opened in the editor.
+    """
+
+    def __init__(self, text="", comment_token=PLAIN_TEXT.comment_token,
+            indent_mode=const.INDENT_MODE_SPACE, indent_size=4,
+            newline_mode=const.NEWLINE_MODE_UNIX):
+        self.comment_token = comment_token
+        self.indent_mode = indent_mode
+        self.indent_size = indent_size
+        self.newline_mode = newline_mode
+        self.structure = StructureIndex()
+        self.props = self
+        self.analyze_content(text)
+
+    @property
+    def newline_mode(self):
+        return self._newline_mode
+    @newline_mode.setter
+    def newline_mode(self, value):
+        self._newline_mode = value
+        self.eol = const.EOLS[value]
+
+    def analyze_content(self, text):
+        match = _eol.search(text)
+        if match is not None:
+            self.newline_mode = EOLREF.get(
+                match.group(), const.NEWLINE_MODE_UNIX)
+        info = detect_indentation(text)
+        if info.confidence >= MIN_INDENT_CONFIDENCE:
+            if info.size is not None:
+                self.indent_size = info.size
+            if info.mode is not None:
+                self.indent_mode = info.mode
+
+    def reset_text_attributes(self, indent_size):
+        pass
+
+    def default_text_attributes(self):
+        return {}
+
+
+class HeadlessDocView(object):
+
+    def __init__(self, document, file_path=None):
+        self.document = document
+        self.file_path = file_path
+        self.props = document
+
+
+class HeadlessTextView(object):
+    """Text view for running text commands on a string
+
+    The entire text is selected initially so commands that operate on
+    the selection apply to all of the text.
+
+    Replacements made between `beginEditing` and `endEditing` from the
+    end of the text toward the beginning (as done by `apply_edits`) are
+    deferred and joined in a single pass when editing ends or the text
+    is accessed.
+
+    :param text: The initial text.
+    :param document: A `HeadlessDocument`. One is created for the
+    text if not given.
+    :param file_path: The path of the file being edited (if any).
+    """
+
+    def __init__(self, text, document=None, file_path=None):
+        if document is None:
+            document = HeadlessDocument(text)
+        self._text = text
+        self._editing = 0
+        self._pending = []
+        self.doc_view = HeadlessDocView(document, file_path)
+        self.setSelectedRange_((0, len(text)))
+        self.modified = False
+
+    @property
+    def text(self):
+        if self._pending:
+            self._flush()
+        return self._text
+
+    def string(self):
+        return Text(self.text)
+
+    def selectedRange(self):
+        return self.selection
+
+    def setSelectedRange_(self, range):
+        self.selection = Range(*range)
+        self.selections = [self.selection]
+
+    def selectedRanges(self):
+        return self.selections
+
+    def setSelectedRanges_(self, ranges):
+        self.selections = [Range(*r) for r in ranges]
+        self.selection = self.selections[0]
+
+    def shouldChangeTextInRange_replacementString_(self, range, string):
+        return True
+
+    def shouldChangeTextInRanges_replacementStrings_(self, ranges, strings):
+        return True
+
+    def textStorage(self):
+        return self
+
+    def undoManager(self):
+        return self
+
+    def length(self):
+        return len(self.text)
+
+    def beginEditing(self):
+        self._editing += 1
+
+    def endEditing(self):
+        self._editing -= 1
+        if not self._editing and self._pending:
+            self._flush()
+
+    def replaceCharactersInRange_withString_(self, range, string):
+        start, length = range
+        if self._editing:
+            pending = self._pending
+            if not pending or start + length <= pending[-1][0]:
+                pending.append((start, length, string))
+                return
+        text = self.text
+        self._text = text[:start] + string + text[start + length:]
+        self._edited(start, length, string)
+        if self._text != text:
+            self.modified = True
+
+    def _edited(self, start, length, string):
+        change = len(string) - length
+        self.doc_view.document.structure.edited((start, len(string)), change)
+
+    def _flush(self):
+        text = self._text
+        fragments = []
+        end = len(text)
+        for start, length, string in self._pending:
+            fragments.append(text[start + length:end])
+            fragments.append(string)
+            end = start
+            self._edited(start, length, string)
+        fragments.append(text[:end])
+        fragments.reverse()
+        self._pending = []
+        self._text = "".join(fragments)
+        if self._text != text:
+            self.modified = True
+
+    def _noop(self, *args):
+        pass
+
+    # undo manager methods
+    beginUndoGrouping = endUndoGrouping = setActionName_ = _noop
+
+    # display methods
+    didChangeText = setNeedsDisplay_ = scrollRangeToVisible_ = _noop
+
+
+class HeadlessSender(object):
+    """Sender passed to text commands"""
+
+    def __init__(self, text_commander):
+        self.text_commander = text_commander
+
+    def message(self, msg, msg_type=const.INFO):
+        if isinstance(msg, Exception):
+            raise msg
+        log.info(msg)
+
+
+def load_text_commander():
+    """Create a text command controller with the built-in commands"""
+    from editxt.textcommand import TextCommandController
+    class menu:
+        @staticmethod
+        def insertItem_atIndex_(item, tag):
+            pass
+    commander = TextCommandController([])
+    commander.load_commands(menu)
+    return commander
+
+
+def process_text(text, commands, text_commander, file_path=None,
+        comment_token=PLAIN_TEXT.comment_token):
+    """Run parsed commands (see `parse_script`) on text
+
+    :returns: The transformed text.
+    """
+    document = HeadlessDocument(text, comment_token)
+    textview = HeadlessTextView(text, document, file_path)
+    run_script(commands, [textview], HeadlessSender(text_commander))
+    return textview.text
+
+
+class FileProcessor(object):
+    """Run a script of text commands on files
+
+    Files are read and written as UTF-8 without newline translation.
+
+    :param script: Text of the script to run.
+    :param syntax_dirs: Directories of syntax definitions, which are
+    used to find the comment token of each file. Definitions bundled
+    with EditXT are loaded first, so these may override them.
+    :param dry_run: Do not write changed files if true.
+    """
+
+    def __init__(self, script, syntax_dirs=(), dry_run=False):
+        self.text_commander = load_text_commander()
+        self.commands = parse_script(script, self.text_commander)
+        self.syntax_factory = SyntaxFactory()
+        for path in (SYNTAX_DIR,) + tuple(syntax_dirs):
+            self.syntax_factory.load_definitions(path, False)
+        self.dry_run = dry_run
+
+    def comment_token(self, path):
+        sdef = self.syntax_factory.get_definition(os.path.basename(path))
+        return sdef.comment_token
+
+    def __call__(self, path):
+        """Process a single file
+
+        :returns: A tuple `(path, changed, error)`; `error` is a
+        message or `None`.
+        """
+        try:
+            with open(path, encoding="utf-8", newline="") as fh:
+                text = fh.read()
+            result = process_text(text, self.commands, self.text_commander,
+                os.path.abspath(path), self.comment_token(path))
+            changed = result != text
+            if changed and not self.dry_run:
+                with open(path, "w", encoding="utf-8", newline="") as fh:
+                    fh.write(result)
+        except (CommandError, IOError, UnicodeError) as err:
+            return path, False, str(err)
+        except Exception as err:
+            log.error("cannot process %s", path, exc_info=True)
+            return path, False, "unexpected error: {}".format(err)
+        return path, changed, None
+
+
+_processor = None
+
+def _init_worker(*args):
+    global _processor
+    _processor = FileProcessor(*args)
+
+def _process_file(path):
+    return _processor(path)
+
+
+def process_files(paths, script, syntax_dirs=(), dry_run=False, jobs=None):
+    """Run a script of text commands on many files in parallel
+
+    The script is parsed once in each worker process.
+
+    :param jobs: Number of worker processes. Defaults to the number of
+    CPUs. Files are processed in the current process if this is one.
+    :returns: An iterator of `(path, changed, error)` tuples in
+    completion order.
+    :raises: `CommandError` if the script cannot be parsed.
+    """
+    args = (script, syntax_dirs, dry_run)
+    processor = FileProcessor(*args) # validate script
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or len(paths) < 2:
+        for path in paths:
+            yield processor(path)
+        return
+    chunksize = max(1, len(paths) // (jobs * 4))
+    pool = multiprocessing.Pool(jobs, _init_worker, args)
+    try:
+        for result in pool.imap_unordered(_process_file, paths, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _detect_indentation(path):
+    return path, detect_file_indentation(path)
+
+
+def iter_tree_files(root):
+    """Iterate over paths of files in a directory tree
+
+    Hidden files and directories (names beginning with a dot) are
+    skipped.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(n for n in dirnames if not n.startswith("."))
+        for name in sorted(filenames):
+            if not name.startswith("."):
+                yield os.path.join(dirpath, name)
+
+
+def analyze_indentation(paths, jobs=None):
+    """Detect indentation of many files in parallel
+
+    :param paths: A list of file paths. Use `iter_tree_files` to
+    analyze a project tree.
+    :param jobs: Number of worker processes. Defaults to the number of
+    CPUs. Files are analyzed in the current process if this is one.
+    :returns: An iterator of `(path, Indentation)` tuples in completion
+    order. See `editxt.command.util.detect_file_indentation`.
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or len(paths) < 2:
+        for path in paths:
+            yield _detect_indentation(path)
+        return
+    chunksize = max(1, len(paths) // (jobs * 4))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(_detect_indentation, paths, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(args):
+    parser = OptionParser(
+        description="Run EditXT text commands on files",
+        usage="usage: %prog [options] FILE ...",
+    )
+    parser.add_option("-c", "--command", action="append", default=[],
+        help="Command to run (command bar syntax). May be repeated.")
+    parser.add_option("-s", "--script",
+        help="File containing commands to run, one per line.")
+    parser.add_option("-j", "--jobs", type="int",
+        help="Number of worker processes (default: number of CPUs).")
+    parser.add_option("-n", "--dry-run", action="store_true",
+        help="List files that would change without writing them.")
+    parser.add_option("--syntax-dir", action="append", default=[],
+        help="Directory of syntax definitions used to find comment tokens "
+             "in addition to the bundled definitions. May be repeated.")
+
+    options, paths = parser.parse_args(args)
+    script = list(options.command)
+    if options.script:
+        with open(options.script, encoding="utf-8") as fh:
+            script.append(fh.read())
+    if not script:
+        parser.error("no commands given")
+    if not paths:
+        parser.error("no files given")
+
+    status = 0
+    try:
+        results = process_files(paths, "\n".join(script),
+            options.syntax_dir, options.dry_run, options.jobs)
+        for path, changed, error in results:
+            if error is not None:
+                print("{}: {}".format(path, error), file=sys.stderr)
+                status = 1
+            elif changed:
+                print(path)
+    except CommandError as err:
+        print("error: {}".format(err), file=sys.stderr)
+        return 2
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
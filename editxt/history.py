@@ -19,7 +19,17 @@
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
 import json
 import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from heapq import heappush, heapreplace, merge
+from itertools import accumulate, chain, count
+from math import log2
 from os.path import exists, join
+from zlib import crc32
 
 from editxt.util import WeakProperty
 
@@ -27,23 +37,93 @@ log = logging.getLogger(__name__)
 
 
 class History(object):
-    """A persistent ordered list of JSON-serializable items"""
+    """A persistent ordered list of JSON-serializable items
+
+    History is stored in an append-only log file. Each line in the log
+    is a JSON record prefixed with a checksum; records that fail the
+    checksum (a torn write, for example) are skipped when the log is
+    loaded. The log is replayed once, when the history is first
+    accessed, and history is served from memory after that. The log is
+    compacted in the background when it grows well beyond the number of
+    records needed to restore history.
+
+    Items are kept in pages of at most ``page_size`` items, and at most
+    ``max_pages`` pages are kept. An index of items by name (the first
+    word of text items) is maintained to make lookups of items for a
+    particular command proportional to the number of items for that
+    command rather than the total number of items in history.
+    """
 
     NAME = "history"
+    LOG_FILENAME = "{}.log"
+    # legacy page files, which are converted to a log when loaded
     INDEX_FILENAME = "{}-index.json"
     FILENAME_PATTERN = "{}-{}.txt"
 
+    SYNC_INTERVAL = 5.0 # minimum seconds between fsync calls
+    COMPACT_FACTOR = 2 # compact when log has this many times max records
+
     def __init__(self, store_dir, page_size=100, max_pages=10, name=NAME):
         self.store_dir = store_dir
         self.name = name
         self.page_size = page_size
         self.max_pages = max_pages
-        self.pages = None
         self.zeropage = None
-        self.zerofile = None
+        self.older_pages = None
+        self.index = None
         self.views = set()
+        self.lock = threading.RLock()
+        self.logfile = None
+        self.log_records = 0
+        self.log_torn = False
+        self.last_sync = 0
+        self.since_snapshot = None
+        self.compactor = None
+        self.version = 0
+        self.search_index = None
+
+    @property
+    def log_path(self):
+        return join(self.store_dir, self.LOG_FILENAME.format(self.name))
 
     def _initialize(self):
+        self.zeropage = []
+        self.older_pages = [[] for i in range(self.max_pages - 1)]
+        # index sequence numbers of items, parallel to zeropage + older_pages
+        self.seqs = [[] for i in range(self.max_pages)]
+        self.sequence = count()
+        self.index = {}
+        if exists(self.log_path):
+            self._load_log()
+        else:
+            pages = self._load_legacy_pages()
+            if any(pages):
+                for page in reversed(pages):
+                    self._push_page(page)
+                self.compact()
+
+    def _load_log(self):
+        path = self.log_path
+        try:
+            with open(path, encoding="utf-8") as fh:
+                line = ""
+                for i, line in enumerate(fh):
+                    record = self._decode(line)
+                    if record is None:
+                        log.warn("skipped corrupt record on line %s in %s",
+                                 i + 1, path)
+                        continue
+                    try:
+                        self._apply(record)
+                    except Exception as err:
+                        log.warn("cannot apply record on line %s in %s: %s",
+                                 i + 1, path, err)
+                    self.log_records += 1
+                self.log_torn = bool(line) and not line.endswith("\n")
+        except Exception:
+            log.warn("cannot load %s", path, exc_info=True)
+
+    def _load_legacy_pages(self):
         self.pages = []
         index_file = join(self.store_dir, self.INDEX_FILENAME.format(self.name))
         if exists(index_file):
@@ -63,14 +143,10 @@ class History(object):
         elif len(self.pages) > self.max_pages:
             del self.pages[self.max_pages:]
         assert len(self.pages) == self.max_pages, repr(self.pages)
-        self.zerofile = self.pages[0]
-        self.zeropage = next(self.iter_pages(0))
-        zeropath = join(self.store_dir, self.zerofile)
-        if exists(zeropath) and not self.zeropage:
-            with open(zeropath, "w", encoding="utf-8") as fh:
-                pass # truncate corrupt page file
+        return list(self.iter_pages(0))
 
     def iter_pages(self, start=1):
+        """Iterate over legacy history pages"""
         assert start > -1, start
         for pagefile in self.pages[start:]:
             pagepath = join(self.store_dir, pagefile)
@@ -87,83 +163,285 @@ class History(object):
             else:
                 yield []
 
-    def __iter__(self):
-        if self.zeropage is None:
-            self._initialize()
-        for item in reversed(self.zeropage):
-            yield item
-        for page in self.iter_pages():
-            for item in reversed(page):
-                yield item
+    @staticmethod
+    def _encode(record):
+        data = json.dumps(record)
+        return "{:08x} {}\n".format(crc32(data.encode("utf-8")), data)
 
-    def iter_matching(self, predicate):
-        """Iterate items matching predicate"""
-        return filter(predicate, iter(self))
+    @staticmethod
+    def _decode(line):
+        """Decode a log record
 
-    def append(self, item):
-        """Append an item to history
+        :returns: The record or ``None`` if the line is not valid.
+        """
+        checksum, space, data = line.rstrip("\n").partition(" ")
+        if space and len(checksum) == 8:
+            try:
+                if int(checksum, 16) == crc32(data.encode("utf-8")):
+                    return json.loads(data)
+            except ValueError:
+                pass
+        return None
+
+    def _apply(self, record):
+        """Apply a log record to the in-memory history"""
+        op, value = record
+        if op == "a":
+            self._append(value)
+        elif op == "d":
+            self._delete(value)
+        elif op == "p":
+            self._push_page(list(value))
+        else:
+            raise ValueError("unknown record: {!r}".format(record))
+
+    def _write(self, record):
+        """Append a record to the log
+
+        The log file is flushed after each record, but it is only synced
+        to disk at most once every ``SYNC_INTERVAL`` seconds.
+        """
+        line = self._encode(record)
+        with self.lock:
+            try:
+                if self.logfile is None:
+                    self.logfile = open(self.log_path, "a", encoding="utf-8")
+                if self.log_torn:
+                    # terminate partial record left by an interrupted write
+                    self.logfile.write("\n")
+                    self.log_torn = False
+                self.logfile.write(line)
+                self.logfile.flush()
+                now = time.time()
+                if now - self.last_sync > self.SYNC_INTERVAL:
+                    os.fsync(self.logfile.fileno())
+                    self.last_sync = now
+            except Exception:
+                log.warn("cannot write to history: %s", self.log_path, exc_info=True)
+                return
+            self.log_records += 1
+            if self.since_snapshot is not None:
+                self.since_snapshot.append(line)
+            max_records = self.page_size * self.max_pages * self.COMPACT_FACTOR
+            if self.log_records > max_records and self.compactor is None:
+                self.compactor = threading.Thread(
+                    target=self.compact, name="history-compactor")
+                self.compactor.daemon = True
+                self.compactor.start()
+
+    def compact(self):
+        """Rewrite the log with only the records needed to restore history
 
-        This causes the history to be saved to disk. If item already
-        exists in history it will be moved to the the most recent item,
-        and the older item will be removed (this only applies to the
-        first page of history).
+        This is normally done on a background thread. Records written
+        while the log is being compacted are copied to the new log before
+        it replaces the old log.
         """
         if self.zeropage is None:
             self._initialize()
+        with self.lock:
+            pages = [list(page) for page in reversed(self.older_pages)]
+            pages.append(list(self.zeropage))
+            self.since_snapshot = []
+        path = self.log_path
+        temp = path + ".tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as fh:
+                for page in pages:
+                    fh.write(self._encode(["p", page]))
+                fh.flush()
+                with self.lock:
+                    since = self.since_snapshot
+                    fh.writelines(since)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                    fh.close()
+                    if self.logfile is not None:
+                        self.logfile.close()
+                        self.logfile = None
+                    os.replace(temp, path)
+                    self.log_records = len(pages) + len(since)
+                    self.log_torn = False
+        except Exception:
+            log.warn("cannot compact history: %s", path, exc_info=True)
+        finally:
+            with self.lock:
+                self.since_snapshot = None
+                self.compactor = None
+
+    def close(self):
+        """Sync and close the history log"""
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+        with self.lock:
+            if self.logfile is not None:
+                try:
+                    self.logfile.flush()
+                    os.fsync(self.logfile.fileno())
+                except Exception:
+                    log.warn("cannot sync %s", self.log_path, exc_info=True)
+                finally:
+                    self.logfile.close()
+                    self.logfile = None
+
+    @staticmethod
+    def _item_name(item):
+        """Get the name of an item, which is used as its index key"""
+        if isinstance(item, str):
+            return item.split(" ", 1)[0]
+        return None
+
+    def _index_add(self, item):
+        """Add (newest) item to index
+
+        :returns: The sequence number of the item in the index.
+        """
+        key = self._item_name(item)
+        bucket = self.index.get(key)
+        if bucket is None:
+            bucket = self.index[key] = deque()
+        seq = next(self.sequence)
+        bucket.appendleft((-seq, item))
+        return seq
+
+    def _index_discard(self, item, seq):
+        """Remove item from index
+
+        :param seq: The sequence number of the item in the index (see
+        ``_index_add``).
+        """
+        key = self._item_name(item)
+        bucket = self.index[key]
+        # buckets are ordered by sequence number (newest first)
+        i = bisect_left(bucket, (-seq,))
+        assert bucket[i] == (-seq, item), (bucket[i], seq, item)
+        del bucket[i]
+        if not bucket:
+            del self.index[key]
+
+    def _push_page(self, page):
+        """Make page the most recent page, and drop the oldest page"""
+        self.older_pages.insert(0, self.zeropage)
+        for old_item, seq in zip(self.older_pages.pop(), self.seqs.pop()):
+            self._index_discard(old_item, seq)
+        self.zeropage = page
+        self.seqs.insert(0, [self._index_add(item) for item in page])
+
+    def _append(self, item):
+        """Append item to the in-memory history
+
+        :returns: A tuple ``(moved, removed)``. See ``HistoryView.update``.
+        """
         zero = self.zeropage
+        seqs = self.seqs[0]
         moved = None
         removed = []
         try:
-            moved = zero.index(item)
+            moved = pos = zero.index(item)
         except ValueError:
             pass
         else:
-            zero.remove(item)
             while True:
+                del zero[pos]
+                self._index_discard(item, seqs.pop(pos))
                 try:
-                    removed.append(zero.index(item))
+                    pos = zero.index(item)
                 except ValueError:
                     break
-                zero.remove(item)
-        if moved is not None:
-            for view in self.views:
-                view.update(moved, removed)
-            # rewrite entire file because an item was moved
-            zero.append(item)
-            zeropath = join(self.store_dir, self.zerofile)
-            try:
-                with open(zeropath, "w", encoding='utf-8') as fh:
-                    for item in zero:
-                        json.dump(item, fh)
-                        fh.write("\n")
-            except Exception:
-                log.warn("cannot write to history: %s", zeropath, exc_info=True)
-            assert len(zero) <= self.page_size, repr(zero)
-            return
-        if len(zero) < self.page_size:
-            zero.append(item)
-            mode = "a"
+                removed.append(pos)
+        if moved is None and len(zero) >= self.page_size:
+            self._push_page([])
+            zero = self.zeropage
+            seqs = self.seqs[0]
+        zero.append(item)
+        seqs.append(self._index_add(item))
+        assert len(zero) <= self.page_size, repr(zero)
+        return moved, removed
+
+    def _locate(self, index):
+        """Get a tuple ``(page, seqs, position)`` of the item at index
+
+        :returns: The page containing the item, the index sequence
+        numbers of the items in the page, and the position of the item
+        in the page or ``(None, None, None)`` if index is out of range.
+        """
+        if index >= 0:
+            pages = chain([self.zeropage], self.older_pages)
+            for page, seqs in zip(pages, self.seqs):
+                if index < len(page):
+                    return page, seqs, len(page) - index - 1
+                index -= len(page)
+        return None, None, None
+
+    def _delete(self, index):
+        page, seqs, pos = self._locate(index)
+        if page is None:
+            raise IndexError(index)
+        item = page.pop(pos)
+        self._index_discard(item, seqs.pop(pos))
+
+    def __iter__(self):
+        if self.zeropage is None:
+            self._initialize()
+        for item in reversed(self.zeropage):
+            yield item
+        for page in self.older_pages:
+            for item in reversed(page):
+                yield item
+
+    def iter_matching(self, predicate):
+        """Iterate items matching predicate"""
+        return filter(predicate, iter(self))
+
+    def iter_by_name(self, names):
+        """Iterate items having one of the given names
+
+        The name of a text item is its first word (the text up to the
+        first space). Items are yielded in history order (most recent
+        first).
+
+        :param names: A sequence of names.
+        """
+        if self.zeropage is None:
+            self._initialize()
+        buckets = [self.index[name] for name in set(names) if name in self.index]
+        if len(buckets) == 1:
+            items = iter(buckets[0])
         else:
-            self.zeropage = zero = [item]
-            self.zerofile = self.pages.pop()
-            self.pages.insert(0, self.zerofile)
-            index_name = self.INDEX_FILENAME.format(self.name)
-            index_file = join(self.store_dir, index_name)
-            try:
-                with open(index_file, "w", encoding='utf-8') as fh:
-                    json.dump(self.pages, fh)
-            except Exception:
-                log.warn("cannot write %s", index_file, exc_info=True)
-            mode = "w"
+            items = merge(*buckets)
+        return (item for seq, item in items)
+
+    def iter_with_prefix(self, prefix):
+        """Iterate text items starting with prefix (most recent first)
+
+        The name index is used if prefix contains a complete name
+        (i.e., a space); otherwise all items are scanned.
+        """
+        if " " in prefix:
+            items = self.iter_by_name([prefix.split(" ", 1)[0]])
+        else:
+            items = (item for item in self if isinstance(item, str))
+        return (item for item in items if item.startswith(prefix))
+
+    def append(self, item):
+        """Append an item to history
+
+        This causes the item to be appended to the history log. If item
+        already exists in history it will be moved to the the most
+        recent item, and the older item will be removed (this only
+        applies to the first page of history).
+        """
+        if self.zeropage is None:
+            self._initialize()
+        with self.lock:
+            moved, removed = self._append(item)
+            self._write(["a", item])
+            self.version += 1
         for view in self.views:
-            view.update()
-        zeropath = join(self.store_dir, self.zerofile)
-        try:
-            with open(zeropath, mode, encoding='utf-8') as fh:
-                json.dump(item, fh)
-                fh.write("\n")
-        except Exception:
-            log.warn("cannot write to history: %s", zeropath, exc_info=True)
+            if moved is None:
+                view.update()
+            else:
+                view.update(moved, removed)
 
     def __getitem__(self, index):
         """Get item by index
@@ -174,23 +452,43 @@ class History(object):
         """
         if self.zeropage is None:
             self._initialize()
-        zero = self.zeropage
-        if index < len(zero):
-            return zero[len(zero) - index - 1]
-        index -= len(zero)
-        for page in self.iter_pages():
-            if index >= len(page):
-                index -= len(page)
-                continue
-            return page[len(page) - index - 1]
-        return None
+        page, seqs, pos = self._locate(index)
+        if page is None:
+            return None
+        return page[pos]
 
     def __delitem__(self, index):
         """Remove item from history by index
 
         :param index: Integer index of item in history.
+        :raises: IndexError if index does not reference a valid item.
         """
-        raise NotImplementedError
+        if self.zeropage is None:
+            self._initialize()
+        with self.lock:
+            self._delete(index)
+            self._write(["d", index])
+            self.version += 1
+        for view in self.views:
+            view.item_removed(index)
+
+    def search(self, query, limit=10):
+        """Fuzzy search history
+
+        Items containing all characters of the query in order match.
+        Matches are ranked by match quality and recency. The search is
+        case-insensitive unless query contains upper case characters.
+
+        :param query: Search string.
+        :param limit: Maximum number of items to return.
+        :returns: A list of unique matching text items, best match first.
+        """
+        if self.zeropage is None:
+            self._initialize()
+        index = self.search_index
+        if index is None or index.version != self.version:
+            self.search_index = index = SearchIndex(self, self.version)
+        return index.search(query, limit)
 
     def view(self):
         """Create and return a new view of this history object"""
@@ -202,6 +500,137 @@ class History(object):
         self.views.discard(view)
 
 
+class SearchIndex(object):
+    """Fuzzy search index of history items
+
+    All items are joined in a single newline-delimited string so a fuzzy
+    match can be found with a single regular expression scan, which
+    visits items in history order (most recent first). Scanning stops as
+    soon as no later item can outrank the matches already found.
+    """
+
+    # quality bonus for matching at the beginning of an item/word
+    ITEM_START_BONUS = 2
+    WORD_START_BONUS = 1
+    MAX_QUALITY = 4 + ITEM_START_BONUS
+    # score penalty is RECENCY_WEIGHT * log2(1 + <history index>)
+    RECENCY_WEIGHT = 0.3
+    CACHE_SIZE = 20
+
+    def __init__(self, items, version=None):
+        self.version = version
+        self.items = items = [item for item in items if isinstance(item, str)]
+        self.folded_items = [item.lower() for item in items]
+        self.text, self.starts = self._join(items)
+        self.folded_text, self.folded_starts = self._join(self.folded_items)
+        self.cache = {}
+        self.narrow = None
+
+    @staticmethod
+    def _join(items):
+        lines = [item.replace("\n", " ") for item in items]
+        starts = [0]
+        starts.extend(accumulate(len(line) + 1 for line in lines))
+        return "\n".join(lines), starts
+
+    @staticmethod
+    def _compile(query, flags=re.MULTILINE):
+        """Compile fuzzy match regex for query
+
+        Each character is matched by skipping characters up to its first
+        occurrence, which finds the earliest match on a line without
+        backtracking.
+        """
+        parts = ["^"]
+        for i, char in enumerate(query):
+            char = re.escape(char)
+            parts.append("[^{}\n]*".format(char))
+            parts.append("({})".format(char) if i == 0 else char)
+        return re.compile("".join(parts), flags)
+
+    def search(self, query, limit=10):
+        query = query.replace("\n", " ")
+        key = (query, limit)
+        if key in self.cache:
+            return self.cache[key]
+        if not query:
+            result = []
+            seen = set()
+            for item in self.items:
+                if item not in seen:
+                    seen.add(item)
+                    result.append(item)
+                    if len(result) >= limit:
+                        break
+        else:
+            if query == query.lower():
+                text, starts, lines = \
+                    self.folded_text, self.folded_starts, self.folded_items
+            else:
+                text, starts, lines = self.text, self.starts, self.items
+            if all(char in text for char in set(query)):
+                result = self._search(query, text, starts, lines, limit)
+            else:
+                result = []
+        if len(self.cache) >= self.CACHE_SIZE:
+            self.cache.clear()
+        self.cache[key] = result
+        return result
+
+    def _search(self, query, text, starts, lines, limit):
+        pattern = self._compile(query)
+        # Narrow the search to items matched by a previous (complete)
+        # search if query extends the previous query. This makes
+        # searches for rare matches fast while typing.
+        candidates = None
+        if self.narrow is not None:
+            last_query, last_text, matched = self.narrow
+            if last_text is text and query.startswith(last_query):
+                candidates = matched
+        if candidates is None:
+            matches = pattern.finditer(text)
+        else:
+            matches = (pattern.match(text, starts[i]) for i in candidates)
+        max_quality = self.MAX_QUALITY
+        weight = self.RECENCY_WEIGHT
+        size = len(query)
+        best = [] # min-heap of (score, -index, item)
+        seen = set()
+        matched = []
+        for match in matches:
+            if match is None:
+                continue
+            index = bisect_right(starts, match.start()) - 1
+            penalty = weight * log2(index + 1)
+            if len(best) >= limit and max_quality - penalty <= best[0][0]:
+                matched = None
+                break
+            matched.append(index)
+            item = self.items[index]
+            if item in seen:
+                continue
+            seen.add(item)
+            line = lines[index]
+            first = line.find(query)
+            if first >= 0:
+                quality = 4
+            else:
+                first = match.start(1) - starts[index]
+                quality = 4.0 * size / (match.end() - match.start(1))
+            if first == 0:
+                quality += self.ITEM_START_BONUS
+            elif not line[first - 1].isalnum():
+                quality += self.WORD_START_BONUS
+            entry = (quality - penalty, -index, item)
+            if len(best) < limit:
+                heappush(best, entry)
+            elif entry > best[0]:
+                heapreplace(best, entry)
+        if matched is not None:
+            self.narrow = (query, text, matched)
+        return [item for score, index, item in sorted(best, reverse=True)]
+
+
 class HistoryView(object):
     """A history view that can be kept consistent when history is updated"""
 
@@ -237,6 +666,19 @@ class HistoryView(object):
         if removed:
             raise NotImplementedError(removed)
 
+    def item_removed(self, index):
+        """Update this view's pointers to reflect removal of an item
+
+        :param index: Index of the item that was removed from history.
+        """
+        if self.history_index >= index:
+            self.history_index -= 1
+        if self.history_edits:
+            self.history_edits.pop(index, None)
+            for key in sorted(self.history_edits):
+                if key > index:
+                    self.history_edits[key - 1] = self.history_edits.pop(key)
+
     def get(self, current_item, forward=False):
         """Get next item in history
 
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Text command execution profiler
+
+The profiler is disabled by default. When enabled, it records the wall
+time, text length and edit size of each text command in a bounded ring
+buffer, which can be summarized with the `stats` command or dumped to a
+JSON file for offline analysis.
+"""
+import json
+import logging
+import time
+from collections import defaultdict, deque, namedtuple
+from contextlib import contextmanager
+from math import ceil
+
+log = logging.getLogger(__name__)
+
+# sources of profiled commands
+COMMAND_BAR = "command bar"
+MENU = "menu"
+INPUT = "input"
+
+PERCENTILES = (50, 90, 99)
+
+Record = namedtuple("Record",
+    ["name", "source", "seconds", "text_length", "edit_size", "time"])
+
+
+class CommandProfiler(object):
+    """Record execution statistics of text commands
+
+    :param max_records: The maximum number of records to keep. The
+    oldest records are discarded when this number is exceeded.
+    """
+
+    def __init__(self, max_records=1000):
+        self.enabled = False
+        self.records = deque(maxlen=max_records)
+
+    @contextmanager
+    def measure(self, name, source, textview):
+        """Measure the execution of a command on a text view
+
+        Usage::
+
+            with profiler.measure(command.name, MENU, textview):
+                command(textview, sender, args)
+
+        Text is only inspected if the profiler is enabled, and that is
+        done outside of the timed region.
+        """
+        if not self.enabled:
+            yield
+            return
+        before = get_text(textview)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            after = get_text(textview)
+            self.records.append(Record(name, source, seconds,
+                len(before), edit_size(before, after), time.time()))
+
+    def clear(self):
+        self.records.clear()
+
+    def summarize(self):
+        """Summarize records by command name
+
+        :returns: A list of
+        `(name, count, total_seconds, [percentile_seconds...], max_seconds)`
+        tuples ordered by total time (descending). Percentiles are listed
+        in the order of `PERCENTILES`.
+        """
+        times = defaultdict(list)
+        for record in self.records:
+            times[record.name].append(record.seconds)
+        summary = []
+        for name, values in times.items():
+            values.sort()
+            summary.append((name, len(values), sum(values),
+                [percentile(values, p) for p in PERCENTILES], values[-1]))
+        summary.sort(key=lambda item: (-item[2], item[0]))
+        return summary
+
+    def report(self):
+        """Get a summary of records formatted as text"""
+        if not self.records:
+            return "no commands recorded"
+        header = ["command", "count"]
+        header.extend("p{}".format(p) for p in PERCENTILES)
+        header.append("max")
+        rows = [header]
+        for name, count, total, values, maxval in self.summarize():
+            row = [name, str(count)]
+            row.extend(format_ms(v) for v in values + [maxval])
+            rows.append(row)
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        return "\n".join(
+            "  ".join([row[0].ljust(widths[0])] +
+                [value.rjust(width) for value, width in zip(row[1:], widths[1:])])
+            for row in rows)
+
+    def dump(self, path):
+        """Write records to a JSON file
+
+        :returns: The number of records written.
+        """
+        records = [record._asdict() for record in self.records]
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(records, fh, indent=1)
+        return len(records)
+
+
+def get_text(textview):
+    if textview is None:
+        return ""
+    return textview.string()
+
+
+def edit_size(before, after):
+    """Get the size of the region that differs between two strings
+
+    :returns: The length of the longer of the changed regions of the
+    before and after strings, excluding the common prefix and suffix.
+    """
+    end = min(len(before), len(after))
+    prefix = _common_length(before, after, end, False)
+    suffix = _common_length(before, after, end - prefix, True)
+    return max(len(before), len(after)) - prefix - suffix
+
+
+def _common_length(a, b, limit, from_end):
+    # Binary search for the length of the common prefix (or suffix).
+    # Slices are compared in C, which is much faster than comparing one
+    # character at a time for large strings.
+    alen = len(a)
+    blen = len(b)
+    lo = 0
+    hi = limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if from_end:
+            same = a[alen - mid:alen - lo] == b[blen - mid:blen - lo]
+        else:
+            same = a[lo:mid] == b[lo:mid]
+        if same:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def percentile(values, p):
+    """Get the nearest-rank percentile of a sorted list of values"""
+    index = int(ceil(len(values) * p / 100.0)) - 1
+    return values[max(index, 0)]
+
+
+def format_ms(seconds):
+    return "{:.1f}ms".format(seconds * 1000)
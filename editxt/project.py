@@ -113,7 +113,7 @@ class Project(fn.NSObject):
         if self.serial_cache != self.serialize_full():
             if self.path is not None:
                 self.save_with_path(self.path)
-            app.save_editor_states()
+            app.schedule_save_editor_states()
             self.reset_serial_cache()
 
     def save_with_path(self, path):
@@ -185,7 +185,7 @@ class Project(fn.NSObject):
         # TODO test
         if doc is not None:
             for dv in self.documents():
-                if dv.document is doc:
+                if dv.is_view_of_document(doc):
                     return dv
         return None
 
@@ -227,7 +227,7 @@ class Project(fn.NSObject):
 
     def find_view_with_document(self, doc):
         for view in self._documents:
-            if view.document is doc:
+            if view.is_view_of_document(doc):
                 return view
         return None
 
@@ -0,0 +1,850 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Structural index of text for code-aware selection and folding
+
+The index holds bracket tokens, string and comment spans and the
+indentation of each line. It is built (lazily, on first query) from the
+delimited ranges of a syntax definition, and is kept up to date by
+re-lexing only the lines around edited ranges. Lines are stored in
+chunks and a tree of per-chunk bracket depths allows matching brackets
+across a large file in O(log n) time.
+
+All query methods take the current text of the document. Edits must be
+reported with `StructureIndex.edited` as they happen.
+"""
+import logging
+import re
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate, chain
+from operator import attrgetter
+
+from editxt.command.util import iterlines
+from editxt.syntax import PLAIN_TEXT, escape_token
+
+log = logging.getLogger(__name__)
+
+OPEN_BRACKETS = "([{"
+CLOSE_BRACKETS = ")]}"
+BRACKET_PAIRS = dict(chain(
+    zip(OPEN_BRACKETS, CLOSE_BRACKETS), zip(CLOSE_BRACKETS, OPEN_BRACKETS)))
+STRING = "string"
+COMMENT = "comment"
+# Maximum number of lines per chunk
+CHUNK_SIZE = 256
+QUOTES = "'\"`"
+EOL_CHARS = "\r\n\u2028"
+
+
+class Error(Exception): pass
+
+Line = namedtuple("Line", "length indent brackets spans state depth low")
+Line.__doc__ = """Lexed line of text
+
+:param length: The length of the line including its line ending.
+:param indent: Width of the leading whitespace (tabs expanded to eight
+columns) or `None` if the line is blank or starts inside a span.
+:param brackets: A string of the bracket characters on the line.
+Brackets in strings and comments are not included. See
+`Lexer.bracket_columns`.
+:param spans: A tuple of `(<start column>, <end column>, <span index>)`
+for each (piece of a) string or comment span on the line.
+:param state: The index of the span that is open at the end of the line
+or `None`.
+:param depth: Number of opening minus closing brackets on the line.
+:param low: Lowest bracket depth reached on the line (zero or less).
+"""
+
+
+class Lexer(object):
+    """Line lexer for brackets, strings and comments
+
+    Spans are the delimited ranges of the syntax definition. A delimited
+    range is a string if its start delimiter contains a quote character;
+    all other delimited ranges (comments, markup tags, etc.) are treated
+    as comments. Brackets inside spans are ignored.
+
+    :param syntaxdef: A `SyntaxDefinition` or `PLAIN_TEXT`.
+    """
+
+    def __init__(self, syntaxdef=PLAIN_TEXT):
+        flags = getattr(syntaxdef, "flags", 0)
+        starts = []
+        self.ends = []
+        self.kinds = []
+        ranges = getattr(syntaxdef, "delimited_ranges", ())
+        for i, (start, ends, color, sdef) in enumerate(ranges):
+            token = escape_token(start)
+            starts.append("(?P<s{}>{})".format(i, token))
+            self.ends.append(re.compile(
+                "|".join(escape_token(end) for end in ends), flags))
+            quoted = any(q in token for q in QUOTES)
+            self.kinds.append(STRING if quoted else COMMENT)
+        self.starts = re.compile("|".join(starts), flags) if starts else None
+        self.brackets = re.compile(r"[][(){}]")
+        self._summaries = {}
+
+    def lex(self, line, state=None):
+        """Lex a line of text
+
+        :param line: A line of text including its line ending.
+        :param state: The index of the span that is open at the start of
+        the line or `None`.
+        :returns: A `Line`.
+        """
+        brackets = []
+        spans = []
+        pos = 0
+        continued = state
+        if state is not None:
+            match = self.ends[state].search(line)
+            if match is None:
+                spans.append((0, len(line), state))
+                pos = len(line)
+            else:
+                pos = match.end()
+                spans.append((0, pos, state))
+                state = None
+        if state is None:
+            find_brackets = self.brackets.findall
+            find_span = self.starts.search if self.starts else None
+            while True:
+                match = find_span(line, pos) if find_span else None
+                stop = len(line) if match is None else match.start()
+                brackets.extend(find_brackets(line, pos, stop))
+                if match is None:
+                    break
+                index = int(match.lastgroup[1:])
+                end = self.ends[index].search(line, match.end())
+                if end is None:
+                    spans.append((match.start(), len(line), index))
+                    state = index
+                    break
+                pos = max(end.end(), match.start() + 1)
+                spans.append((match.start(), end.end(), index))
+        brackets = "".join(brackets)
+        try:
+            depth, low = self._summaries[brackets]
+        except KeyError:
+            depth = low = 0
+            for char in brackets:
+                depth += 1 if char in OPEN_BRACKETS else -1
+                if depth < low:
+                    low = depth
+            if len(self._summaries) < 10000:
+                self._summaries[brackets] = (depth, low)
+        indent = None
+        if continued is None:
+            text = line.lstrip(" \t")
+            if text.strip():
+                indent = len(line[:len(line) - len(text)].expandtabs(8))
+        return Line(len(line), indent, brackets, tuple(spans),
+                    state, depth, low)
+
+    def bracket_columns(self, text, offset, line):
+        """Get the columns of brackets on a line
+
+        :param text: The text containing the line.
+        :param offset: The offset of the line in text.
+        :param line: The `Line`.
+        :returns: A list of `(<column>, <bracket character>)` pairs.
+        """
+        if not line.brackets:
+            return []
+        matches = self.brackets.finditer(text, offset, offset + line.length)
+        columns = ((m.start() - offset, m.group()) for m in matches)
+        if line.spans:
+            spans = line.spans
+            columns = (item for item in columns
+                if not any(s <= item[0] < e for s, e, i in spans))
+        return list(columns)
+
+
+class Chunk(object):
+    """A run of consecutive lines with summary values
+
+    :param lines: A list of `Line` objects.
+    """
+
+    __slots__ = ["lines", "length", "depth", "low"]
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.length = sum(line.length for line in lines)
+        self.depth, self.low = _bracket_summary(lines)
+
+    def __repr__(self):
+        return "<Chunk lines={} length={}>".format(
+            len(self.lines), self.length)
+
+
+def _bracket_summary(items):
+    """Get the net and lowest bracket depth of a sequence of items
+
+    Items are `Line` or `Chunk` objects (or anything else with `depth`
+    and `low` attributes).
+    """
+    depth = low = 0
+    for item in items:
+        if depth + item.low < low:
+            low = depth + item.low
+        depth += item.depth
+    return depth, low
+
+
+class StructureIndex(object):
+    """Incrementally maintained structural index of a document's text
+
+    :param syntaxdef: The syntax definition used to find strings and
+    comments. Brackets and indentation are indexed for all syntaxes.
+    """
+
+    def __init__(self, syntaxdef=PLAIN_TEXT):
+        self.syntaxdef = syntaxdef
+        self.lexer = None
+        self.chunks = None
+        self.reset()
+
+    def reset(self, syntaxdef=None):
+        """Discard the index
+
+        It will be rebuilt from scratch on the next query.
+
+        :param syntaxdef: A new syntax definition (optional).
+        """
+        if syntaxdef is not None and syntaxdef is not self.syntaxdef:
+            self.syntaxdef = syntaxdef
+            self.lexer = None
+        self.chunks = None
+        self.length = 0
+        self.dirty = None
+        self._tree = None
+
+    def edited(self, range, change):
+        """Record an edit
+
+        Edits are accumulated in a single dirty region, which is
+        re-lexed on the next query.
+
+        :param range: The `(location, length)` range of the new text.
+        :param change: The change in the length of the text.
+        """
+        if self.chunks is None:
+            return
+        start = range[0]
+        end = start + range[1]
+        if self.dirty is not None:
+            dstart, dend, dchange = self.dirty
+            dend = dend + change if dend >= end - change else end
+            start = min(start, dstart)
+            end = max(end, dend)
+            change += dchange
+        self.dirty = (start, end, change)
+
+    @property
+    def edited_length(self):
+        """The length of the text after recorded edits
+
+        This is `None` if the index has not been built (edits are not
+        recorded until it is).
+        """
+        if self.chunks is None:
+            return None
+        return self.length + (self.dirty[2] if self.dirty is not None else 0)
+
+    def update(self, text):
+        """Bring the index up to date with the given text"""
+        if self.lexer is None:
+            self.lexer = Lexer(self.syntaxdef)
+            self.chunks = None
+        if self.chunks is None:
+            self._build(text)
+            return
+        if self.dirty is None:
+            if len(text) != self.length:
+                log.warn("structure index out of sync; rebuilding")
+                self._build(text)
+            return
+        start, end, change = self.dirty
+        if len(text) != self.length + change:
+            log.warn("structure index out of sync; rebuilding")
+            self._build(text)
+            return
+        self.dirty = None
+        self._relex(text, start, end, change)
+
+    def _build(self, text):
+        lex = self.lexer.lex
+        lines = []
+        state = None
+        for line in iterlines(text):
+            line = lex(line, state)
+            state = line.state
+            lines.append(line)
+        self.chunks = [Chunk(lines[i:i + CHUNK_SIZE])
+                       for i in range(0, len(lines), CHUNK_SIZE)]
+        self.dirty = None
+        self._reindex()
+
+    def _relex(self, text, start, end, change):
+        """Re-lex lines in the edited region of text
+
+        The region is extended by one line before the edit (the end of a
+        line may be joined with the edit) and continues past the edit
+        until the span state at the end of a re-lexed line is the same as
+        it was before the edit.
+
+        :param start: Start of the edited region.
+        :param end: End of the edited region (in the new text).
+        :param change: Change in length of the text.
+        """
+        first, offset = self._line_at(start)
+        if offset == start and first > 0:
+            first -= 1
+            offset -= self._line(first).length
+        last, last_offset = self._line_at(end - change)
+        old = self._line(last)
+        stop = last_offset + old.length + change
+        state = self._line(first - 1).state if first > 0 else None
+        lex = self.lexer.lex
+        lines = []
+        if offset < stop:
+            for line in iterlines(text, (offset, stop - offset)):
+                line = lex(line, state)
+                state = line.state
+                lines.append(line)
+        following = self._iter_lines(last + 1, last_offset + old.length)
+        while state != old.state:
+            old_line = next(following, None)
+            if old_line is None:
+                break
+            last, old_offset, old = old_line
+            line = lex(text[stop:stop + old.length], state)
+            state = line.state
+            stop += old.length
+            lines.append(line)
+        self._replace(first, last, lines)
+
+    def _replace(self, first, last, lines):
+        """Replace a range of lines (first to last, inclusive)"""
+        chunks = self.chunks
+        ci, fi = self._locate(first)
+        cj, lj = self._locate(last)
+        lines = chunks[ci].lines[:fi] + lines + chunks[cj].lines[lj + 1:]
+        while len(lines) < CHUNK_SIZE // 2 and cj + 1 < len(chunks):
+            cj += 1
+            lines.extend(chunks[cj].lines)
+        if not lines and len(chunks) == cj - ci + 1:
+            lines = [self.lexer.lex("")]
+        size = -(-len(lines) // CHUNK_SIZE) if lines else 0
+        step = -(-len(lines) // size) if size else 0
+        chunks[ci:cj + 1] = [Chunk(lines[i:i + step])
+                             for i in range(0, len(lines), step or 1)]
+        self._reindex()
+
+    def _reindex(self):
+        chunks = self.chunks
+        self.line_starts = list(accumulate(
+            chain([0], map(len, map(attrgetter("lines"), chunks)))))
+        self.offsets = list(accumulate(
+            chain([0], map(attrgetter("length"), chunks))))
+        self.length = self.offsets[-1]
+        self._tree = None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # line access
+
+    @property
+    def line_count(self):
+        return self.line_starts[-1]
+
+    def _locate(self, index):
+        """Get `(<chunk index>, <line index in chunk>)` for a line index"""
+        ci = bisect_right(self.line_starts, index) - 1
+        ci = max(0, min(ci, len(self.chunks) - 1))
+        return ci, index - self.line_starts[ci]
+
+    def _line(self, index):
+        ci, li = self._locate(index)
+        return self.chunks[ci].lines[li]
+
+    def _line_at(self, offset):
+        """Get `(<line index>, <line offset>)` of the line containing offset
+
+        An offset at the end of the text is in the last line.
+        """
+        offsets = self.offsets
+        ci = bisect_right(offsets, offset) - 1
+        ci = max(0, min(ci, len(self.chunks) - 1))
+        start = offsets[ci]
+        lines = self.chunks[ci].lines
+        for li, line in enumerate(lines):
+            if offset < start + line.length or li == len(lines) - 1:
+                break
+            start += line.length
+        return self.line_starts[ci] + li, start
+
+    def _iter_lines(self, index, offset, reverse=False):
+        """Generate `(<line index>, <line offset>, <Line>)` triples
+
+        :param index: The index of the first line to generate.
+        :param offset: The offset of the line at index (or the end
+        offset of that line if `reverse` is true).
+        :param reverse: Generate lines toward the beginning of the text.
+        """
+        if not 0 <= index < self.line_count:
+            return
+        ci, li = self._locate(index)
+        chunks = self.chunks
+        if reverse:
+            while ci >= 0:
+                lines = chunks[ci].lines
+                for li in range(li, -1, -1):
+                    line = lines[li]
+                    offset -= line.length
+                    yield index, offset, line
+                    index -= 1
+                ci -= 1
+                li = len(chunks[ci].lines) - 1 if ci >= 0 else 0
+        else:
+            while ci < len(chunks):
+                lines = chunks[ci].lines
+                for li in range(li, len(lines)):
+                    line = lines[li]
+                    yield index, offset, line
+                    offset += line.length
+                    index += 1
+                ci += 1
+                li = 0
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # brackets
+
+    def _get_tree(self):
+        """Get a segment tree of chunk bracket summaries
+
+        The tree is a pair of lists `(<depths>, <lows>)` with leaves
+        (chunks) starting at the index returned by `len(depths) // 2`.
+        It is built on demand after the index changes.
+        """
+        if self._tree is None:
+            size = 1
+            while size < len(self.chunks):
+                size *= 2
+            depths = [0] * (size * 2)
+            lows = [0] * (size * 2)
+            for i, chunk in enumerate(self.chunks, size):
+                depths[i] = chunk.depth
+                lows[i] = chunk.low
+            for i in range(size - 1, 0, -1):
+                left = i * 2
+                depths[i] = depths[left] + depths[left + 1]
+                lows[i] = min(lows[left], depths[left] + lows[left + 1])
+            self._tree = (depths, lows)
+        return self._tree
+
+    def _find_chunk(self, ci, pending, reverse=False):
+        """Find the chunk containing the bracket that closes a search
+
+        Search forward from the beginning of chunk `ci` for a closing
+        bracket that brings the depth below zero or (if `reverse` is
+        true) backward from the end of chunk `ci` for an opening bracket
+        that does the same.
+
+        :param pending: The number of unmatched brackets (of the type
+        being searched for) before the beginning of the search.
+        :returns: `(<chunk index>, <pending>)` where pending is the
+        number of unmatched brackets at the start (or end) of the found
+        chunk, or `None` if the search reached the end of the text.
+        """
+        depths, lows = self._get_tree()
+        size = len(depths) // 2
+        if reverse:
+            lo, hi = size, ci + size + 1
+            sign = -1
+            found = lambda node, pending: \
+                depths[node] - lows[node] > pending
+        else:
+            lo, hi = ci + size, size * 2
+            sign = 1
+            found = lambda node, pending: pending + lows[node] < 0
+        left = []
+        right = []
+        while lo < hi:
+            if lo & 1:
+                left.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right.append(hi)
+            lo //= 2
+            hi //= 2
+        nodes = left + right[::-1]
+        if reverse:
+            nodes.reverse()
+        for node in nodes:
+            if found(node, pending):
+                while node < size:
+                    first = node * 2 + (1 if reverse else 0)
+                    if found(first, pending):
+                        node = first
+                    else:
+                        pending += depths[first] * sign
+                        node = node * 2 + (0 if reverse else 1)
+                return node - size, pending
+            pending += depths[node] * sign
+        return None
+
+    def _find_bracket(self, text, index, offset, col, reverse=False):
+        """Find the offset of the bracket that ends a bracket search
+
+        :param index: Index of the line on which the search starts.
+        :param offset: Offset of the line on which the search starts.
+        :param col: Column at which the search starts. Search forward
+        from (and including) this column or backward from (excluding)
+        this column if `reverse` is true.
+        :returns: The offset of the bracket or `None`.
+        """
+        line = self._line(index)
+        pending = 0
+        sign = -1 if reverse else 1
+        brackets = self.lexer.bracket_columns(text, offset, line)
+        if reverse:
+            brackets = [b for b in reversed(brackets) if b[0] < col]
+        else:
+            brackets = [b for b in brackets if b[0] >= col]
+        for bcol, char in brackets:
+            pending += sign if char in OPEN_BRACKETS else -sign
+            if pending < 0:
+                return offset + bcol
+        ci = self._locate(index)[0]
+        if reverse:
+            lines = self._iter_lines(index - 1, offset, True)
+            first = self.line_starts[ci]
+            in_chunk = lambda index: index >= first
+            found = lambda line: line.depth - line.low > pending
+        else:
+            lines = self._iter_lines(index + 1, offset + line.length)
+            stop = self.line_starts[ci + 1]
+            in_chunk = lambda index: index < stop
+            found = lambda line: pending + line.low < 0
+        for index, offset, line in lines:
+            if not in_chunk(index):
+                break
+            if found(line):
+                return self._find_in_line(
+                    text, line, offset, pending, reverse)
+            pending += line.depth * sign
+        else:
+            return None
+        # skip chunks without a match
+        result = self._find_chunk(ci + sign, pending, reverse)
+        if result is None:
+            return None
+        ci, pending = result
+        if reverse:
+            index = self.line_starts[ci + 1] - 1
+            offset = self.offsets[ci + 1]
+        else:
+            index = self.line_starts[ci]
+            offset = self.offsets[ci]
+        return self._find_in_chunk(text, ci, index, offset, pending, reverse)
+
+    def _find_in_chunk(self, text, ci, index, offset, pending, reverse):
+        found = (lambda line: line.depth - line.low > pending) if reverse \
+            else (lambda line: pending + line.low < 0)
+        sign = -1 if reverse else 1
+        for index, offset, line in self._iter_lines(index, offset, reverse):
+            if found(line):
+                return self._find_in_line(
+                    text, line, offset, pending, reverse)
+            pending += line.depth * sign
+        raise Error("bracket not found in chunk {}".format(ci))
+
+    def _find_in_line(self, text, line, offset, pending, reverse):
+        sign = -1 if reverse else 1
+        brackets = self.lexer.bracket_columns(text, offset, line)
+        if reverse:
+            brackets.reverse()
+        for col, char in brackets:
+            pending += sign if char in OPEN_BRACKETS else -sign
+            if pending < 0:
+                return offset + col
+        raise Error("bracket not found in line at {}".format(offset))
+
+    def bracket_at(self, text, offset):
+        """Get the bracket character at offset
+
+        :returns: The bracket character or `None` if there is no bracket
+        (outside of a string or comment) at offset.
+        """
+        self.update(text)
+        index, start = self._line_at(offset)
+        col = offset - start
+        line = self._line(index)
+        for bcol, char in self.lexer.bracket_columns(text, start, line):
+            if bcol == col:
+                return char
+        return None
+
+    def match_bracket(self, text, offset):
+        """Find the bracket matching the bracket at offset
+
+        Brackets are matched by nesting depth regardless of type; the
+        match is rejected if the brackets are not a pair such as `(`
+        and `)`.
+
+        :returns: The offset of the matching bracket or `None` if there
+        is no bracket at offset or it is unmatched.
+        """
+        char = self.bracket_at(text, offset)
+        if char is None:
+            return None
+        index, start = self._line_at(offset)
+        col = offset - start
+        if char in OPEN_BRACKETS:
+            match = self._find_bracket(text, index, start, col + 1)
+        else:
+            match = self._find_bracket(text, index, start, col, True)
+        if match is None or text[match] != BRACKET_PAIRS[char]:
+            return None
+        return match
+
+    def enclosing_brackets(self, text, range):
+        """Find the innermost bracket pair enclosing a range
+
+        :param range: A `(location, length)` range.
+        :returns: A tuple `(<open offset>, <close offset>)` or `None`.
+        """
+        self.update(text)
+        start, end = range[0], range[0] + range[1]
+        pos = start
+        while True:
+            index, offset = self._line_at(pos)
+            opener = self._find_bracket(
+                text, index, offset, pos - offset, True)
+            if opener is None:
+                return None
+            index, offset = self._line_at(opener)
+            closer = self._find_bracket(
+                text, index, offset, opener - offset + 1)
+            if closer is None:
+                return None
+            if closer >= end:
+                if text[closer] != BRACKET_PAIRS[text[opener]]:
+                    return None
+                return (opener, closer)
+            pos = opener
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # strings and comments
+
+    def span_at(self, text, offset):
+        """Get the string or comment span containing offset
+
+        :returns: A tuple `(<start>, <end>, <kind>)` where kind is
+        `STRING` or `COMMENT`, or `None` if offset is not in a span.
+        """
+        self.update(text)
+        index, line_offset = self._line_at(offset)
+        line = self._line(index)
+        col = offset - line_offset
+        for start, end, span in line.spans:
+            if start <= col < end:
+                break
+        else:
+            return None
+        start += line_offset
+        end += line_offset
+        if start == line_offset and index > 0 \
+                and self._line(index - 1).state == span:
+            lines = self._iter_lines(index - 1, line_offset, True)
+            for i, prev_offset, prev in lines:
+                start = prev_offset + prev.spans[-1][0]
+                if prev.spans[-1][0] > 0 or i == 0 \
+                        or self._line(i - 1).state != span:
+                    break
+        if line.state == span and end == line_offset + line.length:
+            lines = self._iter_lines(index + 1, end)
+            for i, next_offset, next_line in lines:
+                end = next_offset + next_line.spans[0][1]
+                if next_line.state != span \
+                        or next_line.spans[0][1] < next_line.length:
+                    break
+        return start, end, self.lexer.kinds[span]
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # indentation blocks
+
+    def block_range(self, text, offset):
+        """Get the indentation block headed by the line at offset
+
+        A block consists of the lines following the header line that are
+        indented more than the header. Blank lines and lines that start
+        inside a string or comment do not end a block.
+
+        :returns: A `(location, length)` range from the end of the header
+        line (before its line ending) to the end of the last line in the
+        block (before its line ending) or `None` if the line does not
+        head a block.
+        """
+        self.update(text)
+        index, offset = self._line_at(offset)
+        return self._block_range(text, index, offset)
+
+    def _block_range(self, text, index, offset):
+        header = self._line(index)
+        if header.indent is None:
+            return None
+        end = None
+        lines = self._iter_lines(index + 1, offset + header.length)
+        for i, line_offset, line in lines:
+            if line.indent is None:
+                continue
+            if line.indent <= header.indent:
+                break
+            end = line_offset + _content_length(text, line_offset, line)
+        if end is None:
+            return None
+        start = offset + _content_length(text, offset, header)
+        return (start, end - start)
+
+    def enclosing_block(self, text, offset):
+        """Get the body of the innermost indentation block containing offset
+
+        A blank line belongs to the block of the next non-blank line.
+
+        :returns: A `(location, length)` range from the beginning of the
+        first line after the block header to the end of the last line in
+        the block (before its line ending) or `None` if the line at
+        offset is not indented.
+        """
+        self.update(text)
+        index, line_offset = self._line_at(offset)
+        for i, o, line in self._iter_lines(index, line_offset):
+            if line.indent is not None:
+                indent = line.indent
+                break
+        else:
+            return None
+        if not indent:
+            return None
+        lines = self._iter_lines(index - 1, line_offset, True)
+        for i, o, line in lines:
+            if line.indent is not None and line.indent < indent:
+                block = self._block_range(text, i, o)
+                if block is None or sum(block) < offset:
+                    return None
+                start = o + line.length
+                return (start, sum(block) - start)
+        return None
+
+    def folding_ranges(self, text):
+        """Get ranges that can be folded (hidden) in the text
+
+        Foldable ranges are the contents of bracket pairs that span more
+        than one line and indentation blocks. This scans the entire
+        index, and is therefore O(n) in the number of lines.
+
+        :returns: A sorted list of `(location, length)` ranges. Each
+        range starts at the end of a line and ends at the end of a line
+        or before a closing bracket.
+        """
+        self.update(text)
+        folds = set()
+        brackets = []
+        blocks = []
+        def close_block():
+            indent, start, end = blocks.pop()
+            if end is not None:
+                folds.add((start, end - start))
+                if blocks:
+                    blocks[-1][2] = end
+        for index, offset, line in self._iter_lines(0, 0):
+            if line.indent is not None:
+                while blocks and blocks[-1][0] >= line.indent:
+                    close_block()
+                end = offset + _content_length(text, offset, line)
+                if blocks:
+                    blocks[-1][2] = end
+                blocks.append([line.indent, end, None])
+            if not line.brackets or (line.depth == 0 and line.low == 0):
+                continue # no brackets or all are paired on this line
+            for col, char in self.lexer.bracket_columns(text, offset, line):
+                if char in OPEN_BRACKETS:
+                    brackets.append((offset + col, char, index))
+                elif brackets:
+                    start, open_char, start_index = brackets.pop()
+                    if start_index != index and \
+                            BRACKET_PAIRS[open_char] == char:
+                        folds.add((start + 1, offset + col - start - 1))
+        while blocks:
+            close_block()
+        return sorted(folds)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # selection
+
+    def expand_selection(self, text, range):
+        """Get the smallest structural range that contains a range
+
+        Candidates are the string or comment span at the range, the
+        contents of the innermost enclosing bracket pair, the pair
+        including its brackets, and the innermost enclosing indentation
+        block.
+
+        :param range: A `(location, length)` range (the selection).
+        :returns: A `(location, length)` range larger than the given
+        range or `None` if there is no larger structure.
+        """
+        self.update(text)
+        start, end = range[0], range[0] + range[1]
+        candidates = []
+        span = self.span_at(text, start)
+        if span is not None:
+            candidates.append((span[0], span[1]))
+        pair = self.enclosing_brackets(text, range)
+        if pair is not None:
+            candidates.append((pair[0] + 1, pair[1]))
+            candidates.append((pair[0], pair[1] + 1))
+        block = self.enclosing_block(text, start)
+        while block is not None:
+            header = self._line_at(block[0] - 1)[1]
+            candidates.append((block[0], sum(block)))
+            candidates.append((header, sum(block)))
+            if header <= start and sum(block) >= end:
+                break
+            block = self.enclosing_block(text, header)
+        best = None
+        for cstart, cend in candidates:
+            if cstart <= start and cend >= end and cend - cstart > end - start:
+                if best is None or cend - cstart < best[1] - best[0]:
+                    best = (cstart, cend)
+        if best is None:
+            return None
+        return (best[0], best[1] - best[0])
+
+
+def _content_length(text, offset, line):
+    """Get the length of a line without its line ending"""
+    length = line.length
+    while length and text[offset + length - 1] in EOL_CHARS:
+        length -= 1
+    return length
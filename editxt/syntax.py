@@ -265,16 +265,13 @@ class SyntaxDefinition(NoHighlight):
                 ]
         """
         super(SyntaxDefinition, self).__init__(name, comment_token, disabled)
-        def escape(token):
-            if hasattr(token, "pattern"):
-                return token.pattern
-            token = re.escape(token)
-            return token.replace(re.escape("\n"), "\\n")
+        escape = escape_token
         namegen = ("g%i" % i for i in count())
         self.filename = filename
         self.filepatterns = set(filepatterns)
         self.word_groups = list(word_groups)
         self.delimited_ranges = list(delimited_ranges)
+        self.flags = flags
         self.wordinfo = wordinfo = {}
         flags |= re.DOTALL
         groups = []
@@ -330,6 +327,17 @@ class SyntaxDefinition(NoHighlight):
 PLAIN_TEXT = NoHighlight("Plain Text", "x")
 
 
+def escape_token(token):
+    """Get the regular expression for a syntax definition token
+
+    :param token: A string to be matched literally or an `RE` object.
+    """
+    if hasattr(token, "pattern"):
+        return token.pattern
+    token = re.escape(token)
+    return token.replace(re.escape("\n"), "\\n")
+
+
 class RE(object):
     def __init__(self, pattern):
         self.pattern = pattern
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+from mocker import Mocker, ANY, expect
+from AppKit import NSTextStorage, NSTextView
+from editxt.test.util import assert_raises, eq_
+
+import editxt.command.block as mod
+from editxt.command.base import CommandError
+from editxt.command.util import Lines
+from editxt.headless import HeadlessTextView, Text
+
+log = logging.getLogger(__name__)
+
+
+def test_text_width():
+    def test(text, expect, tab_size=4):
+        eq_(mod.text_width(text, tab_size), expect)
+    yield test, "", 0
+    yield test, "abc", 3
+    yield test, "\t", 4
+    yield test, "a\t", 4
+    yield test, "abcd\t", 8
+    yield test, "a\tb\t", 8
+    yield test, "a\tb", 3, 2
+
+def test_column_offset():
+    def test(line, column, expect, tab_size=4):
+        eq_(mod.column_offset(line, column, tab_size), expect)
+    yield test, "", 0, (0, 0)
+    yield test, "", 3, (0, 0)
+    yield test, "abc", 2, (2, 2)
+    yield test, "abc", 5, (3, 3)
+    yield test, "\tx", 0, (0, 0)
+    yield test, "\tx", 2, (1, 4)
+    yield test, "\tx", 4, (1, 4)
+    yield test, "\tx", 5, (2, 5)
+    yield test, "a\tb\tc", 6, (4, 8)
+    yield test, "a\tb", 2, (2, 2), 2
+
+def test_Block_from_ranges():
+    def test(text, ranges, start, end, lines, tab_size=4):
+        block = mod.Block.from_ranges(Text(text), ranges, tab_size)
+        eq_((block.start, block.end), (start, end))
+        eq_(list(block.lines), lines)
+    text = "abc\n\tdef\nghi"
+    yield test, text, [(1, 0)], 1, 1, ["abc\n"]
+    yield test, text, [(1, 5)], 1, 5, ["abc\n", "\tdef\n"]
+    yield test, text, [(6, 5)], 2, 5, ["\tdef\n", "ghi"]
+    yield test, text, [(2, 0), (5, 1), (10, 1)], 1, 5, \
+        ["abc\n", "\tdef\n", "ghi"]
+    yield test, "abc\n", [(4, 0)], 0, 0, [""]
+    yield test, "", [(0, 0)], 0, 0, [""]
+
+def test_Block_cells():
+    def test(text, start, end, cells, strings, tab_size=4):
+        block = mod.Block(Lines(text), start, end, tab_size)
+        eq_(list(block.cells()), cells)
+        eq_(block.strings(), strings)
+        eq_(len(block), len(strings))
+    text = "abcd\nab\n\tx\n"
+    yield test, text, 1, 3, [(1, 2, 0), (6, 1, 0), (9, 0, 0)], \
+        ["bc", "b", ""]
+    yield test, text, 3, 5, [(3, 1, 0), (7, 0, 1), (9, 1, 0)], \
+        ["d", "", "x"]
+    yield test, text, 4, 4, [(4, 0, 0), (7, 0, 2), (9, 0, 0)], ["", "", ""]
+    yield test, "a\r\nb ", 0, 5, [(0, 1, 0), (3, 1, 0)], ["a", "b"]
+
+def test_block_edit():
+    def test(command, text, ranges, expect, selection, tab_size=4):
+        tv = HeadlessTextView(text)
+        tv.doc_view.document.indent_size = tab_size
+        tv.setSelectedRanges_(ranges)
+        args = mod.block_edit.arg_parser.parse(command)
+        mod.block_edit(tv, None, args)
+        eq_(tv.text, expect)
+        eq_(tv.selectedRanges(), selection)
+    text = "abc\nde\nfghi\n"
+    yield test, "insert X", text, [(1, 9)], "aXbc\ndXe\nfXghi\n", \
+        [(1, 1), (6, 1), (10, 1)]
+    yield test, "insert ab", text, [(3, 8)], "abcab\nde ab\nfghabi\n", \
+        [(3, 2), (9, 2), (15, 2)]
+    yield test, "insert", text, [(1, 9)], text, [(1, 0), (5, 0), (8, 0)]
+    yield test, "replace X", text, [(1, 10)], "aX\ndX\nfX\n", \
+        [(1, 1), (4, 1), (7, 1)]
+    yield test, "delete", text, [(1, 10)], "a\nd\nf\n", \
+        [(1, 0), (3, 0), (5, 0)]
+    yield test, "delete", text, [(1, 0), (5, 1), (9, 2)], "a\nd\nf\n", \
+        [(1, 0), (3, 0), (5, 0)]
+    yield test, "delete", "\tabc\n\tdef\n", [(1, 6)], "\tbc\n\tef\n", \
+        [(1, 0), (5, 0)]
+
+def test_edit_block_NSTextView():
+    # NSTextView ranges count UTF-16 code units (two per emoji)
+    m = Mocker()
+    tv = m.mock(NSTextView)
+    ts = m.mock(NSTextStorage)
+    text = ["\U0001f600abc\n\U0001f600\U0001f600de\n"]
+    def replace(range, string):
+        data = text[0].encode("utf-16-le")
+        start, end = range[0] * 2, (range[0] + range[1]) * 2
+        text[0] = (data[:start] + string.encode("utf-16-le") + data[end:]) \
+            .decode("utf-16-le")
+    def should_change(ranges, strings):
+        eq_([tuple(r.rangeValue()) for r in ranges], [(2, 1), (8, 2)])
+        eq_(strings, ["", ""])
+        return True
+    tv.doc_view.document.indent_size >> 4
+    (tv.carets << None).count(0, None)
+    tv.selectedRanges() >> [(2, 8)]
+    expect(tv.string()).call(lambda: text[0]).count(1, None)
+    expect(tv.shouldChangeTextInRanges_replacementStrings_(ANY, ANY)) \
+        .call(should_change)
+    tv.textStorage() >> ts
+    ts.beginEditing()
+    expect(ts.replaceCharactersInRange_withString_(ANY, ANY)) \
+        .call(replace).count(2)
+    ts.endEditing()
+    tv.didChangeText()
+    tv.setSelectedRange_((2, 0))
+    tv.carets = [(2, 0), (6, 0)]
+    with m:
+        block = mod.Block.from_textview(tv)
+        eq_((block.start, block.end), (1, 2))
+        mod.edit_block(tv, block, [""])
+        eq_(text[0], "\U0001f600bc\n\U0001f600de\n")
+
+def test_block_edit_pasteboard():
+    def test(command, text, ranges, expect, paste=None, copied=None):
+        tv = HeadlessTextView(text)
+        tv.setSelectedRanges_(ranges)
+        saved = []
+        args = mod.block_edit.arg_parser.parse(command)
+        load, save = mod.load_pasteboard_string, mod.save_to_pasteboard
+        mod.load_pasteboard_string = lambda: paste
+        mod.save_to_pasteboard = saved.append
+        try:
+            mod.block_edit(tv, None, args)
+        finally:
+            mod.load_pasteboard_string, mod.save_to_pasteboard = load, save
+        eq_(tv.text, expect)
+        eq_(saved, [] if copied is None else [copied])
+    text = "abc\r\ndef\r\n"
+    yield test, "copy", text, [(1, 6)], text, None, "b\r\ne"
+    yield test, "paste", text, [(1, 6)], "aXc\r\ndYf\r\n", "X\nY\n"
+    yield test, "paste", text, [(1, 5)], "aXbc\r\ndXef\r\n", "X"
+    with assert_raises(CommandError, msg="nothing to paste"):
+        test("paste", text, [(1, 0)], text)
+
+def test_block_edit_errors():
+    tv = HeadlessTextView("abc")
+    with assert_raises(CommandError, msg="nothing to do"):
+        mod.block_edit(tv, None, None)
+    with assert_raises(CommandError, msg="nothing to do"):
+        mod.block_edit(tv, None, mod.block_edit.arg_parser.parse(""))
@@ -97,6 +97,9 @@ def test_find_command():
     yield test, c(input="/abc// s", find="abc", action="replace_all_in_selection")
     yield test, c(input="/abc// c", find="abc", action="count_occurrences",
                   message="Found 3 occurrences")
+    yield test, c(input="/abc// multi-n", find="abc", action="select_next")
+    yield test, c(input="/abc// multi-a", find="abc", action="select_all",
+                  message="Selected 3 occurrences")
     yield test, c(input="/abc//  regex", find="abc", search=mod.REGEX)
     yield test, c(input="/abc//  literal", find="abc", search=mod.LITERAL)
     yield test, c(input="/abc//  word", find="abc", search=mod.WORD)
@@ -191,6 +194,46 @@ def test_Finder_python_replace():
             "    return match(",
             "unexpected EOF while parsing (<string>, line 2)"))
 
+def test_Finder_select_next():
+    from editxt.headless import HeadlessTextView
+    def test(sels, expect, find="abc", beep=False):
+        tv = HeadlessTextView("abc def abc ABC abc")
+        tv.setSelectedRanges_(sels)
+        finder = Finder(lambda: tv, make_options(dict(find=find,
+            search=mod.LITERAL, ignore_case=False, wrap=True)))
+        beeps = []
+        with replattr(ak, "NSBeep", lambda: beeps.append(1)):
+            finder.select_next(None)
+        eq_(tv.selectedRanges(), expect)
+        eq_(bool(beeps), beep)
+    yield test, [(0, 3)], [(0, 3), (8, 3)]
+    yield test, [(0, 3), (8, 3)], [(0, 3), (8, 3), (16, 3)]
+    yield test, [(8, 3), (16, 3)], [(0, 3), (8, 3), (16, 3)]
+    yield test, [(0, 3), (8, 3), (16, 3)], \
+        [(0, 3), (8, 3), (16, 3)], "abc", True
+    yield test, [(0, 0)], [(0, 0)], "", True
+
+def test_Finder_select_all():
+    from editxt.headless import HeadlessTextView
+    def test(c):
+        tv = HeadlessTextView("abc def abc ABC abc")
+        tv.setSelectedRange_((0, 0))
+        finder = Finder(lambda: tv, make_options(c))
+        beeps = []
+        with replattr(ak, "NSBeep", lambda: beeps.append(1)):
+            eq_(finder.select_all(None), c.message)
+        eq_(tv.selectedRanges(), c.sels)
+        eq_(bool(beeps), c.message is None)
+    c = TestConfig(find="abc", search=mod.LITERAL, ignore_case=False,
+        wrap=True, message="Selected 3 occurrences",
+        sels=[(0, 3), (8, 3), (16, 3)])
+    yield test, c
+    yield test, c(ignore_case=True, message="Selected 4 occurrences",
+        sels=[(0, 3), (8, 3), (12, 3), (16, 3)])
+    yield test, c(find="d.f", search=mod.REGEX, message="Selected 1 occurrence",
+        sels=[(4, 3)])
+    yield test, c(find="xyz", message=None, sels=[(0, 0)])
+
 def test_FindController_shared_controller():
     fc = FindController.shared_controller()
     assert isinstance(fc, FindController), fc
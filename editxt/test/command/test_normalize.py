@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+from editxt.test.util import eq_, TestConfig
+
+import editxt.command.normalize as mod
+import editxt.constants as const
+from editxt.command.parser import Options
+from editxt.headless import HeadlessTextView
+
+log = logging.getLogger(__name__)
+
+
+def test_normalize_whitespace():
+    def test(command, text, expect, sel=None, mode=const.INDENT_MODE_SPACE,
+             size=4, newline_mode=const.NEWLINE_MODE_UNIX):
+        tv = HeadlessTextView(text)
+        doc = tv.doc_view.document
+        doc.indent_mode = mode
+        doc.indent_size = size
+        doc.newline_mode = newline_mode
+        if sel is not None:
+            tv.setSelectedRange_(sel)
+        args = mod.normalize_whitespace.arg_parser.parse(command)
+        mod.normalize_whitespace(tv, None, args)
+        eq_(tv.text, expect)
+        eq_(tv.modified, text != expect)
+        if sel is not None:
+            eq_(tv.selectedRange(), expect_sel)
+    expect_sel = None
+    TAB = const.INDENT_MODE_TAB
+    yield test, "", "", ""
+    yield test, "", "a\n", "a\n"
+    yield test, "", "\ta  \r\n  b", "    a\n  b\n"
+    yield test, "", "    a\n      b\n", "\ta\n\t  b\n", None, TAB
+    yield test, "no-indent", "\ta  \r\n", "\ta\n"
+    yield test, "no-newlines", "\ta  \r\n", "    a\r\n"
+    yield test, "no-strip", "\ta  \r\n", "    a  \n"
+    yield test, "no-final-newline", "\ta  \r\n  b", "    a\n  b"
+    yield test, "indent no-newlines no-strip no-final-newline", \
+        "a  \r\n\tb", "a  \r\n    b"
+    yield test, "", "a\nb\n", "a\r\nb\r\n", None, \
+        const.INDENT_MODE_SPACE, 4, const.NEWLINE_MODE_WINDOWS
+    expect_sel = (1, 3)
+    yield test, "", "a  \nb  \n", "a\nb\n", (2, 6)
+    expect_sel = (4, 1)
+    yield test, "", "a  \nb  \nc", "a\nb\nc\n", (8, 1)
+    expect_sel = (3, 0)
+    yield test, "", "a  \nb  \nc", "a\nb\nc\n", (6, 1)
+    expect_sel = (0, 7)
+    yield test, "", "\ta\r\nb", "    a\nb\n", (0, 5)
+
+def test_normalize_whitespace_default_options():
+    # indent mode and newline mode are detected from the text
+    tv = HeadlessTextView("\ta  \r\n  b")
+    mod.normalize_whitespace(tv, None, None)
+    eq_(tv.text, "\ta\r\n  b\r\n")
+
+def test_save_options():
+    def test(config, expect):
+        keys = ["normalize_indent", "normalize_newlines",
+                "strip_trailing_whitespace", "ensure_final_newline"]
+        config = {"on_save." + key: config.get(key, False) for key in keys}
+        eq_(mod.save_options(config), expect)
+    yield test, {}, None
+    yield test, {"strip_trailing_whitespace": True}, Options(
+        indent=False, newlines=False, strip=True, final_newline=False)
+    yield test, {"normalize_indent": True, "ensure_final_newline": True}, \
+        Options(indent=True, newlines=False, strip=False, final_newline=True)
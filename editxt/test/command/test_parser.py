@@ -18,15 +18,17 @@
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import os
 import re
 from functools import partial
+from os.path import join
 
 from mocker import Mocker, expect, ANY, MATCH
 from nose.tools import eq_
-from editxt.test.util import assert_raises, TestConfig
+from editxt.test.util import assert_raises, tempdir, TestConfig
 
-from editxt.command.parser import (Choice, Int, String, Regex, RegexPattern,
-    CommandParser, SubArgs, SubParser, VarArgs,
+from editxt.command.parser import (Choice, File, Int, String, Regex,
+    RegexPattern, CommandParser, SubArgs, SubParser, VarArgs,
     identifier, Options, Error, ArgumentError, ParseError)
 
 log = logging.getLogger(__name__)
@@ -213,6 +215,99 @@ def test_CommandParser_order():
     yield test, 'r', tt
     yield test, 's', Options(selection=True, reverse=False)
 
+def test_CommandParser_get_placeholder_incremental():
+    def test(parser, text):
+        state = None
+        for i in range(len(text) + 1):
+            parser.placeholder_state = None
+            expect = parser.get_placeholder(text[:i])
+            parser.placeholder_state = state
+            eq_(parser.get_placeholder(text[:i]), expect, repr(text[:i]))
+            state = parser.placeholder_state
+        assert state[1][0] > 0, state
+    parser = CommandParser(
+        Choice(('selection', True), ('all', False)),
+        Regex('sort_regex', True),
+        Int("num", default=42),
+        String("str"),
+        VarArgs("args", placeholder="..."),
+    )
+    yield test, parser, "sel /x y/abc/i 123 'a b' x y z"
+    yield test, parser, "a  12 a\\ b x"
+    yield test, parser, "all /x\\/y/ x 'a\\' b' z"
+    sub = CommandParser(
+        SubParser("var", SubArgs("num", Int("n")), SubArgs("str", String("s"))),
+        Choice(('yes', True), ('no', False)),
+    )
+    yield test, sub, "num 1 y"
+    yield test, sub, "str 'a b' no"
+
+def test_CommandParser_match_token():
+    def test(text, expect):
+        eq_(parser.match_token(text), expect)
+    parser = CommandParser(Regex('regex'), yesno)
+    yield test, "", (True, False)
+    yield test, "x", (False, False)
+    yield test, "/", (True, False)
+    yield test, "/x ", (True, False)
+    yield test, "/x/", (True, False)
+    yield test, "/x/ ", (True, False)
+    yield test, "/x/ y", (True, True)
+
+def test_Field_get_start_chars():
+    def test(arg, expect):
+        eq_(arg.get_start_chars(), expect)
+        eq_(CommandParser(arg).get_start_chars(), expect)
+    yield test, yesno, {"y", "n", " "}
+    yield test, Choice("abc 1st", "xyz"), {"a", "0", "x", " "}
+    yield test, Int("num"), {"0", "+", "-", " ", "\t"}
+    yield test, String("str"), None
+    yield test, VarArgs("args"), None
+    yield test, Regex("regex"), set("/:\"'")
+    yield test, SubParser("var", SubArgs("num", Int("n")), SubArgs("str")), \
+        {"n", "s", " "}
+
+def test_Field_parse_token_cache():
+    calls = []
+    class Counted(Int):
+        def consume(self, text, index):
+            calls.append((text, index))
+            return super(Counted, self).consume(text, index)
+    arg = Counted("num")
+    eq_(arg.parse_token("12 x", 0), ("12 ", 3, True))
+    eq_(arg.parse_token("12 x", 0), ("12 ", 3, True))
+    eq_(calls, [("12 x", 0)])
+    for i in range(2):
+        with assert_raises(ParseError, msg="invalid literal for int() with base 10: 'x'"):
+            arg.parse_token("12 x", 3)
+    eq_(calls, [("12 x", 0), ("12 x", 3)])
+    eq_(arg.parse_token("12 y", 0), ("12 ", 3, True))
+    eq_(calls, [("12 x", 0), ("12 x", 3), ("12 y", 0)])
+
+def test_char_class():
+    from editxt.command.parser import char_class
+    def test(char, expect):
+        eq_(char_class(char), expect)
+    yield test, "1", "0"
+    yield test, "\u0663", "0" # ARABIC-INDIC DIGIT THREE
+    yield test, "a", "a"
+    yield test, " ", " "
+    yield test, "\t", "\t"
+    yield test, "\u3000", "\t" # IDEOGRAPHIC SPACE
+
+def test_Field_get_start_chars_consistency():
+    from editxt.command.parser import char_class
+    args = [yesno, Int("num"), Regex("regex", True),
+        SubParser("var", SubArgs("num", Int("n")), SubArgs("str"))]
+    def test(arg):
+        chars = arg.get_start_chars()
+        for text in ["yes", "no", "1", "-1", "\u0663", "+", "/", ":x:",
+                     " ", "\t1", "x", "num", "s", "\"x\"", "'"]:
+            if char_class(text[0]) not in chars:
+                assert_raises((ParseError, ArgumentError), arg.consume, text, 0)
+    for arg in args:
+        yield test, arg
+
 #def test_
 #    CommandParser(
 #        Regex('regex'),
@@ -436,6 +531,55 @@ def test_String():
     yield test, None, ""
     yield test, 5, Error("invalid value: str=5")
 
+def test_File():
+    from editxt.dircache import DirectoryCache
+    with tempdir() as tmp:
+        os.mkdir(join(tmp, "dir"))
+        for name in ["file.txt", "file name.txt", ".hidden", "dir/a.txt"]:
+            with open(join(tmp, name), "w") as fh:
+                pass
+        arg = File('path', directory=lambda: tmp)
+        arg.cache = DirectoryCache()
+        eq_(str(arg), 'path')
+        eq_(repr(arg), "File('path', directory={!r})".format(arg.directory))
+
+        test = make_type_checker(arg)
+        yield test, '', 0, (None, 0)
+        yield test, 'a', 0, ('a', 1)
+        yield test, 'a b', 0, ('a', 2)
+        yield test, 'a\\ b', 0, ('a b', 4)
+        yield test, '"a b" c', 0, ('a b', 6)
+
+        def test(token, expect):
+            for path in [tmp, join(tmp, "dir")]:
+                arg.cache.get(path, timeout=5)
+            eq_(arg.get_completions(token), expect)
+        yield test, "", ["dir/", "file\\ name.txt", "file.txt"]
+        yield test, "f", ["file\\ name.txt", "file.txt"]
+        yield test, "file\\ ", ["file\\ name.txt"]
+        yield test, "'file ", ["file name.txt"]
+        yield test, ".", [".hidden"]
+        yield test, "dir/", ["a.txt"]
+        yield test, join(tmp, "d"), ["dir/"]
+        yield test, "x", []
+
+        test = make_completions_checker(arg)
+        yield test, "fi", (["file\\ name.txt", "file.txt"], 2)
+        yield test, "file.txt ", (None, 9)
+
+def test_File_get_directory():
+    home = os.path.expanduser("~")
+    def test(directory, path, expect):
+        eq_(File("path", directory=directory).get_directory(path), expect)
+    yield test, None, "", home
+    yield test, None, "dir", join(home, "dir")
+    yield test, "/base", "", "/base"
+    yield test, "/base", "dir/", "/base/dir"
+    yield test, "/base", "/abs/", "/abs"
+    yield test, "/base", "~/x", join(home, "x")
+    yield test, (lambda: "/base"), "../x", "/x"
+    yield test, (lambda: None), "x", join(home, "x")
+
 # TODO test VarArgs
 
 def test_Regex():
@@ -629,6 +773,7 @@ def test_SubParser():
     yield test, (sub, Options(num=1)), "val 1"
     yield test, (su2, Options(yes=True)), "str "
     yield test, (su2, Options(yes=False)), "str no"
+    yield test, None, ""
 
 Args = lambda *a, **k: (a, k)
 
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+from os.path import join
+
+from editxt.test.util import assert_raises, eq_, tempdir
+
+import editxt.command.script as mod
+from editxt.command.base import command, CommandError
+from editxt.command.parser import CommandParser, Int, Options
+from editxt.textcommand import TextCommandController
+
+log = logging.getLogger(__name__)
+
+
+class FakeTextView(object):
+
+    def __init__(self):
+        self.calls = []
+        self.text_storage = self.undo_manager = self
+
+    def textStorage(self):
+        return self.text_storage
+
+    def undoManager(self):
+        return self.undo_manager
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args: self.calls.append((name,) + args)
+
+
+def make_commander(calls):
+    class menu:
+        @staticmethod
+        def insertItem_atIndex_(item, tag):
+            pass
+    @command(arg_parser=CommandParser(Int("num")))
+    def add(textview, sender, args):
+        if args.num is None:
+            raise CommandError("num is required")
+        calls.append(("add", textview, args.num))
+    @command
+    def fail(textview, sender, args):
+        raise ValueError("unexpected")
+    commander = TextCommandController([])
+    commander.add_command(add, None, menu)
+    commander.add_command(fail, None, menu)
+    return commander, add, fail
+
+
+def test_parse_script():
+    commander, add, fail = make_commander([])
+    def test(text, expect):
+        if isinstance(expect, Exception):
+            with assert_raises(type(expect), msg=str(expect)):
+                mod.parse_script(text, commander)
+        else:
+            eq_(mod.parse_script(text, commander), expect)
+    yield test, "", []
+    yield test, "add 1\n\n  # comment\nadd 2", [
+        (1, add, Options(num=1)),
+        (4, add, Options(num=2)),
+    ]
+    yield test, "add 1\nadd x", CommandError(
+        "line 2: invalid arguments: x\ninvalid literal for int() with base 10: 'x'")
+    yield test, "add 1\nnope 2", CommandError("line 2: unknown command: nope 2")
+
+def test_run_script():
+    calls = []
+    commander, add, fail = make_commander(calls)
+    def test(text, expect_calls, error=None):
+        del calls[:]
+        views = [FakeTextView(), FakeTextView()]
+        commands = mod.parse_script(text, commander)
+        if error is not None:
+            with assert_raises(CommandError, msg=error):
+                mod.run_script(commands, views)
+            views = views[:1]
+        else:
+            mod.run_script(commands, views)
+        eq_(calls, [(c, views[i], n) for c, i, n in expect_calls])
+        for view in views:
+            eq_(view.calls, [
+                ("beginUndoGrouping",),
+                ("beginEditing",),
+                ("endEditing",),
+                ("setActionName_", "Run Script"),
+                ("endUndoGrouping",),
+            ])
+    yield test, "add 1\nadd 2", [
+        ("add", 0, 1), ("add", 0, 2), ("add", 1, 1), ("add", 1, 2)]
+    yield test, "add 1\nadd", [("add", 0, 1)], "line 2: num is required"
+    yield test, "add 1\nfail\nadd 2", [("add", 0, 1)], \
+        "line 2: error in command: fail"
+
+def test_run_script_file():
+    calls = []
+    commander, add, fail = make_commander(calls)
+    class sender:
+        text_commander = commander
+    def test(argstr, script, expect):
+        with tempdir() as tmp:
+            textview = FakeTextView()
+            textview.doc_view = type("View", (object,), {})()
+            textview.doc_view.file_path = join(tmp, "doc.txt")
+            if script is not None:
+                with open(join(tmp, "script.txt"), "w") as fh:
+                    fh.write(script)
+            args = mod.run_script_file.arg_parser.parse(argstr)
+            del calls[:]
+            if isinstance(expect, Exception):
+                with assert_raises(type(expect), msg=str(expect).format(tmp)):
+                    mod.run_script_file(textview, sender, args)
+            else:
+                eq_(mod.run_script_file(textview, sender, args), expect)
+                eq_(calls, [("add", textview, 1), ("add", textview, 2)])
+    yield test, "script.txt", "add 1\nadd 2\n", \
+        "ran 2 commands from script.txt"
+    yield test, "", None, CommandError("please specify a script to run")
+    yield test, "script.txt", None, CommandError("cannot read script: "
+        "[Errno 2] No such file or directory: '{}/script.txt'")
+
+def test_run_script_file_recursion():
+    calls = []
+    commander, add, fail = make_commander(calls)
+    class menu:
+        @staticmethod
+        def insertItem_atIndex_(item, tag):
+            pass
+    commander.add_command(mod.run_script_file, None, menu)
+    class sender:
+        text_commander = commander
+    with tempdir() as tmp:
+        textview = FakeTextView()
+        textview.doc_view = type("View", (object,), {})()
+        textview.doc_view.file_path = join(tmp, "doc.txt")
+        with open(join(tmp, "a.txt"), "w") as fh:
+            fh.write("add 1\nrun {}\n".format(join(tmp, "b.txt")))
+        with open(join(tmp, "b.txt"), "w") as fh:
+            fh.write("run {}\n".format(join(tmp, "a.txt")))
+        args = mod.run_script_file.arg_parser.parse("a.txt")
+        for x in range(2):
+            with assert_raises(CommandError, msg="line 2: line 1: "
+                    "script is already running: {}/a.txt".format(tmp)):
+                mod.run_script_file(textview, sender, args)
+        eq_(mod._running_scripts, set())
+        eq_(calls, [("add", textview, 1), ("add", textview, 1)])
@@ -18,16 +18,19 @@
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import multiprocessing
 import os
 import re
 from contextlib import closing
+from functools import partial
 from tempfile import gettempdir
 
 import AppKit as ak
 import Foundation as fn
 from mocker import Mocker, MockerTestCase, expect, ANY, MATCH
 from nose.tools import *
-from editxt.test.util import TestConfig, untested, check_app_state
+from editxt.test.util import (TestConfig, untested, check_app_state,
+    assert_raises, replattr, tempdir)
 
 import editxt.command.base as base
 import editxt.command.sortlines as mod
@@ -61,6 +64,124 @@ def test_sort_command():
     yield test, "sort all", "|0|4dagJ|0"
     yield test, "sort all   match-case", "|0|4dJag|0"
 
+def test_sort_command_options():
+    def test(command, text, expected):
+        tv = FakeTextView(text)
+        do = CommandTester(mod.sort_lines, textview=tv)
+        do(command)
+        eq_(tv.text, expected)
+    nums = "10 b\n9 a\n-1.5 c\nx\n9 a\n"
+    yield test, "sort all", nums, "-1.5 c\n10 b\n9 a\n9 a\nx\n"
+    yield test, "sort all numeric", nums, "x\n-1.5 c\n9 a\n9 a\n10 b\n"
+    yield test, "sort all reverse numeric", nums, \
+        "10 b\n9 a\n9 a\n-1.5 c\nx\n"
+    yield test, "sort all numeric unique", nums, "x\n-1.5 c\n9 a\n10 b\n"
+    yield test, "sort all numeric count", nums, \
+        "      1 x\n      1 -1.5 c\n      2 9 a\n      1 10 b\n"
+    vers = "v1.10\nv1.9\nV1.2\nv1.02\n"
+    yield test, "sort all natural", vers, "v1.02\nV1.2\nv1.9\nv1.10\n"
+    yield test, "sort all match-case version", vers, \
+        "V1.2\nv1.02\nv1.9\nv1.10\n"
+    yield test, "sort all match-case", vers, "V1.2\nv1.02\nv1.10\nv1.9\n"
+    csv = "b,3,x\na,10,y\nc,2,z\n"
+    yield test, "sort all numeric field 2 ,", csv, "c,2,z\nb,3,x\na,10,y\n"
+    yield test, "sort all field 3 ,", csv, "b,3,x\na,10,y\nc,2,z\n"
+    yield test, "sort all reverse field 3 ,", csv, "c,2,z\na,10,y\nb,3,x\n"
+    yield test, "sort all unique field 2", "a 1\nb 2\nc 1\n", "a 1\nb 2\n"
+    yield test, "sort all column 3 4", "a 20\nb 13\nc 17", "b 13\nc 17\na 20"
+    yield test, "sort all column 3", "a 20\nb 13\nc 1\n", "c 1\nb 13\na 20\n"
+
+def test_sort_last_line_without_eol():
+    from editxt.command.script import parse_script
+    from editxt.headless import load_text_commander, process_text
+    commander = load_text_commander()
+    def test(command, text, expected):
+        commands = parse_script(command, commander)
+        eq_(process_text(text, commands, commander), expected)
+        with replattr(mod, "EXTERNAL_SORT_SIZE", 0):
+            eq_(process_text(text, commands, commander), expected)
+    yield test, "sort all", "b\na", "a\nb"
+    yield test, "sort all", "a\nb", "a\nb"
+    yield test, "sort all", "b", "b"
+    yield test, "sort all", "c\r\nb\r\na", "a\r\nb\r\nc"
+    yield test, "sort all", "c\rb\ra", "a\rb\rc"
+    yield test, "sort all reverse", "a\nb\nc", "c\nb\na"
+    yield test, "sort all unique", "b\na\nb", "a\nb"
+    yield test, "sort all count", "b\na\nb", "      1 a\n      2 b"
+
+def test_missing_eol():
+    def test(text, range, expected):
+        eq_(mod.missing_eol(text, range), expected)
+    yield test, "", (0, 0), ""
+    yield test, "a", (0, 1), ""
+    yield test, "a\n", (0, 2), ""
+    yield test, "a\nb", (0, 3), "\n"
+    yield test, "a\r\nb", (0, 4), "\r\n"
+    yield test, "a\u2028b\nc", (0, 5), "\n"
+    yield test, "a\nb\nc", (2, 3), "\n"
+    yield test, "a\nb", (2, 1), ""
+
+def test_sort_block_key():
+    from editxt.command.script import parse_script, run_script
+    from editxt.headless import HeadlessSender, HeadlessTextView
+    from editxt.headless import load_text_commander
+    commander = load_text_commander()
+    def test(command, text, sel, expected):
+        tv = HeadlessTextView(text)
+        tv.setSelectedRange_(sel)
+        run_script(parse_script(command, commander), [tv],
+                   HeadlessSender(commander))
+        eq_(tv.text, expected)
+    text = "x 3 a\ny 1 c\nz 2 b\n"
+    yield test, "sort selection block", text, (2, 13), "y 1 c\nz 2 b\nx 3 a\n"
+    yield test, "sort selection block", text, (4, 13), "x 3 a\nz 2 b\ny 1 c\n"
+    yield test, "sort selection reverse block", text, (2, 12), \
+        "x 3 a\nz 2 b\ny 1 c\n"
+    # tab stops are at multiples of the indent size
+    text = "a\t\t3\nbbbbb\t1\n\t\t2\n"
+    yield test, "sort selection block", text, (3, 13), \
+        "bbbbb\t1\n\t\t2\na\t\t3\n"
+
+def test_SortKey_errors():
+    def test(command, error):
+        opts = mod.sort_lines.arg_parser.parse(command)
+        with assert_raises(base.CommandError, msg=error):
+            mod.SortKey(opts)
+    yield test, "field 0", "invalid field number: 0"
+    yield test, "column 0", "invalid column range: 0 None"
+    yield test, "column 4 2", "invalid column range: 4 2"
+
+def test_sort_order():
+    def test(lines, opts, expect_order, expect_keys=None):
+        key = mod.SortKey(SortOptions(**opts))
+        keys, order = mod.sort_order(lines, key, opts.get("reverse", False))
+        eq_(list(order), expect_order)
+        eq_(keys, [key.text_key(line) if key.order == mod.NUMERIC
+                   and key.regex is None else key(line) for line in lines])
+        eq_([lines[i] for i in order], sorted(lines, key=key,
+            reverse=opts.get("reverse", False)))
+    lines = ["b 2", "a 2", "c 1", "d", "a 2"]
+    yield test, lines, {}, [1, 4, 0, 2, 3]
+    yield test, lines, {"order": mod.NUMERIC}, [3, 2, 1, 4, 0]
+    yield test, lines, {"order": mod.NUMERIC, "reverse": True}, \
+        [0, 1, 4, 2, 3]
+    yield test, lines, {"order": mod.NUMERIC, "regex_sort": True,
+        "search_pattern": r"\d"}, [2, 0, 1, 4, 3]
+    yield test, ["x10", "x9", "x09"], {"order": mod.NATURAL}, [2, 1, 0]
+
+def test_iter_unique():
+    def test(items, count, expect):
+        eq_(list(mod.iter_unique(items, count)), expect)
+    yield test, [], False, []
+    yield test, [(1, "a"), (1, "b"), (2, "c")], False, ["a", "c"]
+    yield test, [(1, "a"), (1, "b"), (2, "c")], True, ["      2 a", "      1 c"]
+
+def test_SortOptions_numeric_match():
+    opts = SortOptions()
+    eq_((opts.order, opts.numeric_match), (mod.TEXT, False))
+    opts.numeric_match = True
+    eq_((opts.order, opts.numeric_match), (mod.NUMERIC, True))
+
 def test_SortLinesController_default_options():
     with replace_history() as history:
         ctl = SortLinesController(None)
@@ -151,6 +272,77 @@ def test_sortlines():
     yield test, c(result="daJg|0|4|0", opts=op(sch="(\d) (\d)", mch=r"\2\1"))
     # TODO test and implement numeric match (checkbox is currently hidden)
 
+def test_sortlines_external():
+    def test(opts, sel=None):
+        text = "".join("{} {}\n".format(" " * (i % 3), (i * 7919) % 101)
+            for i in range(300)) + "Abc\nabc\n  z"
+        expect = FakeTextView(text, sel or (0, 0))
+        sortlines(expect, opts)
+        tv = FakeTextView(text, sel or (0, 0))
+        with tempdir() as tmp, replattr(
+                (mod, "EXTERNAL_SORT_SIZE", 10),
+                (mod, "RUN_SIZE", 7),
+                (mod, "mkstemp", partial(mod.mkstemp, dir=tmp)),
+                sigcheck=False):
+            sortlines(tv, opts)
+            eq_(os.listdir(tmp), [])
+        eq_(tv.text, expect.text)
+        assert tv.text != text, "not sorted"
+    yield test, SortOptions(selection=False)
+    yield test, SortOptions(selection=False, reverse=True)
+    yield test, SortOptions(selection=False, ignore_case=False)
+    yield test, SortOptions(selection=False, ignore_leading_whitespace=True)
+    yield test, SortOptions(selection=True), (20, 500)
+    yield test, SortOptions(selection=False, regex_sort=True,
+        search_pattern=r"(\d)(\d)", match_pattern=r"\2")
+
+def test_external_sort():
+    key = mod.SortKey(SortOptions(ignore_case=True))
+    lines = ["{}\n".format("bBaA"[i % 4] * (i % 5)) for i in range(500)]
+    def test(reverse, run_size, pool=None):
+        with tempdir() as tmp:
+            result = mod.external_sort(lines, key, reverse, run_size,
+                pool=pool, tempdir=tmp)
+            eq_(list(result), sorted(lines, key=key, reverse=reverse))
+            eq_(os.listdir(tmp), [])
+    yield test, False, 1000
+    yield test, False, 1
+    yield test, True, 33
+    with closing(multiprocessing.Pool(2)) as pool:
+        yield test, False, 33, pool
+        yield test, True, 33, pool
+    with tempdir() as tmp:
+        result = mod.external_sort(lines, key, False, 10, tempdir=tmp)
+        eq_(next(result), "\n")
+        eq_(len(os.listdir(tmp)), 50)
+        result.close()
+        eq_(os.listdir(tmp), [])
+
+def test_external_sort_merge():
+    # heapq.merge does not accept key or reverse arguments before Python 3.5
+    import heapq
+    def merge(*iterables, heapq_merge=heapq.merge):
+        return heapq_merge(*iterables)
+    key = mod.SortKey(SortOptions(ignore_case=True))
+    lines = ["{}{}\n".format("bBaA"[i % 4], i % 3) for i in range(60)]
+    def test(reverse):
+        with tempdir() as tmp, replattr(mod.heapq, "merge", merge,
+                                        sigcheck=False):
+            result = list(mod.external_sort(lines, key, reverse, 7,
+                tempdir=tmp, with_keys=True))
+        eq_([line for k, line in result],
+            sorted(lines, key=key, reverse=reverse))
+        eq_([k for k, line in result], [key(line) for k, line in result])
+    yield test, False
+    yield test, True
+
+def test_Descending():
+    import pickle
+    keys = [mod.Descending(k) for k in [2, 3, 1, 3]]
+    eq_([k.key for k in sorted(keys)], [3, 3, 2, 1])
+    eq_(pickle.loads(pickle.dumps(keys[0], pickle.HIGHEST_PROTOCOL)).key, 2)
+    eq_(mod.Descending("a"), mod.Descending("a"))
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # test helpers
 
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+from os.path import join
+
+from editxt.test.util import assert_raises, eq_, tempdir
+
+import editxt.command.stats as mod
+from editxt.command.base import CommandError
+from editxt.profiler import CommandProfiler, Record, COMMAND_BAR
+
+log = logging.getLogger(__name__)
+
+
+def test_command_stats():
+    def test(argstr, expect, enabled=False, records=(), after=None):
+        class sender:
+            class text_commander:
+                profiler = CommandProfiler()
+        profiler = sender.text_commander.profiler
+        profiler.enabled = enabled
+        profiler.records.extend(records)
+        with tempdir() as tmp:
+            class textview:
+                class doc_view:
+                    file_path = join(tmp, "doc.txt")
+            args = mod.command_stats.arg_parser.parse(argstr)
+            if isinstance(expect, Exception):
+                with assert_raises(type(expect), msg=str(expect)):
+                    mod.command_stats(textview, sender, args)
+            else:
+                result = mod.command_stats(textview, sender, args)
+                eq_(result, expect.format(tmp=tmp))
+            if after is not None:
+                after(profiler, tmp)
+    def check(enabled=None, records=None, dump=None):
+        def after(profiler, tmp):
+            if enabled is not None:
+                eq_(profiler.enabled, enabled)
+            if records is not None:
+                eq_(len(profiler.records), records)
+            if dump is not None:
+                with open(join(tmp, dump)) as fh:
+                    eq_(len(json.load(fh)), 1)
+        return after
+    rec = Record("sort", COMMAND_BAR, 0.001, 10, 1, 0)
+    yield test, "", "no commands recorded\n"\
+        "(profiling is off; use 'stats on' to enable it)"
+    yield test, "show", "command  count    p50    p90    p99    max\n" \
+        "sort         1  1.0ms  1.0ms  1.0ms  1.0ms", True, [rec]
+    yield test, "on", "command profiling enabled", False, (), check(True)
+    yield test, "off", "command profiling disabled", True, (), check(False)
+    yield test, "clear", "command statistics cleared", True, [rec], \
+        check(records=0)
+    yield test, "dump stats.json", "wrote 1 records to {tmp}/stats.json", \
+        False, [rec], check(dump="stats.json")
+    yield test, "dump", CommandError("please specify a file path")
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+import AppKit as ak
+from mocker import Mocker
+
+from editxt.test.util import eq_, replattr
+
+import editxt.command.structure as mod
+from editxt.headless import HeadlessTextView
+from editxt.structure import StructureIndex
+
+log = logging.getLogger(__name__)
+
+
+def test_expand_selection():
+    def test(text, sel, expect):
+        tv = HeadlessTextView(text)
+        tv.setSelectedRange_(sel)
+        beeps = []
+        with replattr(ak, "NSBeep", lambda: beeps.append(1)):
+            mod.expand_selection(tv, None, None)
+        if expect is None:
+            eq_((tv.selectedRange(), beeps), (sel, [1]))
+        else:
+            start, length = tv.selectedRange()
+            eq_((text[start:start + length], beeps), (expect, []))
+    text = "f(a, [b])\nif x:\n    y\n"
+    yield test, text, (6, 0), "b"
+    yield test, text, (6, 1), "[b]"
+    yield test, text, (5, 3), "a, [b]"
+    yield test, text, (2, 6), "(a, [b])"
+    yield test, text, (20, 0), "    y"
+    yield test, text, (0, 0), None
+    yield test, text, (0, len(text)), None
+
+def test_goto_matching_bracket():
+    def test(text, caret, expect):
+        tv = HeadlessTextView(text)
+        tv.setSelectedRange_((caret, 0))
+        beeps = []
+        with replattr(ak, "NSBeep", lambda: beeps.append(1)):
+            mod.goto_matching_bracket(tv, None, None)
+        eq_((tv.selectedRange(), beeps),
+            ((expect, 0), [] if expect != caret else [1]))
+    text = "a(b\n[c])"
+    yield test, text, 0, 0
+    yield test, text, 1, 7
+    yield test, text, 7, 1
+    yield test, text, 8, 2
+    yield test, text, 2, 8
+    yield test, text, 4, 6
+    yield test, text, 6, 4
+    yield test, text, 5, 7
+    yield test, text, 3, 3
+    yield test, "(]", 0, 0
+    yield test, "", 0, 0
+
+def test_structure_commands_NSTextView():
+    # NSTextView ranges count UTF-16 code units (two per emoji)
+    text = 'x = "\U0001f600"\nf(a)\n'
+    def test(command, sel, expect):
+        m = Mocker()
+        tv = m.mock(ak.NSTextView)
+        tv.doc_view.document.structure >> StructureIndex()
+        tv.string() >> text
+        tv.selectedRange() >> sel
+        tv.setSelectedRange_(expect)
+        tv.scrollRangeToVisible_(expect)
+        with m:
+            command(tv, None, None)
+    yield test, mod.goto_matching_bracket, (11, 0), (13, 0)
+    yield test, mod.goto_matching_bracket, (13, 0), (11, 0)
+    yield test, mod.goto_matching_bracket, (10, 0), (12, 0)
+    yield test, mod.expand_selection, (11, 0), (11, 1)
+    yield test, mod.expand_selection, (11, 1), (10, 3)
@@ -17,31 +17,313 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
-from mocker import Mocker, ANY
+import os
+
+from mocker import Mocker, ANY, expect
 from AppKit import NSMakeRange, NSRange, NSTextStorage, NSTextView
 #from Foundation import *
-from editxt.test.util import eq_, TestConfig
+from editxt.test.util import assert_raises, eq_, replattr, TestConfig
 
 import editxt.constants as const
 import editxt.command.util as mod
 from editxt.command.parser import ArgumentError, CommandParser, Int, Options
 
+def test_current_directory():
+    def test(file_path, expect):
+        class textview:
+            class doc_view:
+                pass
+        textview.doc_view.file_path = file_path
+        eq_(mod.current_directory(textview), expect)
+    yield test, None, None
+    yield test, "/dir/doc.txt", "/dir"
+
+def test_iterlines():
+    def test(text, expect, range=(0,)):
+        eq_(list(mod.iterlines(text, range)), expect)
+        for size in (1, 3):
+            with replattr(mod, "LINE_BLOCK_SIZE", size):
+                eq_(list(mod.iterlines(text, range)), expect)
+    yield test, "", [""]
+    yield test, "abc", ["abc"]
+    yield test, "a\nb\n", ["a\n", "b\n"]
+    yield test, "a\r\nb\rc\u2028d\n\n", ["a\r\n", "b\r", "c\u2028", "d\n", "\n"]
+    yield test, "a\x85b\u2029c\fd\n", ["a\x85b\u2029c\fd\n"]
+    yield test, "\r\n\r\n\r", ["\r\n", "\r\n", "\r"]
+    yield test, "a\nbc\nd\n", ["bc\n", "d"], (2, 4)
+    yield test, "a\r\nb", ["\n"], (2, 1)
+    yield test, "a\nb", [], (1, 0)
+
+def test_line_offsets():
+    def test(text, expect, range=(0,)):
+        offsets = mod.line_offsets(text, range)
+        eq_(list(offsets), expect)
+        with replattr(mod, "LINE_BLOCK_SIZE", 1):
+            eq_(list(mod.line_offsets(text, range)), expect)
+        lines = [text[a:b] for a, b in zip(expect, expect[1:])]
+        eq_(lines, list(mod.iterlines(text, range)) if text else [])
+    yield test, "", [0]
+    yield test, "abc", [0, 3]
+    yield test, "a\r\nb\rc\u2028d\n", [0, 3, 5, 7, 9]
+    yield test, "a\x85b\n\n", [0, 4, 5]
+    yield test, "a\nbc\nd\n", [2, 5, 6], (2, 4)
+    yield test, "a\nb", [1], (1, 0)
+
+def test_Lines():
+    text = "ab\ncd\r\n\nef"
+    lines = mod.Lines(text)
+    eq_(len(lines), 4)
+    eq_(list(lines), ["ab\n", "cd\r\n", "\n", "ef"])
+    eq_([lines[i] for i in (0, 1, -1)], ["ab\n", "cd\r\n", "ef"])
+    eq_(lines.range, (0, len(text)))
+    eq_(lines.line_range(1), (3, 4))
+    eq_(lines.line_range(-1), (8, 2))
+    eq_([lines.line_index(i) for i in (0, 2, 3, 7, 8, 10)], [0, 0, 1, 2, 3, 3])
+    with assert_raises(IndexError):
+        lines[4]
+    sub = lines[1:3]
+    eq_(list(sub), ["cd\r\n", "\n"])
+    eq_((len(sub), sub[-1], sub.range), (2, "\n", (3, 5)))
+    eq_(list(sub[1:]), ["\n"])
+    eq_(list(lines[3:1]), [])
+    eq_(len(mod.Lines("")), 0)
+    with assert_raises(ValueError):
+        lines[::2]
+    part = mod.Lines(text, mod.line_offsets(text, (3, 5)))
+    eq_(list(part), ["cd\r\n", "\n"])
+
+def test_line_edit():
+    def test(old, new, edit):
+        eq_(mod.line_edit(old, new), edit)
+        if edit is not None:
+            start, length, string = edit
+            eq_(old[:start] + string + old[start + length:], new)
+    yield test, "abc\n", "abc\n", None
+    yield test, "abc\n", "\tabc\n", (0, 0, "\t")
+    yield test, "    abc\n", "abc\n", (0, 4, "")
+    yield test, "  \n", "\n", (0, 2, "")
+    yield test, "", "x", (0, 0, "x")
+    yield test, "  x abc\n", "   abc\n", (2, 1, "")
+    yield test, "\tx\tabc\n", "\t\tabc\n", (1, 1, "")
+    yield test, "  abc\n", "\t abc\n", (0, 1, "\t")
+    yield test, "a\n", "b\n", (0, 1, "b")
+
+def test_line_edits():
+    def test(text, range, transform, edits):
+        eq_(list(mod.line_edits(text, range, transform)), edits)
+    indent = lambda line: "  " + line
+    yield test, "", (0, 0), indent, [(0, 0, "  ")]
+    yield test, "a\nb\nc", (0, 5), indent, [(0, 0, "  "), (2, 0, "  "), (4, 0, "  ")]
+    yield test, "a\nb\nc", (2, 2), indent, [(2, 0, "  ")]
+    yield test, "a\n b\nc", (0, 6), str.lstrip, [(2, 1, "")]
+    yield test, "x = '\U0001f600'\ny = 1\n", (0, 14), indent, \
+        [(0, 14, "  x = '\U0001f600'\n  y = 1\n")]
+    yield test, "\U0001f600\nb\n", (0, 4), str.lstrip, []
+
+def test_diff_edits():
+    def test(text, range, new, edits):
+        eq_(list(mod.diff_edits(text, range, new)), edits)
+    yield test, "abc\ndef\n", (4, 4), "dxf\n", [(5, 1, "x")]
+    yield test, "abc\ndef\n", (0, 8), "abc\ndef\n", []
+    yield test, "a \U0001f600\nb\n", (0, 6), "a \U0001f600 b\n", \
+        [(0, 6, "a \U0001f600 b\n")]
+    yield test, "a \U0001f600\nb\n", (0, 6), "a \U0001f600\nb\n", []
+
+def test_text_length():
+    from editxt.headless import HeadlessTextView
+    def test(textview, text, length):
+        eq_(mod.text_length(textview, text), length)
+    headless = HeadlessTextView("")
+    textview = NSTextView.alloc().init()
+    yield test, headless, "abc", 3
+    yield test, headless, "a\U0001f600", 2
+    yield test, textview, "abc", 3
+    yield test, textview, "a\U0001f600b\U0001f600", 6
+
+def test_Utf16Offsets():
+    offsets = mod.Utf16Offsets("a\U0001f600b\U0001f600\U0001f600c")
+    def test(char, utf16):
+        eq_(offsets.to_utf16(char), utf16)
+        eq_(offsets.to_char(utf16), char)
+    yield test, 0, 0
+    yield test, 1, 1
+    yield test, 2, 3
+    yield test, 3, 4
+    yield test, 4, 6
+    yield test, 5, 8
+    yield test, 6, 9
+    yield eq_, offsets.to_char(2), 1
+    yield eq_, offsets.char_range((3, 5)), (2, 3)
+    yield eq_, offsets.utf16_range((2, 3)), (3, 5)
+    yield eq_, list(offsets.utf16_edits([(1, 1, "x"), (5, 0, "y")])), \
+        [(1, 2, "x"), (8, 0, "y")]
+
+def test_view_offsets():
+    from editxt.headless import HeadlessTextView
+    text = "\U0001f600a"
+    eq_(mod.view_offsets(HeadlessTextView(text), text).to_utf16(1), 1)
+    eq_(mod.view_offsets(NSTextView.alloc().init(), text).to_utf16(1), 2)
+
+def test_line_range():
+    def test(text, range, expect):
+        eq_(mod.line_range(text, range), expect)
+    yield test, "", (0, 0), (0, 0)
+    yield test, "abc", (1, 0), (0, 3)
+    yield test, "a\nb\nc", (2, 0), (2, 2)
+    yield test, "a\nb\nc", (1, 0), (0, 2)
+    yield test, "a\nb\nc", (0, 2), (0, 2)
+    yield test, "a\nb\nc", (0, 3), (0, 4)
+    yield test, "a\r\nb", (3, 1), (3, 1)
+    yield test, "a\r\nb", (0, 1), (0, 3)
+    yield test, "a\rb\u2028c", (2, 1), (2, 2)
+    yield test, "a\n", (2, 0), (2, 0)
+
+def test_coalesce_edits():
+    def test(edits, ranges, strings):
+        eq_(mod.coalesce_edits(edits), (ranges, strings))
+    yield test, [], [], []
+    yield test, [(0, 0, "")], [], []
+    yield test, [(0, 0, "a"), (3, 1, "")], [(0, 0), (3, 1)], ["a", ""]
+    yield test, [(0, 1, "a"), (1, 2, "b"), (3, 0, "c")], [(0, 3)], ["abc"]
+    yield test, [(0, 1, ""), (2, 0, ""), (2, 1, "x")], [(0, 1), (2, 1)], ["", "x"]
+
+def test_apply_edits():
+    from editxt.headless import HeadlessTextView
+    class TextView(HeadlessTextView):
+        allow = True
+        def shouldChangeTextInRanges_replacementStrings_(self, ranges, strings):
+            self.calls = list(zip(ranges, strings))
+            return self.allow
+    def test(text, edits, result, calls, allow=True):
+        tv = TextView(text)
+        tv.allow = allow
+        delta = mod.apply_edits(tv, edits)
+        eq_(tv.text, result)
+        eq_(delta, len(result) - len(text) if allow else None)
+        eq_(getattr(tv, "calls", []), calls)
+    yield test, "abc", [], "abc", []
+    yield test, "abc", [(0, 0, "x")], "xabc", [((0, 0), "x")]
+    yield test, "a\nb\n", [(0, 0, "  "), (2, 0, "  ")], "  a\n  b\n", \
+        [((0, 0), "  "), ((2, 0), "  ")]
+    yield test, "abc", [(0, 1, ""), (1, 1, "")], "c", [((0, 2), "")]
+    yield test, "abc", [(0, 1, "")], "abc", [((0, 1), "")], False
+
+def test_apply_edits_NSTextView():
+    m = Mocker()
+    tv = m.mock(NSTextView)
+    ts = m.mock(NSTextStorage)
+    def should_change(ranges, strings):
+        eq_([tuple(r.rangeValue()) for r in ranges], [(0, 0), (2, 1)])
+        eq_(strings, ["x", "\U0001f600"])
+        return True
+    expect(tv.shouldChangeTextInRanges_replacementStrings_(ANY, ANY)) \
+        .call(should_change)
+    tv.textStorage() >> ts
+    ts.beginEditing()
+    ts.replaceCharactersInRange_withString_((2, 1), "\U0001f600")
+    ts.replaceCharactersInRange_withString_((0, 0), "x")
+    ts.endEditing()
+    tv.didChangeText()
+    with m:
+        eq_(mod.apply_edits(tv, [(0, 0, "x"), (2, 1, "\U0001f600")]), 2)
+
+def test_edit_selections():
+    from editxt.headless import HeadlessTextView
+    def test(text, sels, edit, result, newsels):
+        tv = HeadlessTextView(text)
+        tv.setSelectedRanges_(sels)
+        delta = mod.edit_selections(tv, edit)
+        eq_(tv.text, result)
+        eq_(delta, None if newsels is None else len(result) - len(text))
+        eq_(tv.selectedRanges(), sels if newsels is None else newsels)
+    insert = lambda text, sel: (sel[0], sel[1], "xy")
+    delete = lambda text, sel: (sel[0] - 1, 1, "") if sel[0] else None
+    nothing = lambda text, sel: None
+    yield test, "abc", [(1, 0)], insert, "axybc", [(3, 0)]
+    yield test, "abc", [(0, 1), (2, 1)], insert, "xybxy", [(2, 0), (5, 0)]
+    yield test, "abc", [(3, 0), (0, 0)], insert, "xyabcxy", [(2, 0), (7, 0)]
+    yield test, "abc", [(0, 0), (2, 0)], delete, "ac", [(0, 0), (1, 0)]
+    yield test, "abc", [(1, 0), (2, 0)], delete, "c", [(0, 0)]
+    yield test, "abc", [(0, 0), (1, 0)], nothing, "abc", None
+    yield test, "abc", [(1, 2), (2, 0)], \
+        lambda text, sel: (sel[0] - 1, sel[1] + 1, ""), "", [(0, 0)]
+
+def test_whitespace_edits():
+    def test(text, expect, kw={}):
+        edits = list(mod.whitespace_edits(text, **kw))
+        eq_(edits, sorted(edits))
+        result = text
+        for offset, length, string in reversed(edits):
+            result = result[:offset] + string + result[offset + length:]
+        eq_(result, expect)
+    tabs = mod.indent_normalizer(const.INDENT_MODE_TAB, 4)
+    yield test, "", ""
+    yield test, "  a  \r\n", "  a  \r\n"
+    yield test, "a\r\nb\rc\u2028d\n", "a\nb\nc\nd\n", dict(eol="\n")
+    yield test, "a\nb\n", "a\r\nb\r\n", dict(eol="\r\n")
+    yield test, "a \t\nb\t\n", "a\nb\n", dict(strip=True)
+    yield test, "a\n  \t\n  b  ", "a\n\n  b", dict(strip=True)
+    yield test, "    a\n  \tb\n", "\ta\n\tb\n", dict(indent=tabs)
+    yield test, "a", "a\n", dict(final_newline=True)
+    yield test, "a\r\nb", "a\r\nb\r\n", dict(final_newline=True)
+    yield test, "a\r\nb", "a\nb\n", dict(final_newline=True, eol="\n")
+    yield test, "a\n", "a\n", dict(final_newline=True)
+    yield test, "     x  \r\n\t y\t", "\t x\n\t y\n", \
+        dict(indent=tabs, eol="\n", strip=True, final_newline=True)
+
+def test_indent_normalizer():
+    def test(mode, size, ws, expect):
+        eq_(mod.indent_normalizer(mode, size)(ws), expect)
+    TAB = const.INDENT_MODE_TAB
+    SPACE = const.INDENT_MODE_SPACE
+    yield test, TAB, 4, "    ", "\t"
+    yield test, TAB, 4, "  \t", "\t"
+    yield test, TAB, 4, "      ", "\t  "
+    yield test, TAB, 2, "\t   ", "\t\t "
+    yield test, SPACE, 4, "\t", "    "
+    yield test, SPACE, 4, " \t ", "     "
+    yield test, SPACE, 2, "\t\t", "    "
+
+def test_shift_offset():
+    from editxt.headless import HeadlessTextView
+    def test(offset, edits, expect, textview=HeadlessTextView("")):
+        eq_(mod.shift_offset(textview, offset, edits), expect)
+    edits = [(1, 2, ""), (5, 1, "xyz")]
+    yield test, 0, edits, 0
+    yield test, 1, edits, 1
+    yield test, 2, edits, 1
+    yield test, 3, edits, 1
+    yield test, 5, edits, 3
+    yield test, 6, edits, 6
+    yield test, 8, edits, 8
+    yield test, 2, [(0, 4, "x")], 1
+    yield test, 2, [(0, 0, "\U0001f600")], 3
+    yield test, 2, [(0, 0, "\U0001f600")], 4, NSTextView.alloc().init()
+
 def test_replace_newlines():
     def test(c):
         result = []
         m = Mocker()
         tv = m.mock(NSTextView)
         tv.string() >> c.input
-        sel = tv.selectedRange() >> m.mock(NSRange)
         if c.input != c.output:
-            rng = NSMakeRange(0, len(c.input))
-            tv.shouldChangeTextInRange_replacementString_(rng, ANY) >> True
+            tv.selectedRange() >> NSRange(0, 0)
+            tv.shouldChangeTextInRanges_replacementStrings_(ANY, ANY) >> True
             ts = tv.textStorage() >> m.mock(NSTextStorage)
-            ts.replaceCharactersInRange_withString_(rng, c.output)
+            ts.beginEditing()
+            result.append(c.input)
+            def replace(range, string):
+                text = result[0]
+                result[0] = text[:range[0]] + string + text[sum(range):]
+            expect(ts.replaceCharactersInRange_withString_(ANY, ANY)) \
+                .call(replace).count(1, None)
+            ts.endEditing()
             tv.didChangeText()
-            tv.setSelectedRange_(sel)
+            tv.setSelectedRange_((0, 0))
         with m:
             mod.replace_newlines(tv, c.eol)
+            if c.input != c.output:
+                eq_(result[0], c.output)
     c = TestConfig(eol=const.EOLS[const.NEWLINE_MODE_UNIX])
     yield test, c(input="", output="")
     yield test, c(input="\r\n", output="\n")
@@ -56,30 +338,32 @@ def test_change_indentation():
         if c.eol != "\n":
             c.input = c.input.replace("\n", c.eol)
             c.output = c.output.replace("\n", c.eol)
-        result = []
+        result = [c.input]
         m = Mocker()
         tv = m.mock(NSTextView)
         reset = (c.new == "\t")
-        if c.old != c.new or reset:
+        if reset:
+            doc = tv.doc_view.document >> m.mock(TextDocument)
+            doc.reset_text_attributes(c.size)
+        if c.old != c.new:
             tv.string() >> c.input
-            rng = NSMakeRange(0, len(c.input))
-            tv.shouldChangeTextInRange_replacementString_(rng, c.output) >> True
-            if reset:
-                doc = tv.doc_view.document >> m.mock(TextDocument)
-                doc.reset_text_attributes(c.size)
             if c.input != c.output:
-                sel = tv.selectedRange() >> NSRange(*c.sel)
+                tv.selectedRange() >> NSRange(*c.sel)
+                tv.shouldChangeTextInRanges_replacementStrings_(ANY, ANY) >> True
                 ts = tv.textStorage() >> m.mock(NSTextStorage)
-                ts.replaceCharactersInRange_withString_(rng, c.output)
-                if sel.location > len(c.output):
-                    sel = NSRange(len(c.output), 0)
-                elif sel.location + sel.length > len(c.output):
-                    sel = NSRange(sel.location, len(c.output) - sel.location)
-                tv.setSelectedRange_(sel)
-            tv.didChangeText()
+                ts.beginEditing()
+                def replace(range, string):
+                    text = result[0]
+                    result[0] = text[:range[0]] + string + text[sum(range):]
+                expect(ts.replaceCharactersInRange_withString_(ANY, ANY)) \
+                    .call(replace).count(1, None)
+                ts.endEditing()
+                tv.didChangeText()
+                tv.setSelectedRange_(c.newsel or c.sel)
         with m:
             mod.change_indentation(tv, c.old, c.new, c.size)
-    c = TestConfig(old="  ", new="   ", size=4, sel=(0, 0))
+            eq_(result[0], c.output)
+    c = TestConfig(old="  ", new="   ", size=4, sel=(0, 0), newsel=None)
     for mode in [
         const.NEWLINE_MODE_UNIX,
         const.NEWLINE_MODE_MAC,
@@ -104,8 +388,12 @@ def test_change_indentation():
         yield test, c(input="   x\n", output="\t x\n")
         yield test, c(input="    x\n", output="\t\tx\n")
         yield test, c(input="    x    \n", output="\t\tx    \n")
-        yield test, c(input="  x\n    y\n", output="\tx\n\t\ty\n", sel=(8, 2))
-        yield test, c(input="  x\n    y\n", output="\tx\n\t\ty\n", sel=(6, 4))
+        yield test, c(input="  x\n    y\n", output="\tx\n\t\ty\n", sel=(8, 2),
+                      newsel=(5, 2))
+        yield test, c(input="  x\n    y\n", output="\tx\n\t\ty\n", sel=(6, 4),
+                      newsel=(5, 2))
+        yield test, c(input="\U0001f600\n  x\n", output="\U0001f600\n\tx\n",
+                      sel=(5, 1), newsel=(4, 1))
         c = c(old="\t", new="   ", size=3)
         yield test, c(input="", output="")
         yield test, c(input="\t\n", output="   \n")
@@ -149,7 +437,8 @@ if __name__ == "__main__":
     yield test, SPACE, 4, program
     yield test, SPACE, 4, program.replace(" foo()", "foo()")
 
-    yield test, SPACE, 3, """
+    # indentation changes by four columns more often than by three
+    yield test, SPACE, 4, """
 a
    b
    b
@@ -161,3 +450,70 @@ a
        c
            d
 """
+
+def test_detect_indentation():
+    TAB = const.INDENT_MODE_TAB
+    SPACE = const.INDENT_MODE_SPACE
+    def test(text, mode, size, confidence, sample_lines=256):
+        result = mod.detect_indentation(text, sample_lines)
+        eq_(result, (mode, size, confidence))
+    yield test, "", None, None, 0.0
+    yield test, "x\n  \nx\n", None, None, 0.0
+    yield test, "x\n\tx\n", TAB, None, 1.0
+    yield test, "x\n\tx\n  x\n\tx\n", TAB, None, 2 / 3
+    yield test, "x\n\tx\n  x\n", TAB, None, 0.5
+    yield test, "x\n  x\n\tx\n", SPACE, 2, 0.5
+    yield test, "/*\n * x\n */\nf\n\tx\n", TAB, None, 1.0
+    yield test, "x\n    x\n        x\n    x\n", SPACE, 4, 1.0
+    yield test, "x\n  x\n    x\n  x\n", SPACE, 2, 1.0
+    yield test, "x\n    x\n      x\n    x\n        x\n", SPACE, 4, 2 / 3
+    yield test, "    x\n    x\n", SPACE, 4, 1.0
+
+    # the head, middle and tail of long text are sampled
+    def text(head, middle, tail):
+        return "x\n" + head * 5 + "y\n" * 100 + middle * 5 + "y\n" * 100 + \
+            tail * 5
+    yield test, text("  x\n", "y\n", "\tx\n"), TAB, None, 5 / 9, 5
+    yield test, text("  x\n", "\tx\n", "\tx\n"), TAB, None, 10 / 14, 5
+    yield test, text("    x\n", "y\n", "    x\n"), SPACE, 4, 1.0, 5
+    yield test, text("y\n", "\tx\n", "y\n"), TAB, None, 1.0, 5
+
+def test_detect_file_indentation():
+    from editxt.test.util import tempdir
+    TAB = const.INDENT_MODE_TAB
+    SPACE = const.INDENT_MODE_SPACE
+    with tempdir() as tmp, replattr(mod, "_indentation_cache", {}):
+        cache = mod._indentation_cache = mod.OrderedDict()
+        path = os.path.join(tmp, "file.txt")
+        eq_(mod.detect_file_indentation(path), mod.NO_INDENTATION)
+        eq_(mod.detect_file_indentation(path, "x\n\tx"), (TAB, None, 1.0))
+        eq_(len(cache), 0)
+        with open(path, "w") as fh:
+            fh.write("x\n  x\n")
+        eq_(mod.detect_file_indentation(path), (SPACE, 2, 1.0))
+        eq_(len(cache), 1)
+        # text is not analyzed if the file has not changed
+        eq_(mod.detect_file_indentation(path, "x\n\tx\n"), (SPACE, 2, 1.0))
+        with open(path, "w") as fh:
+            fh.write("x\n   x\n")
+        eq_(mod.detect_file_indentation(path), (SPACE, 3, 1.0))
+        eq_(len(cache), 2)
+
+def test_iter_command_history():
+    from editxt.history import History
+    from editxt.test.util import tempdir
+    def test(c):
+        with tempdir() as tmp:
+            history = History(tmp, 3, 5)
+            for item in ["cmd 1", "x 2", "12", "cmd 3", "alt 4", "cmd", "y"]:
+                history.append(item)
+            parser = CommandParser(Int("num"))
+            command = TestConfig(name="cmd", names=c.names, arg_parser=parser,
+                                 lookup_with_arg_parser=c.with_parser)
+            eq_(list(mod.iter_command_history(command, history)), c.result)
+            # predicate results must be consistent when cached
+            eq_(list(mod.iter_command_history(command, history)), c.result)
+    c = TestConfig(names=["cmd"], with_parser=False)
+    yield test, c(result=["cmd 3", "cmd 1"])
+    yield test, c(names=["cmd", "alt"], result=["alt 4", "cmd 3", "cmd 1"])
+    yield test, c(with_parser=True, result=["cmd 3", "12", "cmd 1"])
@@ -43,7 +43,8 @@ def test_wrap_to_margin_guide():
     m = Mocker()
     tv = m.mock(ak.NSTextView)
     wrap = m.replace(mod, 'wrap_selected_lines')
-    wrap(tv, mod.Options(wrap_column=const.DEFAULT_RIGHT_MARGIN, indent=True))
+    wrap(tv, mod.Options(wrap_column=const.DEFAULT_RIGHT_MARGIN, indent=True,
+        optimal=False))
     with m:
         mod.wrap_at_margin(tv, None, None)
 
@@ -53,6 +54,7 @@ def test_WrapLinesController_default_options():
         eq_(ctl.options._target, mod.Options(
             wrap_column=const.DEFAULT_RIGHT_MARGIN,
             indent=True,
+            optimal=False,
         ))
 
 def test_WrapLinesController_wrap_():
@@ -71,7 +73,6 @@ def test_wrap_selected_lines():
         m = Mocker()
         opts = "<options>"
         tv = m.mock(TextView)
-        ts = tv.textStorage() >> m.mock(ak.NSTextStorage)
         wrap = m.replace(mod, 'wraplines')
         iterlines = m.replace("editxt.command.wraplines.iterlines")
         text = tv.string() >> fn.NSString.stringWithString_(c.text)
@@ -80,16 +81,18 @@ def test_wrap_selected_lines():
         eol = tv.doc_view.document.eol >> m.mock()
         lines = iterlines(text, sel) >> "<lines>"
         eol.join(wrap(lines, opts, tv) >> [c.result]) >> c.result
-        tv.shouldChangeTextInRange_replacementString_(sel, c.result) >> True
-        output = []
-        def callback(range, text):
-            output.append(text)
-        expect(ts.replaceCharactersInRange_withString_(sel, c.result)).call(callback)
-        tv.didChangeText()
+        apply_edits = m.replace(mod, 'apply_edits')
+        output = [str(text)]
+        def callback(textview, edits):
+            for start, length, string in reversed(list(edits)):
+                output[0] = output[0][:start] + string + output[0][start + length:]
+            return len(output[0]) - len(text)
+        expect(apply_edits(tv, ANY)).call(callback)
         tv.setSelectedRange_((sel[0], len(c.result)))
         with m:
             wrap_selected_lines(tv, opts)
-            eq_(c.result, output[0])
+            sel_end = sel[0] + len(c.result)
+            eq_(c.result, output[0][sel[0]:sel_end])
     c = TestConfig(col=30, ind=False, sel=None)
     yield test, c(text="Hello world", result="Hello world")
     yield test, c(text="Hello\nworld", result="Hello", sel=(0, 5))
@@ -101,7 +104,7 @@ def test_wraplines():
         tv = m.mock(TextView)
         if c.ind:
             tv.doc_view.document.comment_token >> c.comment
-        opts = TestConfig(wrap_column=c.wid, indent=c.ind)
+        opts = TestConfig(wrap_column=c.wid, indent=c.ind, optimal=c.opt)
         text = fn.NSString.stringWithString_(c.text)
         sel = (0, len(c.text))
         with m:
@@ -109,7 +112,7 @@ def test_wraplines():
                 import pdb; pdb.set_trace()
             output = "\n".join(wraplines(iterlines(text, sel), opts, tv))
             eq_(c.result, output)
-    c = TestConfig(ind=False)
+    c = TestConfig(ind=False, opt=False)
     yield test, c(text="", result="\n", wid=80)
     yield test, c(text="\n", result="\n", wid=80)
     yield test, c(text="Hello world", result="Hello\nworld\n", wid=1)
@@ -148,6 +151,11 @@ def test_wraplines():
     yield test, c(text="abc\n \ndef ghi", result="abc\n\ndef ghi\n", wid=7)
     yield test, c(text="abc\n \ndef ghi", result="abc\n\ndef ghi\n", wid=8)
     yield test, c(text="abc\n\n\ndef ghi", result="abc\n\n\ndef ghi\n", wid=8)
+    yield test, c(text="abc\n\n", result="abc\n\n", wid=8)
+    yield test, c(text="abcd\n\nef", result="abcd\n\nef\n", wid=4)
+    yield test, c(text="aaa bb cc ddddd", result="aaa bb\ncc\nddddd\n", wid=6)
+    yield test, c(text="aaa bb cc ddddd", result="aaa\nbb cc\nddddd\n", wid=6, opt=True)
+    yield test, c(text="Hi      my friend", result="Hi\nmy friend\n", wid=9, opt=True)
 
     c = c(ind=True, comment="#")
     yield test, c(text="  Hello world", result="  Hello\n  world\n", wid=1)
@@ -180,3 +188,28 @@ def test_wraplines():
                     result="  # abc\n  # \n  # def ---\n", wid=11)
         yield test, d(text="  # abc\n\n\n  # def ---\n",
                     result="  # abc\n  # \n  # \n  # def ---\n", wid=11)
+
+def test_greedy_lines():
+    def test(text, width, first_width, lines):
+        eq_(list(mod.greedy_lines(text, width, first_width)), lines)
+    yield test, "abc", 1, None, ["abc"]
+    yield test, "abc def", 7, None, ["abc def"]
+    yield test, "abc def", 6, None, ["abc", "def"]
+    yield test, "abc def ghi", 7, 3, ["abc", "def ghi"]
+    yield test, "ab  cd  ef", 6, None, ["ab  cd", "ef"]
+    yield test, "ab    cd    ef", 6, None, ["ab cd", "ef"]
+    yield test, "ab    cd    ef", 8, None, ["ab    cd", "ef"]
+    yield test, "abcdefgh ij kl", 5, None, ["abcdefgh", "ij kl"]
+    yield test, "a\tb", 3, None, ["a\tb"]
+
+def test_optimal_lines():
+    def test(text, width, first_width, lines):
+        eq_(list(mod.optimal_lines(text, width, first_width)), lines)
+    yield test, "abc", 1, None, ["abc"]
+    yield test, "abc def", 7, None, ["abc def"]
+    yield test, "aaa bb cc ddddd", 6, None, ["aaa", "bb cc", "ddddd"]
+    yield test, "aaa bb cc ddddd", 6, 3, ["aaa", "bb cc", "ddddd"]
+    yield test, "aaa bb cc ddddd", 9, None, ["aaa bb cc", "ddddd"]
+    yield test, "aa bb cc", 5, 2, ["aa", "bb cc"]
+    yield test, "abcdefgh ij kl", 5, None, ["abcdefgh", "ij kl"]
+    yield test, "ab  cd  ef", 6, None, ["ab  cd", "ef"]
@@ -93,6 +93,31 @@ def test_TextView_validateUserInterfaceItem_():
     yield test, c(action="performFindPanelAction:")
     yield test, c(action="performTextCommand:")
 
+def test_TextView_carets():
+    tv = TextView.alloc().init()
+    tv.setString_("abc")
+    eq_(tv.carets, None)
+    tv.carets = [(0, 0), (2, 0)]
+    eq_(tv.carets, [(0, 0), (2, 0)])
+    tv.setSelectedRange_((1, 0))
+    eq_(tv.carets, None)
+
+def test_TextView_insert_at_carets():
+    def test(text):
+        m = Mocker()
+        tv = TextView.alloc().init()
+        tv.carets = [(0, 0), (1, 1)]
+        edit_selections = m.replace(mod, "edit_selections")
+        def check(textview, func):
+            eq_(func("abc", (1, 1)), (1, 1, "x"))
+        expect(edit_selections(tv, ANY)).call(check).count(2)
+        with m:
+            tv.insertText_replacementRange_(text,
+                fn.NSMakeRange(fn.NSNotFound, 0))
+            tv.insertText_(text)
+    yield test, "x"
+    yield test, fn.NSAttributedString.alloc().initWithString_("x")
+
 def test_TextView_setFrameSize():
     def test(c):
         m = Mocker()
@@ -35,7 +35,7 @@ from editxt.commands import iterlines
 from editxt.editor import EditorWindowController, Editor
 from editxt.document import TextDocumentView, TextDocument
 from editxt.project import Project
-from editxt.util import load_yaml
+from editxt.util import dump_yaml, load_yaml
 
 from editxt.test.util import do_method_pass_through, TestConfig, replattr, tempdir
 
@@ -787,6 +787,83 @@ def test_save_editor_states():
     yield test, c(editors=[1, 2])
     yield test, c(editors=[1, 2, 3, 4])
 
+def test_save_editor_states_incremental():
+    def test(c):
+        with tempdir() as tmp:
+            state_path = os.path.join(tmp, const.STATE_DIR)
+            app = Application(tmp)
+            editors = [TestConfig(state=[ident]) for ident in c.before]
+            written = []
+            def dump(state, fh=None):
+                written.append(state)
+                return dump_yaml(state, fh)
+            app.iter_editors = lambda: iter(editors)
+            with replattr(mod, "dump_yaml", dump, sigcheck=False):
+                app.save_editor_states()
+                del written[:]
+                editors[:] = [TestConfig(state=[ident]) for ident in c.after]
+                app.save_editor_states()
+            eq_(written, c.written)
+            states = sorted(os.listdir(state_path))
+            eq_(len(states), len(c.after), states)
+            for ident, state in zip(c.after, states):
+                with open(os.path.join(state_path, state)) as f:
+                    eq_(load_yaml(f), [ident])
+    c = TestConfig(before=[1, 2, 3])
+    yield test, c(after=[1, 2, 3], written=[])
+    yield test, c(after=[1, 4, 3], written=[[4]])
+    yield test, c(after=[1, 2], written=[])
+    yield test, c(after=[1, 2, 3, 4], written=[[4]])
+
+def test_save_editor_states_remove_error():
+    def test(error):
+        with tempdir() as tmp:
+            app = Application(tmp)
+            editors = [TestConfig(state=[1]), TestConfig(state=[2])]
+            app.iter_editors = lambda: iter(editors)
+            app.save_editor_states()
+            del editors[1:]
+            removed = []
+            errors = []
+            def remove(path):
+                removed.append(path)
+                raise error
+            class log:
+                def error(*args, **kw):
+                    errors.append(args[1])
+            with replattr((os, "remove", remove), (mod, "log", log)):
+                app.save_editor_states()
+                eq_(len(app.saved_editor_states), 1)
+                app.save_editor_states() # error is not logged again
+            eq_(len(removed), 1)
+            eq_(len(errors), 0 if isinstance(error, FileNotFoundError) else 1)
+    yield test, FileNotFoundError(2, "No such file or directory")
+    yield test, PermissionError(13, "Permission denied")
+
+def test_schedule_save_editor_states():
+    from PyObjCTools import AppHelper
+    def test(scheduled):
+        app = Application()
+        app.editor_states_scheduled = scheduled
+        m = Mocker()
+        call_later = m.replace(AppHelper, "callLater")
+        if not scheduled:
+            call_later(1.0, app._save_scheduled_editor_states)
+        with m:
+            app.schedule_save_editor_states()
+        assert app.editor_states_scheduled
+    yield test, False
+    yield test, True
+
+def test_save_scheduled_editor_states():
+    app = Application()
+    app.editor_states_scheduled = True
+    m = Mocker()
+    m.method(app.save_editor_states)()
+    with m:
+        app._save_scheduled_editor_states()
+    assert not app.editor_states_scheduled
+
 def test_app_will_terminate():
     def test(ed_config):
         app = Application()
@@ -18,6 +18,8 @@
 # You should have received a copy of the GNU General Public License
 # along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import os
+from os.path import join
 
 from mocker import Mocker, expect, ANY, MATCH
 import AppKit as ak
@@ -36,6 +38,7 @@ def test_load_commands():
     eq_(cmds["text_menu_commands"], [
         mod.show_command_bar,
         mod.goto_line,
+        mod.open_file,
         mod.comment_text,
         mod.pad_comment_text,
         mod.indent_lines,
@@ -43,8 +46,14 @@ def test_load_commands():
         mod.wrap_at_margin,
         mod.wrap_lines,
         mod.sort_lines,
+        mod.block_edit,
         mod.reindent,
+        mod.normalize_whitespace,
+        mod.expand_selection,
+        mod.goto_matching_bracket,
         mod.find,
+        mod.run_script_file,
+        mod.command_stats,
         mod.clear_highlighted_text,
         mod.reload_config,
         mod.set_variable,
@@ -244,13 +253,19 @@ def test_text_commands():
         (tv.doc_view.document.indent_size << c.size).count(0, None)
         (tv.doc_view.document.eol << c.eol).count(0, None)
         sel = fn.NSMakeRange(*c.oldsel); (tv.selectedRange() << sel).count(0, None)
+        (tv.selectedRanges() << [sel]).count(0, None)
+        (tv.carets << None).count(0, None)
         (tv.string() << fn.NSString.stringWithString_(c.input)).count(0, None)
         (tv.shouldChangeTextInRange_replacementString_(ANY, ANY) << True).count(0, None)
+        (tv.shouldChangeTextInRanges_replacementStrings_(ANY, ANY) << True).count(0, None)
         ts = m.mock(ak.NSTextStorage); (tv.textStorage() << ts).count(0, None)
         c.setup(m, c, TestConfig(locals()))
         def do_text(sel, repl):
-            result.text = c.input[:sel[0]] + repl + c.input[sel[0] + sel[1]:]
+            text = result.text if "text" in result else c.input
+            result.text = text[:sel[0]] + repl + text[sel[0] + sel[1]:]
         expect(ts.replaceCharactersInRange_withString_(ANY, ANY)).call(do_text).count(0, None)
+        expect(ts.beginEditing()).count(0, None)
+        expect(ts.endEditing()).count(0, None)
         def do_sel(sel):
             result.sel = sel
         expect(tv.setSelectedRange_(ANY)).call(do_sel).count(0, None)
@@ -305,17 +320,17 @@ def test_text_commands():
     c = cbase(method=mod.insert_newline)
     for eol in eols:
         c = c(eol=eol)
-        yield test, c(input="", output="\n", oldsel=(0, 0))
-        yield test, c(input=" ", output=" \n ", oldsel=(1, 0))
-        yield test, c(input="  ", output="  \n  ", oldsel=(2, 0))
-        yield test, c(input="    ", output=" \n ", oldsel=(1, 0))
-        yield test, c(input="\t", output="\t\n\t", oldsel=(1, 0))
-        yield test, c(input="  a bc", output="  a\n  bc", oldsel=(3, 0))
-        yield test, c(input="  a bc", output="  a\n  c", oldsel=(3, 1))
-        yield test, c(input="a bc", output="a\nbc", oldsel=(1, 0))
         i = len(eol) - 1
-        yield test, c(input=" a\n b", output=" a\n b\n ", oldsel=(5 + i, 0))
-        yield test, c(input="\n x", output="\n\n x", oldsel=(1 + i, 0))
+        yield test, c(input="", output="\n", oldsel=(0, 0), newsel=(1 + i, 0))
+        yield test, c(input=" ", output=" \n ", oldsel=(1, 0), newsel=(3 + i, 0))
+        yield test, c(input="  ", output="  \n  ", oldsel=(2, 0), newsel=(5 + i, 0))
+        yield test, c(input="    ", output=" \n ", oldsel=(1, 0), newsel=(3 + i, 0))
+        yield test, c(input="\t", output="\t\n\t", oldsel=(1, 0), newsel=(3 + i, 0))
+        yield test, c(input="  a bc", output="  a\n  bc", oldsel=(3, 0), newsel=(6 + i, 0))
+        yield test, c(input="  a bc", output="  a\n  c", oldsel=(3, 1), newsel=(6 + i, 0))
+        yield test, c(input="a bc", output="a\nbc", oldsel=(1, 0), newsel=(2 + i, 0))
+        yield test, c(input=" a\n b", output=" a\n b\n ", oldsel=(5 + i, 0), newsel=(7 + 2 * i, 0))
+        yield test, c(input="\n x", output="\n\n x", oldsel=(1 + i, 0), newsel=(2 + 2 * i, 0))
 
 
     c = cbase(method=mod.indent_lines)
@@ -341,6 +356,9 @@ def test_text_commands():
         yield test, c(input="x\nxyz\n", output="  x\n  xyz\n", oldsel=(0, 4), newsel=(0, 10+2*i))
         yield test, c(input="x\rxyz\n", output="  x\r  xyz\n", oldsel=(0, 4), newsel=(0, 10+i))
         yield test, c(input="x\u2028xyz\n", output="  x\u2028  xyz\n", oldsel=(0, 4), newsel=(0, 10+i))
+        yield test, c(input="x = '\U0001f600'\ny = 1\n",
+            output="  x = '\U0001f600'\n  y = 1\n",
+            oldsel=(0, 15+2*i), newsel=(0, 19+2*i))
         # TODO convert leading tabs to spaces (and vice versa)
         #yield test, c(input=u"\tx\n\txyz\n", output=u"    x\n    xyz\n",
         #    oldsel=(0, 6), newsel=(0, 14+2*i))
@@ -423,6 +441,78 @@ def test_text_commands():
         yield test, c(input="\n       ", output="\n    ", oldsel=(8+i, 0), newsel=(5+i, 0))
         yield test, c(input="\n        ", output="\n    ", oldsel=(9+i, 0), newsel=(5+i, 0))
 
+def test_multiple_selections():
+    from editxt.headless import HeadlessDocument, HeadlessTextView
+    def test(method, text, sels, output, newsels, mode=const.INDENT_MODE_SPACE):
+        doc = HeadlessDocument(text)
+        doc.indent_mode = mode
+        doc.indent_size = 2
+        tv = HeadlessTextView(text, doc)
+        tv.setSelectedRanges_(sels)
+        method(tv, None, None)
+        eq_(tv.text, output)
+        eq_(tv.selectedRanges(), newsels)
+
+    tab = const.INDENT_MODE_TAB
+    yield test, mod.insert_newline, "a\nb\nc", [(1, 0), (3, 0), (5, 0)], \
+        "a\n\nb\n\nc\n", [(2, 0), (5, 0), (8, 0)]
+    yield test, mod.insert_newline, "  ab\n  cd", [(3, 0), (8, 0)], \
+        "  a\n  b\n  c\n  d", [(6, 0), (14, 0)]
+    yield test, mod.insert_newline, "abcd", [(1, 1), (2, 1)], \
+        "a\n\nd", [(2, 0), (3, 0)]
+    yield test, mod.move_to_beginning_of_line, "  a\n  b\n", \
+        [(3, 0), (7, 0)], "  a\n  b\n", [(2, 0), (6, 0)]
+    yield test, mod.move_to_beginning_of_line, "  a\n  b\n", \
+        [(2, 0), (6, 0)], "  a\n  b\n", [(0, 0), (4, 0)]
+    yield test, mod.move_to_beginning_of_line, "  ab", [(3, 0), (4, 0)], \
+        "  ab", [(2, 0)]
+    yield test, mod.delete_backward, "ab\ncd\nef", [(1, 0), (4, 0), (7, 0)], \
+        "b\nd\nf", [(0, 0), (2, 0), (4, 0)]
+    yield test, mod.delete_backward, "    a\n    b", [(4, 0), (10, 0)], \
+        "  a\n  b", [(2, 0), (6, 0)]
+    yield test, mod.delete_backward, "abc\ndef", [(0, 0), (1, 2), (5, 0)], \
+        "a\nef", [(0, 0), (1, 0), (2, 0)]
+    yield test, mod.delete_backward, "\ta\n\tb", [(1, 0), (4, 0)], \
+        "a\nb", [(0, 0), (2, 0)], tab
+    yield test, mod.delete_backward, "abc", [(1, 0), (2, 0)], "c", [(0, 0)]
+    yield test, mod.delete_backward, "ae\u0301\nb", [(3, 0), (5, 0)], \
+        "a\n", [(1, 0), (2, 0)], tab
+    yield test, mod.delete_backward, "ae\u0301\nb", [(3, 0), (5, 0)], \
+        "a\n", [(1, 0), (2, 0)]
+
+def test_multiple_selections_scale():
+    from editxt.headless import HeadlessTextView
+    lines = 5000
+    tv = HeadlessTextView("x\n" * lines)
+    tv.setSelectedRanges_([(i * 2 + 1, 0) for i in range(lines)])
+    mod.delete_backward(tv, None, None)
+    eq_(tv.text, "\n" * lines)
+    eq_(tv.selectedRanges()[-1], (lines - 1, 0))
+
+def test_open_file():
+    from editxt import app
+    def test(command, file_path, expect):
+        opened = []
+        class textview:
+            class doc_view:
+                pass
+        textview.doc_view.file_path = file_path
+        do = CommandTester(mod.open_file, textview=textview)
+        with replattr(
+                (app, "open_documents_with_paths", opened.append),
+                (app, "open_path_dialog", lambda: opened.append("dialog")),
+                sigcheck=False):
+            do(command)
+        eq_(opened, [expect])
+    home = os.path.expanduser("~")
+    yield test, "open", "/dir/doc.txt", "dialog"
+    yield test, "open file.txt", "/dir/doc.txt", ["/dir/file.txt"]
+    yield test, "open ../file.txt", "/dir/doc.txt", ["/file.txt"]
+    yield test, "open /abs/file.txt", "/dir/doc.txt", ["/abs/file.txt"]
+    yield test, "open ~/file.txt", "/dir/doc.txt", [join(home, "file.txt")]
+    yield test, "open 'a b.txt'", "/dir/doc.txt", ["/dir/a b.txt"]
+    yield test, "open file.txt", None, [join(home, "file.txt")]
+
 def test_reload_config():
     from editxt import app
     from editxt.config import Config
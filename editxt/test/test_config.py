@@ -121,6 +121,12 @@ def test_Config_schema():
         "newline_mode", const.NEWLINE_MODE_UNIX, \
         {"error": ["newline_mode: expected one of (LF|CR|CRLF|UNICODE), got 'xyz'"]}
 
+    yield test, {}, "on_save.normalize_indent", False
+    yield test, {}, "on_save.normalize_newlines", False
+    yield test, {}, "on_save.strip_trailing_whitespace", False
+    yield test, {"on_save": {"ensure_final_newline": True}}, \
+        "on_save.ensure_final_newline", True
+
     yield test, {}, "right_margin.position", const.DEFAULT_RIGHT_MARGIN
     yield test, {"right_margin": {"position": 42}}, "right_margin.position", 42
     yield test, {"right_margin": {"position": "xyz"}}, \
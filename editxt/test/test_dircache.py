@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import os
+import threading
+from os.path import join
+
+from editxt.test.util import eq_, replattr, tempdir
+
+import editxt.dircache as mod
+
+log = logging.getLogger(__name__)
+
+
+def touch(*paths):
+    for path in paths:
+        with open(path, "w") as fh:
+            pass
+
+def test_DirectoryCache_get():
+    with tempdir() as tmp:
+        touch(join(tmp, "b.txt"), join(tmp, "a.txt"))
+        os.mkdir(join(tmp, "dir"))
+        cache = mod.DirectoryCache()
+        eq_(cache.get(tmp, timeout=5), (["a.txt", "b.txt", "dir/"], True))
+        eq_(list(cache.listings), [tmp])
+        eq_(cache.get(join(tmp, "missing"), timeout=5), ([], True))
+
+def test_DirectoryCache_max_size():
+    with tempdir() as tmp:
+        for name in "abc":
+            os.mkdir(join(tmp, name))
+        cache = mod.DirectoryCache(max_size=2)
+        for name in "abca":
+            cache.get(join(tmp, name), timeout=5)
+        eq_(list(cache.listings), [join(tmp, "c"), join(tmp, "a")])
+
+def test_DirectoryCache_check_mtime():
+    with tempdir() as tmp:
+        touch(join(tmp, "a.txt"))
+        cache = mod.DirectoryCache(check_interval=0)
+        eq_(cache.get(tmp, timeout=5), (["a.txt"], True))
+        listing = cache.listings[tmp]
+        listing.idle.wait(5)
+        touch(join(tmp, "b.txt"))
+        os.utime(tmp, (0, listing.mtime + 10))
+        eq_(cache.get(tmp, timeout=5), (["a.txt", "b.txt"], True))
+
+def test_DirectoryCache_partial_listing():
+    started = threading.Event()
+    proceed = threading.Event()
+    def iter_names(path):
+        yield "b"
+        yield "a"
+        started.set()
+        proceed.wait(5)
+        yield "c"
+    with tempdir() as tmp, replattr(mod, "iter_names", iter_names, sigcheck=False):
+        cache = mod.DirectoryCache()
+        cache.get(tmp, timeout=0)
+        started.wait(5)
+        eq_(cache.get(tmp, timeout=0), (["a", "b"], False))
+        proceed.set()
+        eq_(cache.get(tmp, timeout=5), (["a", "b", "c"], True))
+
+def test_iter_names():
+    with tempdir() as tmp:
+        touch(join(tmp, "file"))
+        os.mkdir(join(tmp, "dir"))
+        eq_(sorted(mod.iter_names(tmp)), ["dir/", "file"])
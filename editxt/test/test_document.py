@@ -103,15 +103,66 @@ def test_document_view_interface():
         td.close()
 
 def test_create_with_state():
-    state = {"path": "<document path>"}
+    def test(is_open):
+        state = {"path": "/document/path"}
+        m = Mocker()
+        nsdc = m.replace(ak, "NSDocumentController")
+        dc = nsdc.sharedDocumentController() >> m.mock(ak.NSDocumentController)
+        doc = m.mock(TextDocument) if is_open else None
+        dc.documentForURL_(ANY) >> doc
+        m.method(TextDocument.get_with_path) # should not be called
+        if is_open:
+            create_with_document = m.method(TextDocumentView.create_with_document)
+            dv = create_with_document(doc) >> m.mock(TextDocumentView)
+            dv.edit_state = state
+        with m:
+            result = TextDocumentView.create_with_state(state)
+            if is_open:
+                eq_(result, dv)
+            else:
+                eq_(result.is_loaded, False)
+                eq_(result.file_path, state["path"])
+                eq_(result.edit_state, state)
+    yield test, True
+    yield test, False
+
+def test_TextDocumentView_unloaded():
+    def test(c):
+        path = "/document/path.txt"
+        m = Mocker()
+        doc = m.mock(TextDocument)
+        dv = TextDocumentView.alloc().init_with_path(path)
+        eq_(dv.is_loaded, False)
+        eq_(dv.file_path, path)
+        eq_(dv.is_dirty, False)
+        eq_(dv.displayName(), "path.txt")
+        if c.compare:
+            url = (fn.NSURL.fileURLWithPath_(c.compare) if c.compare else None)
+            doc.fileURL() >> url
+            with m:
+                eq_(dv.is_view_of_document(doc), c.compare == path)
+            return
+        m.method(TextDocument.get_with_path)(path) >> doc
+        with m:
+            eq_(dv.document, doc)
+            eq_(dv.is_loaded, True)
+            eq_(dv.document, doc) # load only once
+            eq_(dv.is_view_of_document(doc), True)
+    c = TestConfig(compare=None)
+    yield test, c
+    yield test, c(compare="/document/path.txt")
+    yield test, c(compare="/other/path.txt")
+
+def test_TextDocumentView_close_unloaded():
     m = Mocker()
-    dv = m.mock(TextDocumentView)
-    create_with_path = m.method(TextDocumentView.create_with_path)
-    create_with_path(state["path"]) >> dv
-    dv.edit_state = state
+    dv = TextDocumentView.alloc().init_with_path("/document/path.txt")
+    dv.project = proj = m.mock(Project)
+    proj.closing >> False
+    proj.remove_document_view(dv)
     with m:
-        result = TextDocumentView.create_with_state(state)
-        eq_(result, dv)
+        dv.close()
+    assert dv.document is None
+    eq_(dv.is_loaded, True)
 
 def test_create_with_path():
     print(type(TextDocumentView.create_with_document))
@@ -602,6 +653,14 @@ def test_perform_close():
     for num_views in range(3):
         yield test, num_views
 
+def test_perform_close_unloaded():
+    m = Mocker()
+    dv = TextDocumentView.alloc().init_with_path("/document/path.txt")
+    ed = m.mock(Editor)
+    ed.discard_and_focus_recent(dv)
+    with m:
+        dv.perform_close(ed)
+
 def test_document_shouldClose_contextInfo_():
     def test(should_close):
         m = Mocker()
@@ -745,6 +804,9 @@ def test_TextDocument_init():
     assert doc.text_storage is not None
     assert doc.syntaxer is not None
     eq_(doc._filestat, None)
+    eq_(doc._watched_path, None)
+    eq_(doc.external_filestat, None)
+    eq_(doc.externally_modified, False)
     eq_(doc.indent_size, 4)
     assert doc.props is not None
     #eq_(doc.save_hooks, [])
@@ -884,8 +946,10 @@ def test_setFileModificationDate_():
     eq_(doc.fileModificationDate(), None)
     eq_(doc._filestat, None)
     doc._filestat = "<checked>"
+    doc.externally_modified = True
     doc.setFileModificationDate_(dt)
     eq_(doc._filestat, None)
+    eq_(doc.externally_modified, False)
     eq_(doc.fileModificationDate(), dt)
 
 def test_is_externally_modified():
@@ -924,13 +988,130 @@ def test_is_externally_modified():
     yield test, c(ext_stat=1, loc_stat=0, date_ok=True, rval=True)
     yield test, c(ext_stat=1, loc_stat=2, date_ok=True, rval=True)
 
+def test_file_changed():
+    def test(c):
+        m = Mocker()
+        doc = TextDocument.alloc().init()
+        app = m.replace(mod, 'app')
+        filestat = m.replace(mod, 'filestat')
+        check = m.method(doc.check_for_external_changes)
+        doc._saving = c.saving
+        doc._saved_filestat = ("<path>", "<saved>")
+        if not c.saving:
+            filestat("<path>") >> c.stat
+            if c.stat != "<saved>":
+                m.method(doc.is_externally_modified)() >> c.extmod
+        if not c.saving and c.stat != "<saved>" and c.extmod:
+            views = []
+            for has_window, is_key in c.views:
+                view = m.mock(TextDocumentView)
+                win = view.window() >> (m.mock(ak.NSWindow) if has_window else None)
+                views.append(view)
+                if has_window:
+                    if win.isKeyWindow() >> is_key:
+                        check(win)
+                        break
+            app.iter_views_of_document(doc) >> views
+        with m:
+            doc.file_changed("<path>", "<stat>")
+        if c.saving:
+            eq_(doc._deferred_change, ("<path>", "<stat>"))
+            eq_(doc.external_filestat, None)
+        elif c.stat == "<saved>":
+            eq_(doc.external_filestat, None)
+            eq_(doc.externally_modified, False)
+        else:
+            eq_(doc.external_filestat, c.stat)
+            eq_(doc.externally_modified, bool(c.extmod))
+    c = TestConfig(saving=False, stat="<new>", extmod=True, views=[])
+    yield test, c(saving=True)
+    yield test, c(stat="<saved>")
+    yield test, c(extmod=None)
+    yield test, c(extmod=False)
+    yield test, c
+    yield test, c(views=[(False, False)])
+    yield test, c(views=[(True, False)])
+    yield test, c(views=[(True, True)])
+    yield test, c(views=[(False, False), (True, True)])
+
+def test_save_finished():
+    def test(c):
+        m = Mocker()
+        doc = TextDocument.alloc().init()
+        doc._saving = True
+        doc._saved_filestat = "<old>"
+        doc._deferred_change = c.change
+        if c.stat is not None:
+            m.method(doc.document_did_save)()
+        if c.change is not None:
+            m.method(doc.file_changed)(*c.change)
+        with m:
+            doc.save_finished("<path>", c.stat)
+        eq_(doc._saving, False)
+        eq_(doc._deferred_change, None)
+        eq_(doc._saved_filestat,
+            "<old>" if c.stat is None else ("<path>", c.stat))
+    c = TestConfig(stat="<stat>", change=None)
+    yield test, c
+    yield test, c(stat=None)
+    yield test, c(change=("<path>", "<changed>"))
+    yield test, c(stat=None, change=("<path>", "<changed>"))
+
+def test_file_changed_while_saving():
+    from editxt.test.util import tempdir
+    from editxt.util import filestat
+    m = Mocker()
+    app = m.replace(mod, 'app')
+    doc = TextDocument.alloc().init()
+    m.method(doc.document_did_save)()
+    # the file modification date is stale until the save has completed
+    m.method(doc.is_externally_modified)() >> True
+    app.iter_views_of_document(doc) >> []
+    with tempdir() as tmp, m:
+        path = os.path.join(tmp, "file.txt")
+        doc._saving = True # writeSafelyToURL_... has started
+        with open(path, "w") as fh:
+            fh.write("saved")
+        # notification is dispatched before the save has finished
+        doc.file_changed(path, filestat(path))
+        eq_(doc.externally_modified, False)
+        doc.save_finished(path, filestat(path))
+        eq_(doc.externally_modified, False)
+        # notification is dispatched after the save has finished
+        doc.file_changed(path, filestat(path))
+        eq_(doc.externally_modified, False)
+        with open(path, "w") as fh:
+            fh.write("external change")
+        doc.file_changed(path, filestat(path))
+        eq_(doc.externally_modified, True)
+
+def test_setFileURL_():
+    def test(c):
+        m = Mocker()
+        doc = TextDocument.alloc().init()
+        app = m.replace(mod, 'app')
+        doc._watched_path = c.old
+        url = None if c.new is None else fn.NSURL.fileURLWithPath_(c.new)
+        if c.old != c.new:
+            if c.old is not None:
+                app.file_watcher.unwatch(c.old, doc.file_changed)
+            if c.new is not None:
+                app.file_watcher.watch(c.new, doc.file_changed)
+        with m:
+            doc.setFileURL_(url)
+        eq_(doc._watched_path, c.new)
+    c = TestConfig(old=None, new=None)
+    yield test, c
+    yield test, c(new="/file.txt")
+    yield test, c(old="/file.txt", new="/file.txt")
+    yield test, c(old="/file.txt", new="/other.txt")
+    yield test, c(old="/file.txt")
+
 def test_check_for_external_changes():
     from editxt.controls.alert import Alert
     def test(c):
-        def filestat(path):
-            return c.modstat
         def end(): # this allows us to return early (reducing nested if's)
-            with replattr(mod, 'filestat', filestat), m:
+            with m:
                 eq_(doc._filestat, c.prestat)
                 doc.check_for_external_changes(win)
                 eq_(doc._filestat,
@@ -943,7 +1124,7 @@ def test_check_for_external_changes():
         displayName = m.method(doc.displayName)
         isdirty = m.method(doc.isDocumentEdited)
         reload = m.method(doc.reload_document)
-        m.method(doc.is_externally_modified)() >> c.extmod
+        doc.externally_modified = c.extmod
         if not c.extmod:
             return end()
         if isdirty() >> c.isdirty:
@@ -952,8 +1133,7 @@ def test_check_for_external_changes():
             win = m.mock(ak.NSWindow)
             if c.prestat is not None:
                 doc._filestat = c.prestat
-            path = (m.method(doc.fileURL)() >> m.mock(fn.NSURL)).path() >> "<path>"
-            #filestat(path) >> c.modstat
+            doc.external_filestat = c.modstat
             if c.prestat == c.modstat:
                 return end()
             (nsa_class.alloc() >> alert).init() >> alert
@@ -1025,32 +1205,33 @@ def test_reload_document():
         views = list(views()) # why on earth is the intermediate var necessary?
         # I don't know, but it turns to None if we don't do it!! ???
         app.iter_views_of_document(doc) >> views
-        text = ts.string() >> "<string>"
-        range = fn.NSRange(0, doc_ts.length() >> 10)
+        diff = m.replace(mod, 'diff_text')
+        # diff offsets are characters; text storage ranges are UTF-16
+        old = "\U0001f600 old\n\U0001f600"
+        edits = [((0, 1), "<a>"), ((5, 2), "<b>")]
+        ranges = [(0, 2), (6, 3)]
+        diff(doc_ts.string() >> old, ts.string() >> "<new>") >> edits
         if not any(c.view_state):
-            # TODO reload without undo
-            doc_ts.replaceCharactersInRange_withString_(range, text)
+            doc_ts.beginEditing()
+            for range, (x, text) in reversed(list(zip(ranges, edits))):
+                doc_ts.replaceCharactersInRange_withString_(range, text)
+            doc_ts.endEditing()
             undo.removeAllActions()
             return end()
-        if tv.shouldChangeTextInRange_replacementString_(range, text) >> True:
-            # TODO get edit_state of each document view
-            # TODO diff the two text blocks and change chunks of text
-            # throughout the document (in a single undo group if possible)
-            # also adjust edit states if possible
-            # see http://www.python.org/doc/2.5.2/lib/module-difflib.html
-            doc_ts.replaceCharactersInRange_withString_(range, text)
-            tv.didChangeText()
-            tv.breakUndoCoalescing()
-            # TODO restore edit states
-            # HACK use timed invocation to allow didChangeText notification
-            # to update change count before _clearUndo is invoked
-            perform_clear_undo("_clearChanges", doc, 0)
-            tv.setSelectedRange_(fn.NSRange(0, 0)) # TODO remove
-            m.method(doc.update_syntaxer)()
+        apply = m.replace(mod, 'apply_edits')
+        apply(tv, [(0, 2, "<a>"), (6, 3, "<b>")]) \
+            >> (0 if c.should_change else None)
+        if not c.should_change:
+            return end()
+        tv.breakUndoCoalescing()
+        # HACK use timed invocation to allow didChangeText notification
+        # to update change count before _clearUndo is invoked
+        perform_clear_undo("_clearChanges", doc, 0)
+        m.method(doc.update_syntaxer)()
         end()
     from editxt.test.util import profile
     c = TestConfig(url_is_none=False, exists=True, is_reg_file=True,
-        read2_success=True, view_state=[True])
+        read2_success=True, view_state=[True], should_change=True)
     # view_state is a list of flags: text_view_exists
     yield test, c(url_is_none=True)
     yield test, c(exists=False)
@@ -1059,6 +1240,7 @@ def test_reload_document():
     yield test, c(view_state=[False])
     yield test, c(view_state=[False, True])
     yield test, c(read2_success=False)
+    yield test, c(should_change=False)
     yield test, c
 
 def test_clearChanges():
@@ -1140,11 +1322,17 @@ class TestTextDocument(MockerTestCase):
         m.method(doc.update_syntaxer)()
         doc.text_storage.mutableString().appendString_(content)
         app.item_changed(doc, 2)
-        app.save_editor_states()
+        app.schedule_save_editor_states()
         with m:
             doc.saveDocument_(None)
-            with closing(open(path)) as file:
-                saved_content = file.read()
+            # the document is written on a background thread
+            loop = fn.NSRunLoop.currentRunLoop()
+            for i in range(50):
+                with closing(open(path)) as file:
+                    saved_content = file.read()
+                if saved_content == content and not doc.isDocumentEdited():
+                    break
+                loop.runUntilDate_(fn.NSDate.dateWithTimeIntervalSinceNow_(0.1))
             assert saved_content == content, "got %r" % saved_content
 
     def test_icon_cache(self):
@@ -1274,17 +1462,69 @@ def test_get_syntaxdef():
         eq_(doc.syntaxdef, sd)
 
 def test_set_syntaxdef():
+    from editxt.structure import StructureIndex
     from editxt.syntax import SyntaxCache, SyntaxDefinition
     m = Mocker()
     sd = m.mock(SyntaxDefinition)
     doc = TextDocument.alloc().init()
     syn = doc.syntaxer = m.mock(SyntaxCache)
+    struct = doc.structure = m.mock(StructureIndex)
     with m.order():
         syn.syntaxdef = sd
+        struct.reset(sd)
         syn.color_text(doc.text_storage)
     with m:
         doc.syntaxdef = sd
 
+def test_dataOfType_error_():
+    doc = TextDocument.alloc().init()
+    doc.text_storage.mutableString().appendString_("abc")
+    m = Mocker()
+    unblock = m.method(doc.unblockUserInteraction)
+    unblock()
+    with m:
+        data = doc.dataOfType_error_(TEXT_DOCUMENT, None)
+    eq_(fn.NSString.alloc().initWithData_encoding_(
+        data, fn.NSUTF8StringEncoding), "abc")
+
+def test_normalize_on_save():
+    from editxt.command.parser import Options
+    def test(config, views, normalized):
+        m = Mocker()
+        app = m.replace(mod, 'app')
+        normalize = m.replace(mod, "normalize_text")
+        doc = TextDocument.alloc().init()
+        (app.config >> m.mock()).__getitem__(ANY).count(4) >> config
+        if config:
+            app.iter_views_of_document(doc) >> views
+            if normalized is not None:
+                normalize(normalized, Options(indent=True, newlines=True,
+                    strip=True, final_newline=True))
+        with m:
+            doc.normalize_on_save()
+    tv = object()
+    yield test, False, None, None
+    yield test, True, [], None
+    yield test, True, [TestConfig(text_view=None)], None
+    yield test, True, [TestConfig(text_view=None),
+                       TestConfig(text_view=tv)], tv
+
+def test_document_did_save():
+    def test(error):
+        m = Mocker()
+        app = m.replace(mod, 'app')
+        doc = TextDocument.alloc().init()
+        m.method(doc.update_syntaxer)()
+        save = app.schedule_save_editor_states()
+        if error:
+            expect(save).throw(error)
+            log = m.replace(mod, "log")
+            log.error("unexpected error", exc_info=True)
+        with m:
+            doc.document_did_save()
+    yield test, None
+    yield test, Exception("boom")
+
 def test_update_syntaxer():
     from editxt.syntax import SyntaxCache, SyntaxDefinition
     def test(c):
@@ -1325,15 +1565,34 @@ def test_TextDocument_comment_token():
         eq_(doc.comment_token, "#")
 
 def test_textStorageDidProcessEditing_():
+    from editxt.structure import StructureIndex
     from editxt.syntax import SyntaxCache
-    m = Mocker()
-    doc = TextDocument.alloc().init()
-    ts = doc.text_storage = m.mock(ak.NSTextStorage)
-    syn = doc.syntaxer = m.mock(SyntaxCache)
-    range = ts.editedRange() >> m.mock(fn.NSRange)
-    syn.color_text(ts, range)
-    with m:
-        doc.textStorageDidProcessEditing_(None)
+    def test(mask, text="", range=(0, 0), length=None, edited=None):
+        m = Mocker()
+        doc = TextDocument.alloc().init()
+        ts = doc.text_storage = m.mock(ak.NSTextStorage)
+        syn = doc.syntaxer = m.mock(SyntaxCache)
+        struct = doc.structure = m.mock(StructureIndex)
+        ts.editedRange() >> range
+        ts.editedMask() >> mask
+        if mask & ak.NSTextStorageEditedCharacters:
+            struct.edited_length >> length
+            if length is not None:
+                ts.string() >> text
+                ts.length() >> len(text.encode("utf-16-le")) // 2
+                struct.edited(*edited)
+        syn.color_text(ts, range)
+        with m:
+            doc.textStorageDidProcessEditing_(None)
+    EDITED = ak.NSTextStorageEditedCharacters
+    yield test, ak.NSTextStorageEditedAttributes
+    yield test, EDITED
+    yield test, EDITED, "f(a)", (1, 1), 3, ((1, 1), 1)
+    # UTF-16 ranges are converted to characters
+    emoji = "\U0001f600"
+    yield test, EDITED, emoji + "f(a)", (3, 1), 4, ((2, 1), 1)
+    yield test, EDITED, emoji + "f(a)", (0, 2), 4, ((0, 1), 1)
+    yield test, EDITED, "f(a)", (0, 0), 5, ((0, 0), -1)
 
 def test_updateChangeCount_():
     m = Mocker()
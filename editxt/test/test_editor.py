@@ -136,6 +136,7 @@ def test__setstate():
         m = Mocker()
         ed = Editor(editxt.app, m.mock(EditorWindowController))
         ed.discard_and_focus_recent = m.method(ed.discard_and_focus_recent)
+        ed.prefetch_recent_documents = m.method(ed.prefetch_recent_documents)
         create_with_serial = m.method(Project.create_with_serial)
         ed.projects = projs = m.mock(list)
         ed.recent = m.mock(RecentItemStack)
@@ -158,6 +159,7 @@ def test__setstate():
                             doc = docs[di] >> m.mock(TextDocumentView)
                             ed.recent.push(doc.id >> m.mock())
             ed.discard_and_focus_recent(None)
+            ed.prefetch_recent_documents()
             if 'window_settings' in data:
                 ws.value = data['window_settings']
         with m:
@@ -168,6 +170,50 @@ def test__setstate():
     yield test, dict(recent_items=[[0, 2], [0, 0], [0, "<project>"], [0, 1], [1, 0]])
     yield test, dict(window_settings="<window_settings>")
 
+def test_prefetch_recent_documents():
+    from PyObjCTools import AppHelper
+    def test(c):
+        ed = Editor(editxt.app, None)
+        ed.projects = []
+        views = {}
+        for proj_items in c.projs:
+            docs = []
+            for ident, loaded in proj_items:
+                view = TestConfig(id=ident, is_loaded=loaded, file_path=None)
+                loads = []
+                def load_document(view=view, loads=loads):
+                    loads.append(view.id)
+                    view.is_loaded = True
+                    if view.id in c.fail:
+                        raise Exception("cannot load")
+                view.load_document = load_document
+                view.loads = loads
+                views[ident] = view
+                docs.append(view)
+            ed.projects.append(TestConfig(documents=lambda docs=docs: docs))
+        ed.recent.reset(c.recent)
+        calls = []
+        def call_later(delay, func):
+            eq_(delay, 0.1)
+            calls.append(func)
+        with replattr(AppHelper, "callLater", call_later, sigcheck=False):
+            ed.prefetch_recent_documents(count=c.count)
+            loaded = []
+            while calls:
+                calls.pop(0)()
+                loaded.append([v for v in sorted(views)
+                               if views[v].loads and v not in sum(loaded, [])])
+        eq_(loaded, c.loaded)
+    c = TestConfig(count=5, fail=())
+    yield test, c(projs=[], recent=[], loaded=[])
+    yield test, c(projs=[[(1, True)]], recent=[1], loaded=[])
+    yield test, c(projs=[[(1, False), (2, False)], [(3, False)]],
+                  recent=[1, 3, 2], loaded=[[2], [3], [1]])
+    yield test, c(projs=[[(1, False), (2, True)], [(3, False)]],
+                  recent=[3, 1, 2, 4], count=1, loaded=[[1]])
+    yield test, c(projs=[[(1, False), (2, False)]],
+                  recent=[1, 2], fail=(2,), loaded=[[2], [1]])
+
 def test_state():
     def test(c):
         m = Mocker()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import os
+import sys
+import threading
+from os.path import join
+
+from editxt.test.util import eq_, tempdir
+
+import editxt.filewatcher as mod
+from editxt.util import filestat
+
+log = logging.getLogger(__name__)
+
+
+class FakeBackend(object):
+
+    def __init__(self):
+        self.paths = []
+
+    def add(self, path):
+        self.paths.append(path)
+
+    def remove(self, path):
+        self.paths.remove(path)
+
+    def run(self, callback):
+        pass
+
+    def stop(self):
+        pass
+
+
+def test_FileWatcher_watch():
+    calls = []
+    queued = []
+    backend = FakeBackend()
+    watcher = mod.FileWatcher(backend, queued.append)
+    def callback(path, stat):
+        calls.append((path, stat))
+    with tempdir() as tmp:
+        path = join(tmp, "file.txt")
+        with open(path, "w") as fh:
+            fh.write("text")
+        watcher.watch(path, callback)
+        watcher.watch(path, callback)
+        eq_(backend.paths, [path])
+        watcher.file_changed(path)
+        watcher.file_changed(path)
+        watcher.file_changed(join(tmp, "other.txt"))
+        eq_(queued, [watcher.dispatch])
+        eq_(calls, [])
+        watcher.dispatch()
+        eq_(calls, [(path, filestat(path))])
+        watcher.unwatch(path, callback)
+        eq_(backend.paths, [])
+        watcher.file_changed(path)
+        eq_(len(queued), 1)
+    watcher.stop()
+
+def test_FileWatcher_unwatch_before_dispatch():
+    calls = []
+    queued = []
+    watcher = mod.FileWatcher(FakeBackend(), queued.append)
+    def callback(path, stat):
+        calls.append(path)
+    watcher.watch("/file.txt", callback)
+    watcher.watch("/other.txt", callback)
+    watcher.file_changed("/file.txt")
+    watcher.unwatch("/file.txt", callback)
+    watcher.file_changed("/other.txt")
+    watcher.dispatch()
+    eq_(calls, ["/other.txt"])
+    watcher.stop()
+
+def test_FileWatcher_dispatch_error():
+    calls = []
+    watcher = mod.FileWatcher(FakeBackend(), lambda func: func())
+    def bad_callback(path, stat):
+        raise Exception("boom")
+    def callback(path, stat):
+        calls.append(path)
+    watcher.watch("/file.txt", bad_callback)
+    watcher.watch("/file.txt", callback)
+    watcher.file_changed("/file.txt")
+    eq_(calls, ["/file.txt"])
+    watcher.stop()
+
+def test_backends():
+    def test(backend):
+        changed = threading.Event()
+        calls = []
+        def dispatch(func):
+            func()
+            changed.set()
+        watcher = mod.FileWatcher(backend, dispatch)
+        def callback(path, stat):
+            calls.append(path)
+        with tempdir() as tmp:
+            path = join(tmp, "file.txt")
+            other = join(tmp, "other.txt")
+            with open(path, "w") as fh:
+                fh.write("text")
+            try:
+                watcher.watch(path, callback)
+                if isinstance(backend, mod.PollingBackend):
+                    threading.Event().wait(backend.interval * 3)
+                with open(other, "w") as fh:
+                    fh.write("other text")
+                with open(path, "w") as fh:
+                    fh.write("changed text")
+                assert changed.wait(5), "change not detected"
+                eq_(calls[0], path)
+                assert other not in calls, calls
+            finally:
+                watcher.stop()
+    yield test, mod.PollingBackend(interval=0.05)
+    if sys.platform.startswith("linux"):
+        yield test, mod.InotifyBackend()
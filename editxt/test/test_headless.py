@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import os
+import sys
+from io import StringIO
+from os.path import join
+
+from editxt.test.util import assert_raises, eq_, replattr, tempdir
+
+import editxt.constants as const
+import editxt.headless as mod
+from editxt.command.base import CommandError
+from editxt.command.script import parse_script
+from editxt.headless import Range, Text
+
+log = logging.getLogger(__name__)
+
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        fh.write(text)
+
+def read(path):
+    with open(path, encoding="utf-8", newline="") as fh:
+        return fh.read()
+
+def test_Text_lineRangeForRange_():
+    def test(text, rng, expect):
+        eq_(Text(text).lineRangeForRange_(rng), expect)
+    yield test, "", (0, 0), (0, 0)
+    yield test, "abc", (1, 0), (0, 3)
+    yield test, "abc\ndef\n", (1, 0), (0, 4)
+    yield test, "abc\ndef\n", (4, 0), (4, 4)
+    yield test, "abc\ndef\n", (8, 0), (8, 0)
+    yield test, "abc\ndef\n", (2, 3), (0, 8)
+    yield test, "abc\ndef\n", (0, 4), (0, 4)
+    yield test, "abc\r\ndef", (1, 0), (0, 5)
+    yield test, "abc\r\ndef", (6, 1), (5, 3)
+    yield test, "abc\rdef ghi", (5, 0), (4, 4)
+
+def test_Text_rangeOfString_options_range_():
+    def test(string, options, rng, expect):
+        text = Text("abc ABC abc")
+        eq_(text.rangeOfString_options_range_(string, options, rng), expect)
+    notfound = (mod.NSNotFound, 0)
+    icase = mod.NSCaseInsensitiveSearch
+    back = mod.NSBackwardsSearch
+    yield test, "abc", 0, (0, 11), (0, 3)
+    yield test, "abc", 0, (1, 10), (8, 3)
+    yield test, "abc", 0, (1, 6), notfound
+    yield test, "abc", icase, (1, 6), (4, 3)
+    yield test, "abc", back, (0, 11), (8, 3)
+    yield test, "abc", back | icase, (0, 8), (4, 3)
+    yield test, "", 0, (0, 11), notfound
+
+def test_HeadlessDocument():
+    def test(text, mode, size, newline_mode):
+        doc = mod.HeadlessDocument(text)
+        eq_((doc.indent_mode, doc.indent_size, doc.newline_mode),
+            (mode, size, newline_mode))
+        eq_(doc.eol, const.EOLS[newline_mode])
+    space = const.INDENT_MODE_SPACE
+    yield test, "", space, 4, const.NEWLINE_MODE_UNIX
+    yield test, "a\r\n  b\r\n", space, 2, const.NEWLINE_MODE_WINDOWS
+    yield test, "a\r\tb\r", const.INDENT_MODE_TAB, 4, const.NEWLINE_MODE_MAC
+
+def test_HeadlessTextView():
+    tv = mod.HeadlessTextView("abc\ndef")
+    eq_(tv.selectedRange(), (0, 7))
+    eq_(tv.selectedRange().length, 7)
+    eq_(tv.string().lineRangeForRange_((5, 0)), (4, 3))
+    tv.textStorage().replaceCharactersInRange_withString_((1, 1), "B")
+    eq_((tv.text, tv.modified), ("aBc\ndef", True))
+    tv.setSelectedRange_((1, 2))
+    eq_(tv.selectedRange(), Range(1, 2))
+    eq_(tv.doc_view.document.props.indent_size, 4)
+
+def test_HeadlessTextView_batched_edits():
+    tv = mod.HeadlessTextView("abc\ndef\nghi")
+    tv.beginEditing()
+    tv.replaceCharactersInRange_withString_((8, 0), "  ")
+    tv.replaceCharactersInRange_withString_((4, 1), "")
+    tv.replaceCharactersInRange_withString_((0, 0), "  ")
+    eq_(len(tv._pending), 3)
+    tv.endEditing()
+    eq_((tv.text, tv.modified), ("  abc\nef\n  ghi", True))
+    tv.beginEditing()
+    tv.replaceCharactersInRange_withString_((0, 2), "")
+    tv.replaceCharactersInRange_withString_((4, 1), "E")
+    eq_(tv.string(), "abc\nEf\n  ghi")
+    tv.endEditing()
+    eq_(tv.text, "abc\nEf\n  ghi")
+
+def test_HeadlessTextView_structure():
+    tv = mod.HeadlessTextView("(a)\n[b]\n")
+    structure = tv.doc_view.document.structure
+    eq_(structure.match_bracket(tv.text, 4), 6)
+    tv.replaceCharactersInRange_withString_((0, 0), "x")
+    eq_(structure.match_bracket(tv.text, 5), 7)
+    tv.beginEditing()
+    tv.replaceCharactersInRange_withString_((7, 1), "")
+    tv.replaceCharactersInRange_withString_((1, 0), "{\n")
+    tv.endEditing()
+    eq_(tv.text, "x{\n(a)\n[b\n")
+    eq_(structure.match_bracket(tv.text, 3), 5)
+    eq_(structure.match_bracket(tv.text, 1), None)
+
+def test_process_text():
+    commander = mod.load_text_commander()
+    def test(script, text, expect, comment_token="#"):
+        commands = parse_script(script, commander)
+        result = mod.process_text(text, commands, commander,
+            comment_token=comment_token)
+        eq_(result, expect)
+    yield test, "sort all", "b\nc\na\n", "a\nb\nc\n"
+    yield test, "sort all reverse", "b\nc\na\n", "c\nb\na\n"
+    yield test, "comment_text", "a\n  b\n", "#a\n#  b\n"
+    yield test, "comment_text", "#a\n#  b\n", "a\n  b\n"
+    yield test, "indent_lines", "a\n\nb", "    a\n\n    b"
+    yield test, "indent_lines\ndedent_lines", "a\n  b\n", "a\n  b\n"
+    yield test, "indent_lines", "\ta\nb\n", "\t\ta\n\tb\n"
+
+def test_FileProcessor():
+    def test(script, files, expect, dry_run=False):
+        with tempdir() as tmp:
+            for name, text in files.items():
+                write(join(tmp, name), text)
+            process = mod.FileProcessor(script, dry_run=dry_run)
+            results = [process(join(tmp, name)) for name in sorted(files)]
+            eq_([(path[len(tmp) + 1:], changed, err)
+                 for path, changed, err in results], expect[0])
+            eq_({name: read(join(tmp, name)) for name in files}, expect[1])
+    files = {"a.txt": "b\r\na\r\n", "b.txt": "a\nb\n"}
+    yield test, "sort all", files, (
+        [("a.txt", True, None), ("b.txt", False, None)],
+        {"a.txt": "a\r\nb\r\n", "b.txt": "a\nb\n"})
+    yield test, "sort all", files, (
+        [("a.txt", True, None), ("b.txt", False, None)], files), True
+    with tempdir() as tmp:
+        with open(join(tmp, "c.txt"), "wb") as fh:
+            fh.write(b"\xff\xfe\x00")
+        process = mod.FileProcessor("sort all")
+        path, changed, err = process(join(tmp, "c.txt"))
+        eq_(changed, False)
+        assert err.startswith("'utf-8' codec can't decode"), err
+    with assert_raises(CommandError, msg="line 1: unknown command: nope"):
+        mod.FileProcessor("nope")
+
+def test_FileProcessor_comment_token():
+    with tempdir() as tmp:
+        write(join(tmp, "js.syntax.py"),
+            'name = "JavaScript"\n'
+            'filepatterns = ["*.js"]\n'
+            'comment_token = "//"\n')
+        process = mod.FileProcessor("comment_text", syntax_dirs=[tmp])
+        eq_(process.comment_token("file.js"), "//")
+        eq_(process.comment_token("file.txt"), "x")
+        write(join(tmp, "file.js"), "var a;\n")
+        eq_(process(join(tmp, "file.js"))[1:], (True, None))
+        eq_(read(join(tmp, "file.js")), "//var a;\n")
+    # bundled syntax definitions are loaded by default
+    process = mod.FileProcessor("sort")
+    eq_(process.comment_token("file.py"), "#")
+    eq_(process.comment_token("file.js"), "//")
+    eq_(process.comment_token("file.txt"), "x")
+
+def test_process_files():
+    def test(jobs):
+        with tempdir() as tmp:
+            paths = []
+            for i in range(6):
+                paths.append(join(tmp, "{}.txt".format(i)))
+                write(paths[-1], "b\na\n" if i % 2 else "a\nb\n")
+            results = mod.process_files(paths, "sort all", jobs=jobs)
+            eq_(sorted(results), [(p, bool(i % 2), None)
+                                  for i, p in enumerate(paths)])
+            eq_({read(p) for p in paths}, {"a\nb\n"})
+    yield test, 1
+    yield test, 2
+
+def test_iter_tree_files():
+    with tempdir() as tmp:
+        for path in ["a.txt", ".hidden", "sub/b.txt", ".git/c.txt"]:
+            if "/" in path:
+                os.mkdir(join(tmp, os.path.dirname(path)))
+            write(join(tmp, path), "")
+        eq_([path[len(tmp) + 1:] for path in mod.iter_tree_files(tmp)],
+            ["a.txt", "sub/b.txt"])
+
+def test_analyze_indentation():
+    def test(jobs):
+        with tempdir() as tmp:
+            files = {"a.txt": "x\n  x\n", "b.txt": "x\n\tx\n", "c.txt": "x\n"}
+            for name, text in files.items():
+                write(join(tmp, name), text)
+            paths = sorted(join(tmp, name) for name in files)
+            paths.append(join(tmp, "missing.txt"))
+            result = sorted(mod.analyze_indentation(paths, jobs=jobs))
+            eq_([(path[len(tmp) + 1:], info) for path, info in result], [
+                ("a.txt", (const.INDENT_MODE_SPACE, 2, 1.0)),
+                ("b.txt", (const.INDENT_MODE_TAB, None, 1.0)),
+                ("c.txt", (None, None, 0.0)),
+                ("missing.txt", (None, None, 0.0)),
+            ])
+    yield test, 1
+    yield test, 2
+
+def test_main():
+    def test(args, files, status, out="", err="", expect=None):
+        with tempdir() as tmp:
+            for name, text in files.items():
+                write(join(tmp, name), text)
+            args = [a.format(tmp=tmp) for a in args]
+            stdout = StringIO()
+            stderr = StringIO()
+            with replattr((sys, "stdout", stdout), (sys, "stderr", stderr)):
+                eq_(mod.main(args), status)
+            eq_(stdout.getvalue(), out.format(tmp=tmp))
+            eq_(stderr.getvalue(), err.format(tmp=tmp))
+            if expect is not None:
+                eq_({name: read(join(tmp, name)) for name in files}, expect)
+    files = {"a.txt": "a\nb\n", "b.txt": "b\na\n"}
+    yield test, ["-j1", "-c", "sort all", "{tmp}/a.txt", "{tmp}/b.txt"], \
+        files, 0, "{tmp}/b.txt\n", "", {"a.txt": "a\nb\n", "b.txt": "a\nb\n"}
+    yield test, ["-j1", "-n", "-c", "sort all", "{tmp}/b.txt"], \
+        files, 0, "{tmp}/b.txt\n", "", files
+    yield test, ["-s", "{tmp}/script", "{tmp}/a.txt"], \
+        dict(files, script="# reverse\nsort all reverse\n"), 0, \
+        "{tmp}/a.txt\n", ""
+    yield test, ["-c", "sort all", "{tmp}/missing.txt"], {}, 1, "", \
+        "{tmp}/missing.txt: [Errno 2] No such file or directory: " \
+        "'{tmp}/missing.txt'\n"
+    yield test, ["-c", "nope", "{tmp}/a.txt"], files, 2, "", \
+        "error: line 1: unknown command: nope\n", files
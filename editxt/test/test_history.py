@@ -100,3 +100,243 @@ def test_History_append():
         (6, "f"), (7, "e"), (8, "d"),
         (9, "c"), (10, "b"), (11, "a")
     ]
+
+def test_History_append_after_reload():
+    def test(first, second, lookups):
+        with tempdir() as tmp:
+            history = mod.History(tmp, 3, 5)
+            for item in first:
+                history.append(item)
+            history.close()
+
+            history = mod.History(tmp, 3, 5)
+            for item in second:
+                history.append(item)
+
+            history = mod.History(tmp, 3, 5)
+            eq_(list(enumerate(history)), lookups)
+
+    yield test, "ab", "a", [(0, "a"), (1, "b")]
+    yield test, "abc", "da", [(0, "a"), (1, "d"), (2, "c"), (3, "b"), (4, "a")]
+
+def test_History__delitem__():
+    def test(appends, index, lookups):
+        with tempdir() as tmp:
+            history = mod.History(tmp, 3, 5)
+            for item in appends:
+                history.append(item)
+            if lookups is IndexError:
+                try:
+                    del history[index]
+                except IndexError:
+                    pass
+                else:
+                    raise AssertionError("IndexError not raised")
+                return
+            del history[index]
+            eq_(list(enumerate(history)), lookups)
+            eq_(list(history.iter_by_name([item for x, item in lookups])),
+                [item for x, item in lookups])
+
+            history = mod.History(tmp, 3, 5)
+            eq_(list(enumerate(history)), lookups)
+
+    yield test, "", 0, IndexError
+    yield test, "a", 1, IndexError
+    yield test, "a", -1, IndexError
+    yield test, "a", 0, []
+    yield test, "abc", 1, [(0, "c"), (1, "a")]
+    yield test, "abcdefa", 4, [
+        (0, "a"), (1, "f"), (2, "e"), (3, "d"), (4, "b"), (5, "a")]
+    yield test, "abcdab", 4, [(0, "b"), (1, "a"), (2, "d"), (3, "c"), (4, "a")]
+
+def test_History_corrupt_log():
+    def test(corrupt, lookups):
+        with tempdir() as tmp:
+            history = mod.History(tmp, 3, 5)
+            for item in "abc":
+                history.append(item)
+            history.close()
+            with open(history.log_path, encoding="utf-8") as fh:
+                lines = fh.readlines()
+            with open(history.log_path, "w", encoding="utf-8") as fh:
+                fh.write(corrupt(lines))
+
+            history = mod.History(tmp, 3, 5)
+            eq_(list(enumerate(history)), lookups)
+            history.append("d")
+
+            history = mod.History(tmp, 3, 5)
+            eq_(list(enumerate(history)), [(0, "d")] + [
+                (i + 1, item) for i, item in lookups])
+
+    yield test, "".join, [(0, "c"), (1, "b"), (2, "a")]
+    # torn write
+    yield test, (lambda lines: "".join(lines)[:-5]), [(0, "b"), (1, "a")]
+    # bad checksum
+    yield test, (lambda lines: "".join(lines).replace('"b"', '"x"')), \
+        [(0, "c"), (1, "a")]
+
+def test_History_compact():
+    def test(appends, lookups):
+        with tempdir() as tmp:
+            history = mod.History(tmp, 3, 2)
+            for item in appends:
+                history.append(item)
+            history.compact()
+            eq_(history.log_records, 2)
+            eq_(list(enumerate(history)), lookups)
+
+            history = mod.History(tmp, 3, 2)
+            eq_(list(enumerate(history)), lookups)
+            history.append("z")
+            eq_(history[0], "z")
+
+    yield test, "", []
+    yield test, "abcdefgha", [
+        (0, "a"), (1, "h"), (2, "g"), (3, "f"), (4, "e"), (5, "d")]
+
+def test_History_background_compact():
+    with tempdir() as tmp:
+        history = mod.History(tmp, 3, 2)
+        items = ["item {}".format(i) for i in range(30)]
+        for item in items:
+            history.append(item)
+        history.close()
+        assert history.log_records <= 3 * 2 * history.COMPACT_FACTOR, \
+            history.log_records
+        expect = list(reversed(items[-6:]))
+        eq_(list(history), expect)
+        eq_(list(mod.History(tmp, 3, 2)), expect)
+
+def test_History_iter_by_name():
+    def test(names, expect, appends="a1 b2 a3 c4 b5 a1 d6 a7 b8 a9 c10 a11"):
+        with tempdir() as tmp:
+            history = mod.History(tmp, 3, 3)
+            for item in appends.split():
+                history.append(item[0] + " " + item[1:])
+            eq_(list(history.iter_by_name(names)), expect)
+
+            history = mod.History(tmp, 3, 3)
+            eq_(list(history.iter_by_name(names)), expect)
+
+    yield test, [], []
+    yield test, ["x"], []
+    yield test, ["a"], ["a 11", "a 9", "a 7", "a 1"]
+    yield test, ["b"], ["b 8", "b 5"]
+    yield test, ["b", "a"], ["a 11", "a 9", "b 8", "a 7", "a 1", "b 5"]
+    yield test, ["a"], ["a 1", "a 3"], "a1 b2 a3 a1"
+    yield test, ["a", "b"], ["a 1", "b 2", "a 3"], "a1 b2 a3 b2 a1"
+
+def test_History_index():
+    # index must be consistent with history after moves and page rollover
+    import random
+    rand = random.Random(42)
+    with tempdir() as tmp:
+        history = mod.History(tmp, 4, 3)
+        for i in range(200):
+            item = "{} {}".format(rand.choice("abc"), rand.randrange(8))
+            history.append(item)
+            for name in "abc":
+                expect = [x for x in history if x.startswith(name + " ")]
+                eq_(list(history.iter_by_name([name])), expect, item)
+            eq_(list(history.iter_by_name("abc")), list(history))
+
+def test_History_index_delete():
+    # index must be consistent with history after deleting duplicate items
+    import random
+    rand = random.Random(42)
+    with tempdir() as tmp:
+        history = mod.History(tmp, 4, 3)
+        for i in range(300):
+            items = list(history)
+            if items and rand.random() < 0.3:
+                del history[rand.randrange(len(items))]
+            else:
+                item = "{} {}".format(rand.choice("ab"), rand.randrange(3))
+                history.append(item)
+            for name in "ab":
+                expect = [x for x in history if x.startswith(name + " ")]
+                eq_(list(history.iter_by_name([name])), expect, i)
+        eq_(list(mod.History(tmp, 4, 3)), list(history))
+
+def test_History_iter_with_prefix():
+    def test(prefix, expect):
+        with tempdir() as tmp:
+            history = mod.History(tmp, 3, 5)
+            for item in ["abc", "ab x", "a y", "ab z", "abc x"]:
+                history.append(item)
+            eq_(list(history.iter_with_prefix(prefix)), expect)
+
+    yield test, "", ["abc x", "ab z", "a y", "ab x", "abc"]
+    yield test, "ab", ["abc x", "ab z", "ab x", "abc"]
+    yield test, "ab ", ["ab z", "ab x"]
+    yield test, "ab x", ["ab x"]
+    yield test, "x", []
+
+def test_History_search():
+    items = [
+        "find /abc/",
+        "sort selection",
+        "find /xyz/ Abc",
+        "grab /abc/",
+        "sort reverse",
+        "find /abc/",
+        "wrap 80",
+    ]
+    def test(query, expect, limit=10):
+        with tempdir() as tmp:
+            history = mod.History(tmp, 3, 5)
+            for item in items:
+                history.append(item)
+            eq_(history.search(query, limit), expect)
+
+    yield test, "", ["wrap 80", "find /abc/", "sort reverse"], 3
+    yield test, "wrap", ["wrap 80"]
+    yield test, "st", ["sort reverse", "sort selection"]
+    yield test, "abc", ["find /abc/", "grab /abc/", "find /xyz/ Abc"]
+    yield test, "Abc", ["find /xyz/ Abc"]
+    yield test, "fa", ["find /abc/", "find /xyz/ Abc"]
+    yield test, "fa", ["find /abc/"], 1
+    yield test, "sr", ["sort reverse", "sort selection"]
+    yield test, "qqq", []
+
+def test_History_search_after_append():
+    with tempdir() as tmp:
+        history = mod.History(tmp, 3, 5)
+        for item in ["abc", "axbxc", "bc"]:
+            history.append(item)
+        eq_(history.search("abc"), ["abc", "axbxc"])
+        history.append("abcd")
+        eq_(history.search("abc"), ["abcd", "abc", "axbxc"])
+        del history[0]
+        eq_(history.search("abc"), ["abc", "axbxc"])
+
+def test_History_search_narrowing():
+    import random
+    rand = random.Random(42)
+    words = ["find", "sort", "wrap", "grab", "/abc/", "/x y/", "80", "Abc"]
+    with tempdir() as tmp:
+        history = mod.History(tmp, 20, 50)
+        for i in range(200):
+            history.append(" ".join(rand.choice(words) for x in range(3)))
+        for i in range(50):
+            query = ""
+            for c in rand.sample("fisabcw/ 8", 4):
+                query += c
+                fresh = mod.SearchIndex(history, history.version)
+                eq_(history.search(query), fresh.search(query, 10), query)
+
+def test_HistoryView_item_removed():
+    def test(index, removed, expect_index, expect_edits):
+        view = mod.HistoryView(mod.History(None))
+        view.history_index = index
+        view.history_edits = {-1: "new", 0: "zero", 2: "two", 3: "three"}
+        view.item_removed(removed)
+        eq_(view.history_index, expect_index)
+        eq_(view.history_edits, expect_edits)
+
+    yield test, 1, 2, 1, {-1: "new", 0: "zero", 2: "three"}
+    yield test, 2, 2, 1, {-1: "new", 0: "zero", 2: "three"}
+    yield test, 3, 0, 2, {-1: "new", 1: "two", 2: "three"}
+    yield test, -1, 0, -1, {-1: "new", 1: "two", 2: "three"}
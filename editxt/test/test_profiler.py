@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+from os.path import join
+
+from editxt.test.util import assert_raises, eq_, tempdir
+
+import editxt.profiler as mod
+
+log = logging.getLogger(__name__)
+
+
+class FakeTextView(object):
+
+    def __init__(self, text):
+        self.text = text
+
+    def string(self):
+        return self.text
+
+
+def test_edit_size():
+    def test(before, after, expect):
+        eq_(mod.edit_size(before, after), expect)
+        eq_(mod.edit_size(after, before), expect)
+    yield test, "", "", 0
+    yield test, "abc", "abc", 0
+    yield test, "", "abc", 3
+    yield test, "abc", "abxc", 1
+    yield test, "abc", "xbc", 1
+    yield test, "abc", "abx", 1
+    yield test, "abc\ndef\n", "def\nabc\n", 7
+    yield test, "aaaa", "aaaaaa", 2
+    yield test, "a" * 1000 + "b" + "a" * 1000, "a" * 2001, 1
+
+def test_percentile():
+    def test(values, p, expect):
+        eq_(mod.percentile(values, p), expect)
+    values = list(range(1, 11))
+    yield test, [5], 50, 5
+    yield test, values, 50, 5
+    yield test, values, 90, 9
+    yield test, values, 99, 10
+    yield test, values, 0, 1
+
+def test_CommandProfiler_measure():
+    profiler = mod.CommandProfiler(max_records=2)
+    textview = FakeTextView("abc")
+    with profiler.measure("cmd", mod.MENU, textview):
+        textview.text = "abcd"
+    eq_(list(profiler.records), [])
+
+    profiler.enabled = True
+    for i in range(3):
+        with profiler.measure("cmd{}".format(i), mod.MENU, textview):
+            textview.text += "x" * i
+    with assert_raises(ValueError):
+        with profiler.measure("err", mod.INPUT, textview):
+            raise ValueError("failed")
+    eq_([(r.name, r.source, r.text_length, r.edit_size)
+         for r in profiler.records],
+        [("cmd2", mod.MENU, 5, 2), ("err", mod.INPUT, 7, 0)])
+    assert all(r.seconds >= 0 for r in profiler.records), profiler.records
+
+    with profiler.measure("none", mod.INPUT, None):
+        pass
+    eq_(profiler.records[-1][:2], ("none", mod.INPUT))
+    eq_(profiler.records[-1][3:5], (0, 0))
+
+def make_profiler(*items):
+    profiler = mod.CommandProfiler()
+    for name, seconds in items:
+        profiler.records.append(
+            mod.Record(name, mod.COMMAND_BAR, seconds, 10, 1, 0))
+    return profiler
+
+def test_CommandProfiler_summarize():
+    profiler = make_profiler(
+        ("sort", 0.002), ("find", 0.001), ("sort", 0.004), ("find", 0.001))
+    eq_(profiler.summarize(), [
+        ("sort", 2, 0.006, [0.002, 0.004, 0.004], 0.004),
+        ("find", 2, 0.002, [0.001, 0.001, 0.001], 0.001),
+    ])
+
+def test_CommandProfiler_report():
+    eq_(make_profiler().report(), "no commands recorded")
+    profiler = make_profiler(("sort", 0.002), ("find", 0.0105), ("sort", 0.004))
+    eq_(profiler.report(),
+        "command  count     p50     p90     p99     max\n"
+        "find         1  10.5ms  10.5ms  10.5ms  10.5ms\n"
+        "sort         2   2.0ms   4.0ms   4.0ms   4.0ms")
+
+def test_CommandProfiler_clear():
+    profiler = make_profiler(("sort", 0.002))
+    profiler.clear()
+    eq_(list(profiler.records), [])
+
+def test_CommandProfiler_dump():
+    profiler = make_profiler(("sort", 0.002), ("find", 0.001))
+    with tempdir() as tmp:
+        path = join(tmp, "stats.json")
+        eq_(profiler.dump(path), 2)
+        with open(path) as fh:
+            data = json.load(fh)
+    eq_(data, [
+        {"name": "sort", "source": mod.COMMAND_BAR, "seconds": 0.002,
+         "text_length": 10, "edit_size": 1, "time": 0},
+        {"name": "find", "source": mod.COMMAND_BAR, "seconds": 0.001,
+         "text_length": 10, "edit_size": 1, "time": 0},
+    ])
@@ -225,7 +225,7 @@ def test_save():
             proj.serial_cache = "<invalid-cache>"
             if proj_has_path:
                 save_with_path(proj.path)
-            app.save_editor_states()
+            app.schedule_save_editor_states()
             reset_cache()
         else:
             proj.serial_cache = "<serial>"
@@ -404,8 +404,7 @@ def test_find_view_with_document():
             docs.append(view)
             view.name >> item
             if not found:
-                adoc = m.mock(TextDocument)
-                view.document >> (doc if item is DOC else adoc)
+                view.is_view_of_document(doc) >> (item is DOC)
                 if item is DOC:
                     theview = view
                     found = True
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+from editxt.test.util import eq_, replattr
+
+import editxt.structure as mod
+from editxt.structure import Lexer, StructureIndex, COMMENT, STRING
+from editxt.syntax import PLAIN_TEXT, RE, SyntaxDefinition
+
+log = logging.getLogger(__name__)
+
+PYTHON = SyntaxDefinition("", "Python", ["*.py"], delimited_ranges=[
+    (RE('[rub]?"""'), ['"""'], "008080", None),
+    (RE('[rub]?"'), ['"', RE(r"[^\\]\n")], "008080", None),
+    ("#", [RE(r"(?=\n)")], "008000", None),
+], comment_token="#")
+
+CODE = (
+    'def f(a, b):\n'
+    '    x = [1, (2)]  # ) comment\n'
+    '    s = """(\n'
+    '  ]\n'
+    '"""\n'
+    '    return {a: b}\n'
+    '\n'
+    'y = f(1,\n'
+    '  2)\n'
+)
+
+def lines(index):
+    return [line for i, offset, line in index._iter_lines(0, 0)]
+
+def test_Lexer_lex():
+    def test(line, expect, state=None, syntaxdef=PYTHON):
+        result = Lexer(syntaxdef).lex(line, state)
+        eq_(result[1:], expect)
+    yield test, "", (None, "", (), None, 0, 0)
+    yield test, "\n", (None, "", (), None, 0, 0)
+    yield test, "  a(b)\n", (2, "()", (), None, 0, 0)
+    yield test, "\tx]\n", (8, "]", (), None, -1, -1)
+    yield test, 'x = ")" # (\n', (0, "", ((4, 7, 1), (8, 11, 2)), None, 0, 0)
+    yield test, "x = ')'\n", (0, ")", (), None, -1, -1)
+    yield test, 'f("(", ")")\n', (0, "()", ((2, 5, 1), (7, 10, 1)), None, 0, 0)
+    yield test, 's = """[\n', (0, "", ((4, 9, 0),), 0, 0, 0)
+    yield test, '  ]\n', (None, "", ((0, 4, 0),), 0, 0, 0), 0
+    yield test, '""" [\n', (None, "[", ((0, 3, 0),), None, 1, 0), 0
+    yield test, "(# x\n", (0, "(", (), None, 1, 0), None, PLAIN_TEXT
+
+def test_StructureIndex_match_bracket():
+    def test(text, pairs, syntaxdef=PYTHON, chunk_size=mod.CHUNK_SIZE):
+        with replattr(mod, "CHUNK_SIZE", chunk_size):
+            index = StructureIndex(syntaxdef)
+            result = {}
+            for i in range(len(text)):
+                if index.bracket_at(text, i) is not None:
+                    result[i] = index.match_bracket(text, i)
+        eq_(result, pairs)
+    pairs = {5: 10, 10: 5, 21: 28, 28: 21, 25: 27, 27: 25,
+             75: 80, 80: 75, 88: 95, 95: 88}
+    yield test, CODE, pairs
+    yield test, CODE, pairs, PYTHON, 1
+    yield test, CODE, pairs, PYTHON, 2
+    yield test, "(]", {0: None, 1: None}
+    yield test, "(\n(\n)", {0: None, 2: 4, 4: 2}, PYTHON, 1
+    yield test, "a)\n(\n[\n]\n)\n(", {1: None, 3: 9, 5: 7, 7: 5, 9: 3,
+                                     11: None}, PYTHON, 2
+    yield test, '"(" )', {1: 4, 4: 1}, PLAIN_TEXT
+    yield test, '"(" )', {4: None}, PYTHON, 1
+
+def test_StructureIndex_edited():
+    def test(edits, chunk_size=2):
+        text = CODE
+        with replattr(mod, "CHUNK_SIZE", chunk_size):
+            index = StructureIndex(PYTHON)
+            index.update(text)
+            for start, length, string in edits:
+                text = text[:start] + string + text[start + length:]
+                index.edited((start, len(string)), len(string) - length)
+            index.update(text)
+            fresh = StructureIndex(PYTHON)
+            fresh.update(text)
+            eq_(lines(index), lines(fresh))
+            for offset in range(len(text)):
+                eq_(index.match_bracket(text, offset),
+                    fresh.match_bracket(text, offset), offset)
+    yield test, [(0, 0, "(")]
+    yield test, [(0, 0, "(")], 1
+    yield test, [(0, 0, '"""\n')]
+    yield test, [(45, 0, "#"), (len(CODE) - 1, 1, "")]
+    yield test, [(51, 3, ""), (10, 0, "\n\n")]
+    yield test, [(13, 30, ""), (0, 13, "")]
+    yield test, [(0, len(CODE), ""), (0, 0, "x(\n")]
+    yield test, [(0, len(CODE), "a\nb\nc\nd\ne\n")], 1
+
+def test_StructureIndex_edited_length():
+    index = StructureIndex(PYTHON)
+    eq_(index.edited_length, None)
+    index.update("f(a)\n")
+    eq_(index.edited_length, 5)
+    index.edited((1, 3), 2)
+    index.edited((0, 0), -1)
+    eq_(index.edited_length, 6)
+
+def test_StructureIndex_edited_astral():
+    # edits are recorded with character offsets, so inserting a
+    # character outside the BMP does not rebuild the index
+    text = 'x = "\U0001f600"\nf(a)\n'
+    index = StructureIndex(PYTHON)
+    index.update(text)
+    builds = []
+    build = index._build
+    index._build = lambda text: (builds.append(text), build(text))
+    for start, string in [(5, "\U0001f601"), (0, "(\U0001f602")]:
+        text = text[:start] + string + text[start:]
+        index.edited((start, len(string)), len(text) - index.edited_length)
+        index.update(text)
+    eq_(builds, [])
+    eq_(index.match_bracket(text, 12), 14)
+    eq_(index.match_bracket(text, 0), None)
+
+def test_StructureIndex_edited_before_update():
+    index = StructureIndex(PYTHON)
+    index.edited((0, 1), 1)
+    eq_(index.match_bracket("(x)", 0), 2)
+
+def test_StructureIndex_update_out_of_sync():
+    index = StructureIndex(PYTHON)
+    eq_(index.match_bracket("(x)", 0), 2)
+    eq_(index.match_bracket("((x)", 0), None)
+
+def test_StructureIndex_reset():
+    index = StructureIndex(PLAIN_TEXT)
+    text = '"(" )'
+    eq_(index.match_bracket(text, 1), 4)
+    index.reset(PYTHON)
+    eq_(index.match_bracket(text, 4), None)
+    eq_(index.span_at(text, 1), (0, 3, STRING))
+
+def test_StructureIndex_span_at():
+    def test(offset, expect):
+        index = StructureIndex(PYTHON)
+        eq_(index.span_at(CODE, offset), expect)
+    yield test, 0, None
+    yield test, CODE.index("comment"), (31, 42, COMMENT)
+    yield test, CODE.index("# )"), (31, 42, COMMENT)
+    yield test, CODE.index("  ]"), (51, 63, STRING)
+    yield test, CODE.index('"""\n '), (51, 63, STRING)
+    yield test, len(CODE), None
+
+def test_StructureIndex_enclosing_brackets():
+    def test(range, expect):
+        index = StructureIndex(PYTHON)
+        eq_(index.enclosing_brackets(CODE, range), expect)
+    yield test, (0, 0), None
+    yield test, (6, 0), (5, 10)
+    yield test, (26, 1), (25, 27)
+    yield test, (25, 3), (21, 28)
+    yield test, (22, 10), None
+    yield test, (91, 2), (88, 95)
+
+def test_StructureIndex_enclosing_block():
+    def test(offset, expect, text=CODE):
+        index = StructureIndex(PYTHON)
+        result = index.enclosing_block(text, offset)
+        eq_(result, expect)
+    yield test, 0, None
+    yield test, 20, (13, 68)
+    yield test, CODE.index("  ]"), (13, 68)
+    yield test, CODE.index("return"), (13, 68)
+    yield test, CODE.index("y ="), None
+    yield test, CODE.index("  2)"), (92, 4)
+    yield test, 9, (8, 5), "a:\n  b:\n    c\n  d\n"
+    yield test, 15, (3, 14), "a:\n  b:\n    c\n  d\n"
+
+def test_StructureIndex_folding_ranges():
+    def test(text, expect, syntaxdef=PYTHON):
+        index = StructureIndex(syntaxdef)
+        eq_(index.folding_ranges(text), expect)
+    yield test, "", []
+    yield test, "a(b)\nc\n", []
+    yield test, CODE, [(12, 69), (89, 6), (91, 5)]
+    yield test, "a:\n  b:\n    c\n  d\n", [(2, 15), (7, 6)]
+    yield test, "a = [\n  1,\n]\n", [(5, 5), (5, 6)]
+
+def test_StructureIndex_expand_selection():
+    def test(range, expect, text=CODE):
+        index = StructureIndex(PYTHON)
+        result = []
+        while range is not None:
+            range = index.expand_selection(text, range)
+            if range is not None:
+                result.append(text[range[0]:sum(range)])
+        eq_(result, expect)
+    yield test, (26, 0), ["2", "(2)", "1, (2)", "[1, (2)]",
+        CODE[13:81], CODE[:81]]
+    yield test, (CODE.index("comment"), 0), ["# ) comment",
+        CODE[13:81], CODE[:81]]
+    yield test, (CODE.index("return"), 0), [CODE[13:81], CODE[:81]]
+    yield test, (0, len(CODE)), []
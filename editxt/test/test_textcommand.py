@@ -122,6 +122,24 @@ def test_CommandBar_execute():
                   msg='unknown command: 123 456')
     yield test, c(text='123 456', lookup='full', error=True)
 
+def test_CommandBar_execute_profiled():
+    from editxt.profiler import COMMAND_BAR
+    class textview:
+        text = "abc"
+        def string():
+            return textview.text
+    @command(arg_parser=CommandParser(Int("num")))
+    def cmd(textview, sender, args):
+        textview.text += "x" * args.num
+    bar = CommandTester(cmd, textview=textview)
+    profiler = bar.refs[1].profiler
+    bar("cmd 1")
+    eq_(list(profiler.records), [])
+    profiler.enabled = True
+    bar("cmd 2")
+    eq_([r[:2] + r[3:5] for r in profiler.records],
+        [("cmd", COMMAND_BAR, 4, 2)])
+
 def test_CommandBar_get_placeholder():
     from editxt.command.parser import CommandParser, Choice, Regex, VarArgs
     def test(c):
@@ -225,6 +243,70 @@ def test_CommandBar_get_completions():
     yield test, c(text='/a', expect=([], -1))
     yield test, c(text='/abc/ ', expect=(["yes", "no"], 0))
 
+def test_CommandBar_get_placeholder_incremental():
+    from editxt.command.parser import Choice, Regex, VarArgs
+    @command(arg_parser=CommandParser(
+        Choice(('selection', True), ('all', False)),
+        Regex('sort_regex', True),
+    ))
+    def cmd(textview, sender, args):
+        raise NotImplementedError("should not get here")
+    @command(arg_parser=CommandParser(
+        Int("num"),
+        VarArgs("args", placeholder="..."),
+    ), lookup_with_arg_parser=True)
+    def num(textview, sender, args):
+        raise NotImplementedError("should not get here")
+    @command(arg_parser=CommandParser(
+        Regex('search_pattern'),
+        Choice(('yes', True), ('no', False)),
+        VarArgs("args", placeholder="..."),
+    ), lookup_with_arg_parser=True)
+    def search(textview, sender, args):
+        raise NotImplementedError("should not get here")
+    parsers = [cmd.arg_parser, num.arg_parser, search.arg_parser]
+    def test(text):
+        bar = CommandTester(cmd, num, search)
+        states = [None] * len(parsers)
+        for i in range(len(text) + 1):
+            for parser in parsers:
+                parser.placeholder_state = None
+            fresh = CommandTester(cmd, num, search)
+            expect = (fresh.get_placeholder(text[:i]),
+                      fresh.get_completions(text[:i]))
+            for parser, state in zip(parsers, states):
+                parser.placeholder_state = state
+            eq_((bar.get_placeholder(text[:i]), bar.get_completions(text[:i])),
+                expect, repr(text[:i]))
+            states = [parser.placeholder_state for parser in parsers]
+    yield test, "cmd sel /x y/z/"
+    yield test, "/x y/ y a b"
+    yield test, "12 /x/ y"
+    yield test, "c /x/ y"
+
+def test_TextCommandController_match_full_command():
+    from editxt.command.parser import Regex
+    @command(arg_parser=CommandParser(Int("num")), lookup_with_arg_parser=True)
+    def num(*args):
+        pass
+    @command(arg_parser=CommandParser(Regex('search_pattern')),
+             lookup_with_arg_parser=True)
+    def search(*args):
+        pass
+    bar = CommandTester(search, num)
+    ctl = bar.refs[1]
+    eq_(ctl.match_full_command("/x/"), search)
+    eq_(ctl.match_full_command("/x/ "), search)
+    eq_(ctl.match_full_command("/x/ 1"), search)
+    eq_(ctl.full_command_matches["/x/ 1"], (search, True, 1))
+    eq_(ctl.match_full_command("1"), num)
+    eq_(ctl.match_full_command("1 "), num)
+    eq_(ctl.match_full_command("1 /x/"), num)
+    eq_(ctl.match_full_command("x"), None)
+    eq_(ctl.full_command_matches["x"], (None, False, 2))
+    ctl.full_command_matches["/x/ "] = (num, True, 0)
+    eq_(ctl.match_full_command("/x/ 2"), num) # cached prefix match
+
 def test_CommandBar_get_history():
     def test(nav):
         with tempdir() as tmp:
@@ -292,6 +374,20 @@ def test_CommandBar_get_history():
         v("ax", "-"),
     ]
 
+def test_CommandBar_search_history():
+    with tempdir() as tmp:
+        history = mod.CommandHistory(tmp)
+        for item in ["sort", "find /abc/", "wrap 80", "find /a/ b c"]:
+            history.append(item)
+        editor = type("FakeEditor", (object,), {})()
+        commander = TextCommandController(history)
+        bar = mod.CommandBar(editor, commander)
+        eq_(bar.search_history("abc"), "find /abc/")
+        eq_(bar.search_history("abc", 1), "find /a/ b c")
+        eq_(bar.search_history("abc", 2), None)
+        eq_(bar.search_history("w8"), "wrap 80")
+        eq_(bar.search_history("xyz"), None)
+
 def test_CommandBar_get_history_concurrently():
     with tempdir() as tmp:
         history = mod.CommandHistory(tmp)
@@ -470,6 +566,64 @@ def test_TextCommandController_lookup_full_command():
     yield test, c(commands=[num])
     yield test, c(commands=[num], lookup='123', result=(num, Options(value=123)))
 
+def test_TextCommandController_parse():
+    from editxt.command.base import CommandError
+    from editxt.test.util import assert_raises
+    @command(arg_parser=CommandParser(Int("value")))
+    def cmd(*args):
+        pass
+    @command(arg_parser=CommandParser(Int("num")), lookup_with_arg_parser=True)
+    def num(*args):
+        pass
+    bar = CommandTester(cmd, num)
+    ctl = bar.refs[1]
+    def test(text, expect):
+        if isinstance(expect, Exception):
+            with assert_raises(type(expect), msg=str(expect)):
+                ctl.parse(text)
+        else:
+            eq_(ctl.parse(text), expect)
+    yield test, "cmd 42", (cmd, Options(value=42))
+    yield test, " cmd", (cmd, Options(value=None))
+    yield test, "123", (num, Options(num=123))
+    yield test, "cmd x", CommandError(
+        "invalid arguments: x\ninvalid literal for int() with base 10: 'x'")
+    yield test, "nope", CommandError("unknown command: nope")
+
+def test_TextCommandController_get_full_command_candidates():
+    from editxt.command.parser import Regex, String
+    @command(arg_parser=CommandParser(Int("num")), lookup_with_arg_parser=True)
+    def num(*args):
+        pass
+    @command(arg_parser=CommandParser(Regex('search_pattern')),
+             lookup_with_arg_parser=True)
+    def search(*args):
+        pass
+    @command(arg_parser=CommandParser(String('str')),
+             lookup_with_arg_parser=True)
+    def text(*args):
+        pass
+    bar = CommandTester(text, search, num)
+    ctl = bar.refs[1]
+    def test(char, expect):
+        eq_(ctl.get_full_command_candidates(char), expect)
+    yield test, "", [(0, num), (1, search), (2, text)]
+    yield test, "1", [(0, num), (2, text)]
+    yield test, "/", [(1, search), (2, text)]
+    yield test, "x", [(2, text)]
+
+def test_AliasTrie():
+    trie = mod.AliasTrie()
+    for name in ["sort", "s", "find", "so", "sorted", "goto"]:
+        trie[name] = name.upper()
+    eq_(trie.get("sort"), "SORT")
+    eq_(trie.get("sor"), None)
+    eq_(trie.get("sortx", "default"), "default")
+    eq_(list(trie.iter_names()), ["find", "goto", "s", "so", "sort", "sorted"])
+    eq_(list(trie.iter_names("so")), ["so", "sort", "sorted"])
+    eq_(list(trie.iter_names("sort")), ["sort", "sorted"])
+    eq_(list(trie.iter_names("x")), [])
+
 def test_TextCommandController_load_commands():
     def test(c):
         m = Mocker()
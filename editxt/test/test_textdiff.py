@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+from editxt.test.util import eq_
+
+import editxt.textdiff as mod
+
+
+def test_diff_lines():
+    def test(a, b, hunks, max_edits=mod.MAX_EDITS):
+        eq_(mod.diff_lines(list(a), list(b), max_edits), hunks)
+    yield test, "", "", []
+    yield test, "abc", "abc", []
+    yield test, "", "abc", [(0, 0, 0, 3)]
+    yield test, "abc", "", [(0, 3, 0, 0)]
+    yield test, "abc", "abcd", [(3, 3, 3, 4)]
+    yield test, "abc", "xabc", [(0, 0, 0, 1)]
+    yield test, "abc", "aXc", [(1, 2, 1, 2)]
+    yield test, "abcdef", "abXdeYf", [(2, 3, 2, 3), (5, 5, 5, 6)]
+    yield test, "abcabba", "cbabac", [(0, 2, 0, 0), (3, 3, 1, 2),
+                                      (5, 6, 4, 4), (7, 7, 5, 6)]
+    yield test, "axbxc", "aybyc", [(1, 2, 1, 2), (3, 4, 3, 4)]
+    yield test, "xaby", "xbay", [(1, 3, 1, 3)], 1
+
+def test_diff_text():
+    def test(old, new, edits=None):
+        result = mod.diff_text(old, new)
+        if edits is not None:
+            eq_(result, edits)
+        text = old
+        for (start, length), value in reversed(result):
+            text = text[:start] + value + text[start + length:]
+        eq_(text, new)
+    yield test, "", "", []
+    yield test, "", "abc\n", [((0, 0), "abc\n")]
+    yield test, "abc\n", "", [((0, 4), "")]
+    yield test, "a\nb\nc\n", "a\nB\nc\nd\n", [((2, 1), "B"), ((6, 0), "d\n")]
+    yield test, "a\nb\nc", "a\nb\nc\n", [((5, 0), "\n")]
+    yield test, "a\r\nb\r\n", "a\nb\r\n", [((1, 1), "")]
+    yield test, "a\rb c\n", "b c\nd\n", [((0, 2), ""), ((6, 0), "d\n")]
+    yield test, "x\n" * 10, "x\n" * 5 + "y\n" + "x\n" * 5
+    yield test, "".join("%s\n" % i for i in range(100)), \
+                "".join("%s\n" % i for i in range(0, 100, 3))
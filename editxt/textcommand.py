@@ -28,13 +28,17 @@ import Foundation as fn
 
 import editxt.constants as const
 from editxt.command.base import CommandError
-from editxt.command.parser import ArgumentError
+from editxt.command.parser import ArgumentError, char_class
 from editxt.commands import load_commands
 from editxt.history import History
+from editxt.profiler import CommandProfiler, COMMAND_BAR, INPUT, MENU
 from editxt.util import WeakProperty
 
 log = logging.getLogger(__name__)
 
+# Maximum number of full command lookup results to cache
+MAX_CACHED_MATCHES = 1000
+
 
 class CommandBar(object):
 
@@ -45,6 +49,7 @@ class CommandBar(object):
         self.editor = editor
         self.text_commander = text_commander
         self.history_view = None
+        self.found_command = None
 
     def activate(self):
         # abstract to a PyObjC-specific subclass when implementing other frontend
@@ -80,8 +85,11 @@ class CommandBar(object):
         if args is None:
             self.message('invalid command arguments: {}'.format(argstr))
             return
+        textview = doc_view.text_view
+        profiler = self.text_commander.profiler
         try:
-            message = command(doc_view.text_view, self, args)
+            with profiler.measure(command.name, COMMAND_BAR, textview):
+                message = command(textview, self, args)
         except CommandError as err:
             self.message(err)
         except Exception:
@@ -97,14 +105,23 @@ class CommandBar(object):
 
         :returns: A tuple ``(command, argument_string)``. ``command`` will be
         ``None`` if no matching command is found.
+
+        The command found for the previous text is reused if it was
+        looked up by name and ``text`` extends the previous text beyond
+        the space following the command name.
         """
         if not text:
             return None, text
+        found = self.found_command
+        if found is not None and text.startswith(found[0]):
+            return found[1], text[len(found[0]):]
         cmdstr, space, argstr = text.partition(" ")
         command = self.text_commander.lookup(cmdstr)
         if command is None:
             argstr = text
             command, a = self.text_commander.lookup_full_command(argstr, False)
+        elif space:
+            self.found_command = (cmdstr + space, command)
         return command, argstr
 
     def get_placeholder(self, text):
@@ -128,9 +145,7 @@ class CommandBar(object):
         selection).
         """
         if " " not in text:
-            words = sorted(name
-                for name in self.text_commander.commands
-                if isinstance(name, str) and name.startswith(text))
+            words = list(self.text_commander.aliases.iter_names(text))
             index = 0 if words else -1
         else:
             command, argstr = self._find_command(text)
@@ -150,6 +165,18 @@ class CommandBar(object):
             self.history_view = self.text_commander.history.view()
         return self.history_view.get(current_text, forward)
 
+    def search_history(self, query, skip=0):
+        """Fuzzy search command history
+
+        :param query: Search string.
+        :param skip: Number of better matches to skip.
+        :returns: The best matching history item after skipping ``skip``
+        better matches, or ``None`` if there is no such item.
+        """
+        limit = (skip // 10 + 1) * 10
+        items = self.text_commander.history.search(query, limit)
+        return items[skip] if skip < len(items) else None
+
     def message(self, text, exc_info=None, msg_type=const.ERROR):
         if exc_info:
             if isinstance(exc_info, (int, bool)):
@@ -167,6 +194,7 @@ class CommandBar(object):
             view.message(msg, msg_type=msg_type)
 
     def reset(self):
+        self.found_command = None
         view, self.history_view = self.history_view, None
         if view is not None:
             self.text_commander.history.discard_view(view)
@@ -179,9 +207,13 @@ class TextCommandController(object):
         self.tagger = count()
         self.commands = commands = {}
         self.commands_by_path = bypath = defaultdict(list)
+        self.aliases = AliasTrie()
         self.lookup_full_commands = []
+        self.full_command_index = {}
+        self.full_command_matches = {}
         self.input_handlers = {}
         self.editems = editems = {}
+        self.profiler = CommandProfiler()
 #         ntc = menu.itemAtIndex_(1) # New Text Command menu item
 #         ntc.setTarget_(self)
 #         ntc.setAction_("newTextCommand:")
@@ -191,12 +223,37 @@ class TextCommandController(object):
     def lookup(self, alias):
         return self.commands.get(alias)
 
+    def parse(self, text):
+        """Parse a command line
+
+        :param text: Command text with the same syntax as the command bar.
+        :returns: A tuple ``(command, args)``.
+        :raises: ``CommandError`` if the command is not found or its
+        arguments cannot be parsed.
+        """
+        cmdstr, space, argstr = text.lstrip(" ").partition(" ")
+        command = self.lookup(cmdstr)
+        if command is not None:
+            try:
+                args = command.arg_parser.parse(argstr)
+            except ArgumentError as err:
+                raise CommandError(str(err))
+            except Exception:
+                log.warn('cannot parse command: %s', text, exc_info=True)
+                raise CommandError('argument parse error: {}'.format(argstr))
+        else:
+            argstr = text
+            command, args = self.lookup_full_command(argstr)
+            if command is None:
+                raise CommandError('unknown command: {}'.format(argstr))
+        if args is None:
+            raise CommandError('invalid command arguments: {}'.format(argstr))
+        return command, args
+
     def lookup_full_command(self, command_text, full_parse=True):
+        if not full_parse:
+            return self.match_full_command(command_text), None
         for command in self.lookup_full_commands:
-            if not full_parse:
-                if command.arg_parser.match(command_text):
-                    return command, None
-                continue
             try:
                 args = command.arg_parser.parse(command_text)
             except ArgumentError as err:
@@ -207,6 +264,69 @@ class TextCommandController(object):
             return command, args
         return None, None
 
+    def match_full_command(self, command_text):
+        """Find the first full-lookup command whose arguments match text
+
+        Results are cached by command text. A command that matched a
+        prefix of the given text ending with a space is not matched
+        again if its first argument consumed a complete token in that
+        prefix; only commands that take precedence over it are checked.
+
+        :returns: The matched command or ``None``.
+        """
+        matches = self.full_command_matches
+        try:
+            return matches[command_text][0]
+        except KeyError:
+            pass
+        if len(matches) > MAX_CACHED_MATCHES:
+            matches.clear()
+        candidates = self.get_full_command_candidates(command_text[:1])
+        end = command_text.rfind(" ")
+        while end >= 0:
+            match = matches.get(command_text[:end + 1])
+            if match is not None and match[1]:
+                command, terminated, i = match
+                if not any(c.arg_parser.match(command_text)
+                           for j, c in candidates if j < i):
+                    matches[command_text] = match
+                    return command
+                break
+            end = command_text.rfind(" ", 0, end)
+        for i, command in candidates:
+            matched, terminated = command.arg_parser.match_token(command_text)
+            if matched:
+                matches[command_text] = (command, terminated, i)
+                return command
+        matches[command_text] = (None, False, len(self.lookup_full_commands))
+        return None
+
+    def get_full_command_candidates(self, char):
+        """Get full-lookup commands that may match text starting with char
+
+        Commands are indexed by the character classes that the first
+        argument of their parser may begin with (see
+        ``Field.get_start_chars``), so commands that cannot match are
+        not tried at all.
+
+        :param char: The first character of the command text or an
+        empty string if the text is empty.
+        :returns: A list of ``(<priority>, <command>)`` pairs in order of
+        priority (lowest first).
+        """
+        key = char_class(char) if char else ""
+        try:
+            return self.full_command_index[key]
+        except KeyError:
+            pass
+        candidates = []
+        for i, command in enumerate(self.lookup_full_commands):
+            chars = command.arg_parser.get_start_chars()
+            if not key or chars is None or key in chars:
+                candidates.append((i, command))
+        self.full_command_index[key] = candidates
+        return candidates
+
     def get_completions(self, text, index):
         # TODO implement this
         return []
@@ -236,6 +356,8 @@ class TextCommandController(object):
             self.commands[tag] = command
         if command.lookup_with_arg_parser:
             self.lookup_full_commands.insert(0, command)
+            self.full_command_index.clear()
+            self.full_command_matches.clear()
         if command.names:
             for alias in command.names:
                 if not isinstance(alias, str) or ' ' in alias:
@@ -243,6 +365,7 @@ class TextCommandController(object):
                         alias, command, path)
                 else:
                     self.commands[alias] = command
+                    self.aliases[alias] = command
 
     def validate_hotkey(self, value):
         if value is not None:
@@ -264,7 +387,8 @@ class TextCommandController(object):
         command = self.commands.get(sender.tag())
         if command is not None:
             try:
-                command(textview, sender, None)
+                with self.profiler.measure(command.name, MENU, textview):
+                    command(textview, sender, None)
             except Exception:
                 log.error("%s.execute failed", type(command).__name__, exc_info=True)
 
@@ -273,11 +397,56 @@ class TextCommandController(object):
         callback = self.input_handlers.get(selector)
         if callback is not None:
             try:
-                callback(textview, None, None)
+                with self.profiler.measure(selector, INPUT, textview):
+                    callback(textview, None, None)
                 return True
             except Exception:
                 log.error("%s failed", callback, exc_info=True)
         return False
 
 
+class AliasTrie(object):
+    """Prefix tree of command aliases
+
+    Each node is a dict mapping characters to child nodes. The command
+    for an alias ending at a node is stored under the ``None`` key.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def __setitem__(self, name, command):
+        node = self.root
+        for char in name:
+            node = node.setdefault(char, {})
+        node[None] = command
+
+    def get(self, name, default=None):
+        node = self._find(name)
+        if node is None:
+            return default
+        return node.get(None, default)
+
+    def _find(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def iter_names(self, prefix=""):
+        """Iterate aliases starting with prefix in sorted order"""
+        node = self._find(prefix)
+        if node is None:
+            return
+        stack = [(prefix, node)]
+        while stack:
+            name, node = stack.pop()
+            if None in node:
+                yield name
+            stack.extend((name + char, node[char]) for char in
+                sorted((c for c in node if c is not None), reverse=True))
+
+
 CommandHistory = History
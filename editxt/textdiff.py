@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# EditXT
+# Copyright 2007-2013 Daniel Miller <millerdev@gmail.com>
+#
+# This file is part of EditXT, a programmer's text editor for Mac OS X,
+# which can be found at http://editxt.org/.
+#
+# EditXT is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# EditXT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with EditXT.  If not, see <http://www.gnu.org/licenses/>.
+"""Line-oriented text differencing
+
+The functions in this module compute a minimal set of edits that will
+transform one text into another. They are used to apply external changes
+to a document without replacing its entire content.
+"""
+import logging
+
+from editxt.command.util import iterlines
+
+log = logging.getLogger(__name__)
+
+# Maximum number of line edits computed with the Myers algorithm. Larger
+# changes are reported as a single hunk covering the changed region,
+# which bounds the time and memory (O(D^2)) spent computing the diff.
+MAX_EDITS = 1000
+
+
+def diff_lines(a, b, max_edits=MAX_EDITS):
+    """Compute changed regions between two sequences of lines
+
+    Lines that are common to the beginning and end of both sequences
+    are trimmed before running the Myers O(ND) difference algorithm on
+    the remainder. Lines are interned as integers to make comparisons
+    cheap, and lines that only exist in one of the sequences are removed
+    from consideration since they can never be part of a match.
+
+    :param a: Sequence of (hashable) old lines.
+    :param b: Sequence of (hashable) new lines.
+    :param max_edits: Maximum number of edits to compute. A single
+        hunk spanning the entire changed region is returned if the
+        sequences differ by more than this number of line edits.
+    :returns: A list of `(a_start, a_end, b_start, b_end)` tuples. Each
+        tuple means that `a[a_start:a_end]` should be replaced with
+        `b[b_start:b_end]`. Hunks are ordered from first to last.
+    """
+    lo = 0
+    a_hi = len(a)
+    b_hi = len(b)
+    while lo < a_hi and lo < b_hi and a[lo] == b[lo]:
+        lo += 1
+    while a_hi > lo and b_hi > lo and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+    if lo == a_hi and lo == b_hi:
+        return []
+    if lo == a_hi or lo == b_hi:
+        return [(lo, a_hi, lo, b_hi)]
+
+    ids = {}
+    x = [ids.setdefault(line, len(ids)) for line in a[lo:a_hi]]
+    y = [ids.setdefault(line, len(ids)) for line in b[lo:b_hi]]
+    in_x = set(x)
+    in_y = set(y)
+    x_index = [i for i, line in enumerate(x) if line in in_y]
+    y_index = [j for j, line in enumerate(y) if line in in_x]
+    matches = _myers_matches(
+        [x[i] for i in x_index], [y[j] for j in y_index], max_edits)
+    if matches is None:
+        return [(lo, a_hi, lo, b_hi)]
+
+    hunks = []
+    i = j = 0
+    matches.append((len(x_index), len(y_index)))
+    x_index.append(len(x))
+    y_index.append(len(y))
+    for mi, mj in matches:
+        mi = x_index[mi]
+        mj = y_index[mj]
+        if i < mi or j < mj:
+            hunks.append((i + lo, mi + lo, j + lo, mj + lo))
+        i = mi + 1
+        j = mj + 1
+    return hunks
+
+
+def _myers_matches(x, y, max_edits):
+    """Find the longest common subsequence of x and y
+
+    :returns: A list of matched index pairs `(i, j)` where `x[i] == y[j]`
+        or `None` if `x` and `y` differ by more than `max_edits` edits.
+    """
+    n = len(x)
+    m = len(y)
+    max_d = n + m
+    if max_edits is not None and max_edits < max_d:
+        max_d = max_edits
+    v = {1: 0}
+    trace = []
+    for d in range(max_d + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                i = v[k + 1]
+            else:
+                i = v[k - 1] + 1
+            j = i - k
+            while i < n and j < m and x[i] == y[j]:
+                i += 1
+                j += 1
+            v[k] = i
+            if i >= n and j >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(trace, i, j):
+    matches = []
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = i - j
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_i = v[prev_k]
+        prev_j = prev_i - prev_k
+        while i > prev_i and j > prev_j:
+            i -= 1
+            j -= 1
+            matches.append((i, j))
+        i = prev_i
+        j = prev_j
+    while i > 0 and j > 0:
+        i -= 1
+        j -= 1
+        matches.append((i, j))
+    matches.reverse()
+    return matches
+
+
+def diff_text(old, new, max_edits=MAX_EDITS):
+    """Compute a minimal list of edits that transform old text into new
+
+    Changed lines are found with `diff_lines`, and then each changed
+    region is narrowed to exclude characters that are common to the
+    beginning and end of the old and new text in that region.
+
+    :param old: The old text.
+    :param new: The new text.
+    :returns: A list of `((<start>, <length>), <replacement string>)`
+        tuples, which are ranges in the old text paired with the text
+        that should replace them. Edits are ordered from first to last,
+        so they should be applied in reverse order to keep the ranges
+        of earlier edits valid.
+    """
+    a = list(iterlines(old)) if old else []
+    b = list(iterlines(new)) if new else []
+    edits = []
+    offset = 0
+    a_pos = 0
+    for a_start, a_end, b_start, b_end in diff_lines(a, b, max_edits):
+        offset += sum(len(line) for line in a[a_pos:a_start])
+        before = "".join(a[a_start:a_end])
+        after = "".join(b[b_start:b_end])
+        a_pos = a_end
+        start = 0
+        end = min(len(before), len(after))
+        while start < end and before[start] == after[start]:
+            start += 1
+        old_end = len(before)
+        new_end = len(after)
+        while old_end > start and new_end > start \
+                and before[old_end - 1] == after[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+        edits.append(((offset + start, old_end - start), after[start:new_end]))
+        offset += len(before)
+    return edits
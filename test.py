@@ -105,6 +105,338 @@ for i, trial in enumerate(trials):
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 '''
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# paragraph reflow: previous wraplines/get_line (string concatenation and
+# character scans) vs wraplines greedy and optimal on one long line (40k and
+# 200k words) and on 12 word lines (40k words)
+
+init = """
+import random, re
+from editxt.command.wraplines import wraplines
+from editxt.command.parser import Options
+def get_line(frag, lines, width, regexp, ws=" \\\\t"):
+    # previous implementation (first word found with a regex match)
+    while True:
+        while len(frag) < width:
+            try:
+                line = regexp.sub("", next(lines).rstrip(), 1)
+            except StopIteration:
+                return frag, None
+            if not line:
+                return frag, None
+            frag = frag + " " + line if frag else line
+        if len(frag) == width:
+            return frag, ""
+        for i in range(width, 0, -1):
+            if frag[i] in ws:
+                break
+        else:
+            fraglen = len(frag)
+            i = width + 1
+            while i < fraglen and frag[i] not in ws:
+                i += 1
+        line, frag = frag[:i].rstrip(), frag[i:].lstrip()
+        if len(line) + len(re.match(r"[^ \\\\t]*", frag).group()) < width:
+            frag = line + " " + frag
+            continue
+        return line, frag
+def old_wrap(lines, width=72):
+    lines = iter(lines)
+    frag = next(lines)
+    output = []
+    while frag is not None:
+        line, frag = get_line(frag, lines, width, re.compile(r"[ \\\\t]*"))
+        output.append(line)
+    return output
+random.seed(0)
+words = [("x" * random.randint(1, 10)) for i in range(40000)]
+long_line = [" ".join(words)]
+huge_line = [" ".join(words * 5)]
+short_lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+class textview:
+    class doc_view:
+        class document:
+            comment_token = "#"
+greedy = Options(wrap_column=72, indent=True, optimal=False)
+optimal = Options(wrap_column=72, indent=True, optimal=True)
+"""
+
+trials = [
+
+'old_wrap(long_line)',
+'list(wraplines(long_line, greedy, textview))',
+'list(wraplines(long_line, optimal, textview))',
+'old_wrap(huge_line)',
+'list(wraplines(huge_line, greedy, textview))',
+'old_wrap(short_lines)',
+'list(wraplines(short_lines, greedy, textview))',
+'list(wraplines(short_lines, optimal, textview))',
+
+]
+n = 3
+
+# trial 0: 0.229669563000
+# trial 1: 0.079152605000
+# trial 2: 0.710645299000
+# trial 3: 9.167927018000
+# trial 4: 0.433595763000
+# trial 5: 0.058591038000
+# trial 6: 0.081720574000
+# trial 7: 0.522176431000
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# line splitting: regex finditer vs iterlines (blocks + str.splitlines) vs
+# line_offsets on typical code (60k lines), long lines (200 x 5000 chars) and
+# CRLF line endings
+
+init = """
+import re
+from editxt.command.util import iterlines, line_offsets
+splitter = re.compile("([^\\n\\r\\u2028]*(?:\\r\\n|\\n|\\r|\\u2028)?)")
+def regex_iterlines(text):
+    for line in splitter.finditer(text):
+        if line.group():
+            yield line.group()
+code = "    def method(self, arg):\\n        return self.value + arg  # comment\\n\\n" * 20000
+long = ("x" * 5000 + "\\n") * 200
+crlf = code.replace("\\n", "\\r\\n")
+"""
+
+trials = [
+
+'list(regex_iterlines(code))',
+'list(iterlines(code))',
+'line_offsets(code)',
+'list(regex_iterlines(long))',
+'list(iterlines(long))',
+'line_offsets(long)',
+'list(regex_iterlines(crlf))',
+'list(iterlines(crlf))',
+'line_offsets(crlf)',
+
+]
+n = 10
+
+# trial 0: 1.254004066000
+# trial 1: 0.210159917000
+# trial 2: 0.276332334000
+# trial 3: 0.164007677000
+# trial 4: 0.023619475000
+# trial 5: 0.022947206000
+# trial 6: 1.306447275000
+# trial 7: 0.230705195000
+# trial 8: 0.300047487000
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# numeric sort (200k lines): (number, text) tuple keys vs float array + two
+# stable passes (sort_order), and sort + unique
+
+init = """
+import random
+from editxt.command.sortlines import (SortKey, SortOptions, sort_order,
+    iter_unique, NUMERIC)
+random.seed(0)
+lines = ["{} item{}\\n".format(random.randint(0, 50000), i % 7)
+         for i in range(200000)]
+key = SortKey(SortOptions(order=NUMERIC))
+def tuple_sort():
+    return sorted(lines, key=key)
+def array_sort():
+    keys, order = sort_order(lines, key)
+    return [lines[i] for i in order]
+def unique():
+    keys, order = sort_order(lines, key)
+    return list(iter_unique((keys[i], lines[i]) for i in order))
+"""
+
+trials = [
+
+'tuple_sort()',
+'array_sort()',
+'unique()',
+
+]
+n = 3
+
+# trial 0: 3.489780175999
+# trial 1: 3.268873162000
+# trial 2: 3.961732179999
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# sort lines: in-memory sorted vs external_sort (100k lines, 20k line runs)
+# external_sort trades time for bounded memory; it is only used for huge
+# selections (see EXTERNAL_SORT_SIZE)
+
+init = """
+import random
+from editxt.command.sortlines import SortKey, SortOptions, external_sort
+random.seed(0)
+lines = ["{} {}\\n".format(random.random(), "x" * 40) for i in range(100000)]
+key = SortKey(SortOptions(ignore_case=True))
+"""
+
+trials = [
+
+'"".join(sorted(lines, key=key))',
+'"".join(external_sort(lines, key, run_size=20000))',
+
+]
+n = 5
+
+# trial 0: 0.719124194999
+# trial 1: 1.917449093999
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# String.consume: character loop vs compiled scanner
+
+init = """
+from editxt.command.parser import String
+ESCAPES = String.ESCAPES
+
+def loop(text, index=0):
+    if text[index] not in ['"', "'"]:
+        delim = ' '
+        start = index
+    else:
+        delim = text[index]
+        start = index + 1
+    chars, esc = [], 0
+    for i, c in enumerate(text[start:]):
+        if esc:
+            esc = 0
+            try:
+                chars.append(ESCAPES[c])
+                continue
+            except KeyError:
+                chars.append('\\\\')
+        elif c == delim:
+            if delim != ' ' and text[start + i + 1:start + i + 2] == ' ':
+                start += 1
+            return ''.join(chars), start + i + 1
+        if c == '\\\\':
+            esc = 1
+        else:
+            chars.append(c)
+    return ''.join(chars), len(text)
+
+arg = String("str")
+text = "'" + "abc def ghi " * 20 + "' rest"
+escaped = "'" + "abc def\\\\'ghi " * 20 + "' rest"
+"""
+
+trials = [
+
+'loop(text)',
+'arg.consume(text, 0)',
+'loop(escaped)',
+'arg.consume(escaped, 0)',
+
+]
+n = 10000
+
+# trial 0: 0.291094071999
+# trial 1: 0.040284677000
+# trial 2: 0.314701591000
+# trial 3: 0.197461215000
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# command bar placeholder per keystroke: full re-parse vs incremental (200 cmds)
+
+init = """
+from editxt.command.parser import (CommandParser, Choice, Int, Regex,
+    String, VarArgs)
+from editxt.commands import command
+from editxt.textcommand import CommandBar, TextCommandController
+
+class menu:
+    def insertItem_atIndex_(item, tag):
+        pass
+ctl = TextCommandController([])
+def make_command(i, full=False):
+    @command(name="cmd{}".format(i), arg_parser=CommandParser(
+        Choice(('selection', True), ('all', False)),
+        Regex('regex', True),
+        Int("num"),
+        String("str"),
+        Choice(('yes', True), ('no', False)),
+        VarArgs("args", placeholder="..."),
+    ), lookup_with_arg_parser=full)
+    def cmd(textview, sender, args):
+        pass
+    return cmd
+commands = [make_command(i, i % 50 == 0) for i in range(200)]
+for cmd in commands:
+    ctl.add_command(cmd, None, menu)
+bar = CommandBar(menu, ctl)
+texts = ["cmd150 sel /abc def/ghi/i 123 'a b' yes x y z",
+         "sel /abc def/ghi/i 123 'a b' yes x y z"]
+keystrokes = [text[:i] for text in texts for i in range(len(text) + 1)]
+
+def reset():
+    bar.found_command = None
+    ctl.full_command_matches.clear()
+    for cmd in commands:
+        cmd.arg_parser.placeholder_state = None
+
+def t0():
+    for text in keystrokes:
+        reset()
+        bar.get_placeholder(text)
+
+def t1():
+    reset()
+    for text in keystrokes:
+        bar.get_placeholder(text)
+"""
+
+trials = [
+
+'t0()',
+'t1()',
+
+]
+n = 100
+
+# 86 keystrokes per trial call
+# trial 0: 0.268511912000 (31us per keystroke)
+# trial 1: 0.104280096000 (12us per keystroke)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# fuzzy history search: naive scan vs SearchIndex (100k items, typing a query)
+
+init = """
+import random
+import re
+from editxt.history import SearchIndex
+rand = random.Random(0)
+words = ["find", "sort", "wrap", "grab", "/abc/", "/def/", "80", "Abc",
+    "selection", "reverse", "i", "python", "/(\\\\w+)/", "count-occurrences"]
+items = [" ".join(rand.choice(words) for x in range(rand.randint(1, 5)))
+    for i in range(100000)]
+keystrokes = ["f", "fi", "fin", "find", "find ", "find /", "find /a", "find /ab"]
+
+def t0():
+    for query in keystrokes:
+        regex = re.compile(".*?".join(re.escape(c) for c in query))
+        found = [item for item in reversed(items) if regex.search(item)]
+
+def t1():
+    index = SearchIndex(items, 0)
+    for query in keystrokes:
+        found = index.search(query, 10)
+"""
+
+trials = [
+
+'t0()',
+'t1()',
+
+]
+n = 1
+
+# trial 0: 0.257662163000
+# trial 1: 0.073856466000 (includes ~55ms index build)
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # if [] vs if x == ['y']
 